@@ -0,0 +1,55 @@
+"""
+Numeric coercion of line items: `coerce` on each cell, like
+`extract_lines` used to, against `coerce_rows` converting each typed
+column at once. Rows have a float price, an int quantity and an untyped
+description, with ',' and '.' as decimal separators.
+
+    python benchmarks/bench_coerce.py [--rows 50000]
+"""
+
+import argparse
+import random
+
+from common import bench, report
+from invoice2data.coerce import coerce, coerce_rows
+
+TYPES = {'price': 'float', 'qty': 'int'}
+
+
+def synthetic_rows(count, decimal_separator):
+    random.seed(count)
+    thousands = ',' if decimal_separator == '.' else '.'
+    return [{'price': '$%d%s%03d%s%02d' % (random.randint(0, 99), thousands,
+                                           random.randint(0, 999), decimal_separator,
+                                           random.randint(0, 99)),
+             'qty': str(random.randint(0, 99)) if i % 10 else '',
+             'description': 'Item %d' % i}
+            for i in range(count)]
+
+
+def per_cell(rows, types, decimal_separator):
+    for row in rows:
+        for name in row.keys():
+            if name in types:
+                row[name] = coerce(row[name], types[name], decimal_separator)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=50000)
+    args = parser.parse_args()
+
+    for decimal_separator in ('.', ','):
+        rows = synthetic_rows(args.rows, decimal_separator)
+
+        def run(convert):
+            return bench(lambda: convert([dict(row) for row in rows], TYPES, decimal_separator),
+                         repeat=3)
+        report('%d rows, decimal separator %r' % (args.rows, decimal_separator), [
+            ('per cell', run(per_cell)),
+            ('by column', run(coerce_rows)),
+        ])
+
+
+if __name__ == '__main__':
+    main()
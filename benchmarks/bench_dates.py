@@ -0,0 +1,84 @@
+"""
+Date parsing for the date fields of the bundled templates: dateparser
+alone, and `parse_date` with a cold and a warm cache. Raw dates are
+generated with each template's `date_formats` and languages.
+
+    python benchmarks/bench_dates.py [--dates 20]
+"""
+
+import argparse
+import datetime
+import logging
+import random
+
+from common import bench, report
+from common import TEMPLATES_DIR
+from invoice2data import dates
+from invoice2data.template import read_templates
+
+MONTHS = {
+    'fr': ['janvier', 'fevrier', 'mars', 'avril', 'mai', 'juin', 'juillet',
+           'aout', 'septembre', 'octobre', 'novembre', 'decembre'],
+    'nl': ['januari', 'februari', 'maart', 'april', 'mei', 'juni', 'juli',
+           'augustus', 'september', 'oktober', 'november', 'december'],
+}
+
+
+def raw_dates(template, count):
+    "`count` dates written in the formats of the template."
+    random.seed(template['template_name'])
+    formats = template.options['date_formats'] or ['%d %B %Y']
+    languages = template.options['languages']
+    months = MONTHS.get(languages[0]) if languages else None
+    output = []
+    for i in range(count):
+        date = datetime.date(2014, 1, 1) + datetime.timedelta(days=random.randint(0, 1500))
+        text = date.strftime(random.choice(formats))
+        if months:
+            text = text.replace(date.strftime('%B'), months[date.month - 1])
+        output.append(text)
+    return output
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--dates', type=int, default=20, help='Dates per template.')
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    import dateparser
+
+    samples = []
+    for t in read_templates(TEMPLATES_DIR):
+        for raw in raw_dates(t, args.dates):
+            samples.append((raw, t.options['date_formats'], t.options['languages']))
+
+    for raw, formats, languages in samples:
+        assert dates.parse_date(raw, formats, languages) == dateparser.parse(
+            raw, date_formats=formats, languages=languages), raw
+
+    numeric = [s for s in samples if dates.parse_numeric(s[0], s[1])]
+    named = [s for s in samples if not dates.parse_numeric(s[0], s[1])]
+    for label, group in [('numeric formats', numeric), ('month names', named)]:
+        def with_dateparser():
+            for raw, formats, languages in group:
+                dateparser.parse(raw, date_formats=formats, languages=languages)
+
+        def cold():
+            for raw, formats, languages in group:
+                dates.clear_cache()
+                dates.parse_date(raw, formats, languages)
+
+        def warm():
+            for raw, formats, languages in group:
+                dates.parse_date(raw, formats, languages)
+
+        report('%s: %d dates' % (label, len(group)), [
+            ('dateparser', bench(with_dateparser, repeat=3)),
+            ('parse_date, cold cache', bench(cold, repeat=3)),
+            ('parse_date, warm cache', bench(warm, repeat=3)),
+        ])
+
+
+if __name__ == '__main__':
+    main()
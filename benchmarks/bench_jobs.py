@@ -0,0 +1,38 @@
+"""
+Throughput of `extract_files` with 1, 2, 4 and 8 worker processes over the
+bundled test PDFs (repeated to get a meaningful batch).
+
+    python benchmarks/bench_jobs.py [--repeat 10] [--jobs 1 2 4 8]
+"""
+
+import argparse
+import glob
+import logging
+import os
+import time
+
+from common import PDFS_DIR, TEMPLATES_DIR
+from invoice2data.batch import extract_files
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--jobs', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--folder', default=PDFS_DIR, help='Folder with PDF files.')
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    files = sorted(glob.glob(os.path.join(args.folder, '*.pdf'))) * args.repeat
+
+    print('%d files' % len(files))
+    for jobs in args.jobs:
+        start = time.time()
+        for _ in extract_files(files, [TEMPLATES_DIR], jobs=jobs):
+            pass
+        elapsed = time.time() - start
+        print('  jobs=%d  %8.2f s  %8.1f files/s' % (jobs, elapsed, len(files) / elapsed))
+
+
+if __name__ == '__main__':
+    main()
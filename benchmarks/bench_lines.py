@@ -0,0 +1,76 @@
+"""
+`extract_lines` on synthetic invoices with thousands of line items, for
+the bundled templates that have a `lines` section. "classify" is the
+regex part alone: finding the kind of each line with `LineScanner`.
+
+    python benchmarks/bench_lines.py [--lines 10000]
+"""
+
+import argparse
+import logging
+import random
+
+from common import bench, report
+from common import TEMPLATES_DIR
+from invoice2data.template import read_templates
+
+# Body of one item, per template: header line and continuation lines.
+ITEMS = {
+    'com.amazon.aws.yml': (
+        'Detail\n',
+        ['    Amazon EC2 running Linux, m3.medium Instance-hour   %(qty)d Hrs    $%(price)s',
+         '      $0.070 per On Demand Linux m3.medium Instance Hour',
+         '      %(qty)d.000 Hrs                                    $%(price)s'],
+        'VAT ** $0.00\n* May include estimated US sales tax\n'),
+    'de.qualityhosting.yml': (
+        'Contract No. CON02858\n',
+        ['      %(pos)d            %(qty)d  Small Business QualityExchange 2010'
+         '                                    %(price)s            %(price)s',
+         '',
+         '                       Grundgebuehr pro Einheit',
+         '',
+         '                           Dienst: OUDJQ_user%(pos)d',
+         '                         01.05.14-31.05.14'],
+        'Total EUR 1234,00\n'),
+}
+
+
+def synthetic_body(name, count):
+    "A text with `count` line items for the template `name`."
+    random.seed(count)
+    head, item, tail = ITEMS[name]
+    lines = []
+    for pos in range(1, count + 1):
+        values = {'pos': pos, 'qty': random.randint(1, 99),
+                  'price': '%d.%02d' % (random.randint(0, 999), random.randint(0, 99))}
+        if name == 'de.qualityhosting.yml':
+            values['price'] = values['price'].replace('.', ',')
+        lines.extend(line % values for line in item)
+    return head + '\n'.join(lines) + '\n' + tail
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--lines', type=int, default=10000,
+                        help='Approximate number of lines per invoice.')
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    templates = [t for t in read_templates(TEMPLATES_DIR) if t['template_name'] in ITEMS]
+    for t in templates:
+        name = t['template_name']
+        text = synthetic_body(name, args.lines // len(ITEMS[name][1]))
+        body = text.splitlines()
+        classify = t.line_scanner.classify
+
+        output = {}
+        t.extract_lines(text, output)
+        rows = len(output['lines'])
+        report('%s: %d lines, %d rows' % (name, text.count('\n'), rows), [
+            ('extract_lines', bench(lambda: t.extract_lines(text, {}))),
+            ('classify', bench(lambda: [classify(line) for line in body])),
+        ])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+"""
+Cost of logging in the extraction of each invoice of the corpus, from
+the text to the result: with logging disabled, with a handler at WARNING
+(a quiet application), at INFO (the command line, one summary record per
+document) and at DEBUG. Records are written to /dev/null.
+
+Regexes get a 0.1 s budget, so a slow template doesn't hide the rest.
+
+    python benchmarks/bench_logging.py [--corpus DIR]
+"""
+
+import argparse
+import logging
+import os
+
+from common import load_corpus, bench, report
+from invoice2data import budget
+from invoice2data.main import builtin_templates, extract_with_template
+
+LEVELS = [('disabled', None), ('WARNING', logging.WARNING), ('INFO', logging.INFO),
+          ('DEBUG', logging.DEBUG)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--corpus', help='Folder with .txt invoices.')
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.corpus)
+    templates = builtin_templates()
+    budget.enable(0.1)
+
+    root = logging.getLogger()
+    handler = logging.StreamHandler(open(os.devnull, 'w'))
+    handler.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+    root.addHandler(handler)
+
+    rows = {}
+    for label, level in LEVELS:
+        if level is None:
+            logging.disable(logging.CRITICAL)
+        else:
+            logging.disable(logging.NOTSET)
+            root.setLevel(level)
+        for name, text in corpus:
+            seconds = bench(lambda: extract_with_template(name[:30] + '.txt', templates, data=text),
+                            repeat=3)
+            rows.setdefault(name, []).append(('%-30s %s' % (name[:30], label), seconds))
+        rows.setdefault('total', []).append(
+            ('total %s' % label, sum(r[-1][1] for n, r in rows.items() if n != 'total')))
+
+    logging.disable(logging.CRITICAL)
+    for name, _ in corpus:
+        report(name, rows[name])
+    report('all documents', rows['total'])
+
+
+if __name__ == '__main__':
+    main()
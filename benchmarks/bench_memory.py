@@ -0,0 +1,121 @@
+"""
+Memory of the line items of a huge invoice: the default list of dicts
+against `columnar_lines`, from `extract` to the per-issuer CSV report.
+Each mode runs in a process of its own. "lines" is the size of the
+extracted `lines`, "peak" how much the maximum RSS of the process grew
+during `extract` and while writing the report.
+
+    python benchmarks/bench_memory.py [--lines 100000]
+"""
+
+import argparse
+import json
+import logging
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import timeit
+
+from bench_lines import ITEMS, synthetic_body
+from common import TEMPLATES_DIR
+from invoice2data.lines import LineItems
+from invoice2data.out_csv import IssuerCsvWriter
+from invoice2data.template import read_templates
+
+TEMPLATE = 'de.qualityhosting.yml'
+
+MODES = ('dicts', 'columns')
+
+clock = timeit.default_timer
+
+
+def max_rss():
+    "Maximum RSS of this process in MB (ru_maxrss is in KB on Linux)."
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024.0 * 1024 if sys.platform == 'darwin' else 1024)
+
+
+def deep_size(obj):
+    "Bytes of `obj` and of the containers and values it holds."
+    seen = set()
+    todo = [obj]
+    size = 0
+    while todo:
+        obj = todo.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            todo.extend(obj.keys())
+            todo.extend(obj.values())
+        elif isinstance(obj, (list, tuple)):
+            todo.extend(obj)
+        elif isinstance(obj, LineItems):
+            # The getsizeof of an array counts its buffer.
+            todo.append(obj.__dict__)
+    return size
+
+
+def measure(lines, mode):
+    logging.disable(logging.CRITICAL)
+    t = [t for t in read_templates(TEMPLATES_DIR) if t['template_name'] == TEMPLATE][0]
+    text = synthetic_body(TEMPLATE, lines // len(ITEMS[TEMPLATE][1]))
+    optimized_str = t.prepare_input(text)
+    del text
+
+    before = max_rss()
+    start = clock()
+    res = t.extract(optimized_str, columnar_lines=mode == 'columns')
+    extract_seconds = clock() - start
+    extract_peak = max_rss() - before
+    lines_size = deep_size(res['lines'])
+
+    res['title'] = 'invoice'
+    res['invoice_number'] = '1'
+    folder = tempfile.mkdtemp()
+    try:
+        start = clock()
+        with IssuerCsvWriter(folder, 'utf-8') as writer:
+            writer.write(res)
+        write_seconds = clock() - start
+    finally:
+        shutil.rmtree(folder)
+    return {
+        'rows': len(res['lines']),
+        'lines_mb': lines_size / 2.0 ** 20,
+        'extract_peak_mb': extract_peak,
+        'peak_mb': max_rss() - before,
+        'extract_seconds': extract_seconds,
+        'write_seconds': write_seconds,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--lines', type=int, default=100000,
+                        help='Approximate number of lines of the invoice.')
+    parser.add_argument('--mode', choices=MODES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        # In the child process.
+        print(json.dumps(measure(args.lines, args.mode)))
+        return
+
+    results = [(mode, json.loads(subprocess.check_output(
+        [sys.executable, __file__, '--lines', str(args.lines), '--mode', mode])))
+        for mode in MODES]
+    print('%s: %d lines, %d rows' % (TEMPLATE, args.lines, results[0][1]['rows']))
+    print('  %-8s %10s %14s %10s %12s %10s' % (
+        'mode', 'lines MB', 'extract peak', 'peak MB', 'extract ms', 'csv ms'))
+    for mode, result in results:
+        print('  %-8s %10.1f %14.1f %10.1f %12.0f %10.0f' % (
+            mode, result['lines_mb'], result['extract_peak_mb'], result['peak_mb'],
+            result['extract_seconds'] * 1000, result['write_seconds'] * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+"""
+Cost of finding the template of each invoice with the bundled templates
+behind many synthetic ones: in the original order, with the hit counts
+of a first pass over the corpus, and with the issuer as hint.
+
+    python benchmarks/bench_order.py [--corpus DIR] [--synthetic N]
+"""
+
+import argparse
+import logging
+from collections import Counter
+
+from common import load_corpus, synthetic_templates, bench, report
+from common import TEMPLATES_DIR
+from invoice2data.index import TemplateIndex
+from invoice2data.main import match_template
+from invoice2data.template import read_templates
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--corpus', help='Folder with .txt invoices.')
+    parser.add_argument('--synthetic', type=int, default=500)
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    corpus = load_corpus(args.corpus)
+    templates = synthetic_templates(read_templates(TEMPLATES_DIR), args.synthetic)
+    templates += read_templates(TEMPLATES_DIR)
+
+    fixed = TemplateIndex(templates)
+    adaptive = TemplateIndex(templates, hits=Counter())
+    issuers = {}
+    for name, text in corpus:
+        t, optimized_str = match_template(fixed, text)
+        if t is not None:
+            adaptive.add_hit(t)
+            issuers[name] = t['issuer']
+
+    rows = []
+    for name, text in corpus:
+        hint = issuers.get(name)
+        rows.append((name[:30] + ' fixed', bench(lambda: match_template(fixed, text), number=20)))
+        rows.append((name[:30] + ' adaptive', bench(lambda: match_template(adaptive, text), number=20)))
+        rows.append((name[:30] + ' hint', bench(lambda: match_template(fixed, text, hint), number=20)))
+    report('Templates: %d' % len(templates), rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+"""
+Throughput of `extract_files` in one process, with pdftotext run ahead
+on the next 0, 1, 2 and 4 files, over the bundled test PDFs (repeated).
+`--synthetic` adds templates that never match, for more regex work per
+file to overlap with pdftotext.
+
+    python benchmarks/bench_prefetch.py [--repeat 10] [--prefetch 0 1 2 4] [--synthetic 500]
+"""
+
+import argparse
+import glob
+import logging
+import os
+import shutil
+import tempfile
+import time
+
+from common import PDFS_DIR, TEMPLATES_DIR, synthetic_templates, write_templates
+from invoice2data.batch import extract_files
+from invoice2data.template import read_templates
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--prefetch', type=int, nargs='+', default=[0, 1, 2, 4])
+    parser.add_argument('--synthetic', type=int, default=0)
+    parser.add_argument('--folder', default=PDFS_DIR, help='Folder with PDF files.')
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    files = sorted(glob.glob(os.path.join(args.folder, '*.pdf'))) * args.repeat
+    folders = [TEMPLATES_DIR]
+    if args.synthetic:
+        folders.insert(0, tempfile.mkdtemp(prefix='invoice2data-bench'))
+        write_templates(synthetic_templates(read_templates(TEMPLATES_DIR), args.synthetic),
+                        folders[0])
+
+    try:
+        print('%d files, %d synthetic templates' % (len(files), args.synthetic))
+        for prefetch in args.prefetch:
+            start = time.time()
+            for _ in extract_files(files, folders, prefetch=prefetch):
+                pass
+            elapsed = time.time() - start
+            print('  prefetch=%d  %8.2f s  %8.1f files/s' % (prefetch, elapsed,
+                                                             len(files) / elapsed))
+    finally:
+        if args.synthetic:
+            shutil.rmtree(folders[0], ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
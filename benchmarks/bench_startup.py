@@ -0,0 +1,52 @@
+"""
+Time to load the bundled templates in a fresh process: parsing every .yml
+with the pure Python loader, with libyaml's loader, and from a warm
+template cache.
+
+    python benchmarks/bench_startup.py
+"""
+
+import shutil
+import subprocess
+import sys
+import tempfile
+
+from common import ROOT, TEMPLATES_DIR, report
+
+SNIPPET = '''
+import time, yaml
+from invoice2data import utils, template
+if %(pure)r:
+    template.ordered_load = lambda s: utils.ordered_load(s, Loader=yaml.Loader)
+start = time.time()
+template.read_templates(%(folder)r, cache_folder=%(cache)r)
+print(time.time() - start)
+'''
+
+
+def load_time(pure=False, cache=None, repeat=5):
+    "Best time of `read_templates` over `repeat` fresh interpreters."
+    code = SNIPPET % {'pure': pure, 'folder': TEMPLATES_DIR, 'cache': cache}
+    times = []
+    for _ in range(repeat):
+        out = subprocess.check_output([sys.executable, '-c', code], cwd=ROOT)
+        times.append(float(out.strip()))
+    return min(times)
+
+
+def main():
+    cache = tempfile.mkdtemp()
+    try:
+        rows = [
+            ('pure Python loader', load_time(pure=True)),
+            ('libyaml loader', load_time()),
+        ]
+        load_time(cache=cache, repeat=1)
+        rows.append(('warm template cache', load_time(cache=cache)))
+    finally:
+        shutil.rmtree(cache)
+    report('read_templates, bundled templates', rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+"""
+Per-invoice cost of trying all templates against a text: once with the
+bundled templates and once with 500 extra synthetic templates in front.
+Each set is timed looping over all templates and through `TemplateIndex`.
+
+    python benchmarks/bench_templates.py [--corpus DIR]
+"""
+
+import argparse
+import logging
+
+from common import load_corpus, synthetic_templates, bench, report
+from common import TEMPLATES_DIR
+from invoice2data.index import TemplateIndex
+from invoice2data.template import read_templates
+
+
+def match_and_extract(text, templates):
+    "Same loop as `extract_data`, minus the text extraction."
+    for t in templates:
+        optimized_str = t.prepare_input(text)
+        if t.matches_input(optimized_str):
+            return t.extract(optimized_str)
+    return False
+
+
+def match_and_extract_indexed(text, index):
+    "Same loop as `extract_data`, with the keyword index."
+    for t, optimized_str in index.candidates(text):
+        if t.matches_input(optimized_str):
+            return t.extract(optimized_str)
+    return False
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--corpus', help='Folder with .txt invoices.')
+    parser.add_argument('--synthetic', type=int, default=500)
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    corpus = load_corpus(args.corpus)
+    bundled = read_templates(TEMPLATES_DIR)
+    many = synthetic_templates(bundled, args.synthetic) + bundled
+
+    for label, templates in [('bundled (%d)' % len(bundled), bundled),
+                             ('synthetic (%d)' % len(many), many)]:
+        index = TemplateIndex(templates)
+        rows = []
+        for name, text in corpus:
+            rows.append((name[:32] + ' linear', bench(lambda: match_and_extract(text, templates))))
+            rows.append((name[:32] + ' index', bench(lambda: match_and_extract_indexed(text, index))))
+        report('Templates: %s' % label, rows)
+
+
+if __name__ == '__main__':
+    main()
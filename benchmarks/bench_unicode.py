@@ -0,0 +1,60 @@
+"""
+`replace_unicode_characters` on large multi-page invoices, compared to the
+previous implementation (one regex pass per entry of UTF_MAP).
+
+    python benchmarks/bench_unicode.py [--corpus DIR] [--pages 1 10 100]
+"""
+
+import argparse
+import glob
+import logging
+import os
+import re
+
+from common import PDFS_DIR, bench, report
+from invoice2data import in_pdftotext as pdftotext
+from invoice2data.unicode import UTF_MAP, replace_unicode_characters
+
+
+def legacy_asciify(text):
+    "The regex-per-character implementation, for comparison."
+    uni_string = text.decode('utf-8')
+    try:
+        return uni_string.encode('ascii')
+    except UnicodeEncodeError:
+        for key, val in UTF_MAP.items():
+            uni_string = re.sub(key, val, uni_string)
+        return uni_string.encode('ascii', 'ignore')
+
+
+def raw_corpus(folder=None):
+    "Raw UTF-8 text of the test PDFs or of the .txt files in `folder`."
+    if folder:
+        return [open(path, 'rb').read()
+                for path in sorted(glob.glob(os.path.join(folder, '*.txt')))]
+    return [pdftotext.to_text(path, encoding='UTF-8')
+            for path in sorted(glob.glob(os.path.join(PDFS_DIR, '*.pdf')))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--corpus', help='Folder with .txt invoices (UTF-8).')
+    parser.add_argument('--pages', type=int, nargs='+', default=[1, 10, 100])
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    corpus = raw_corpus(args.corpus)
+    for text in corpus:
+        assert replace_unicode_characters(text) == legacy_asciify(text)
+
+    page = b'\f'.join(corpus)
+    for pages in args.pages:
+        text = page * pages
+        report('%d x corpus (%d KB)' % (pages, len(text) // 1024), [
+            ('legacy', bench(lambda: legacy_asciify(text))),
+            ('replace_unicode_characters', bench(lambda: replace_unicode_characters(text))),
+        ])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+"""
+Helpers shared by the benchmark scripts in this folder.
+
+Run the scripts from the repository root, e.g.
+`python benchmarks/bench_templates.py`.
+"""
+
+import os
+import sys
+import glob
+import copy
+import json
+import timeit
+from collections import OrderedDict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from invoice2data import in_pdftotext as pdftotext
+from invoice2data.template import InvoiceTemplate
+from invoice2data.unicode import replace_unicode_characters
+
+TEMPLATES_DIR = os.path.join(ROOT, 'invoice2data', 'templates')
+PDFS_DIR = os.path.join(ROOT, 'invoice2data', 'test', 'pdfs')
+
+
+def load_corpus(folder=None):
+    """
+    Return a list of (name, text) with the already normalized text of
+    the bundled test PDFs, or of the .txt files in `folder`.
+    """
+    corpus = []
+    if folder:
+        for path in sorted(glob.glob(os.path.join(folder, '*.txt'))):
+            with open(path) as f:
+                text = f.read()
+            corpus.append((os.path.basename(path), replace_unicode_characters(text)))
+    else:
+        for path in sorted(glob.glob(os.path.join(PDFS_DIR, '*.pdf'))):
+            text = pdftotext.to_text(path)
+            corpus.append((os.path.basename(path), replace_unicode_characters(text)))
+    return corpus
+
+
+def synthetic_templates(templates, count):
+    """
+    Derive `count` templates from the given ones. They get unique keywords
+    and patterns so they never match and don't share compiled regexes.
+    """
+    output = []
+    for i in range(count):
+        tpl = copy.deepcopy(OrderedDict(templates[i % len(templates)].items()))
+        tpl['template_name'] = 'synthetic-%d.yml' % i
+        tpl['keywords'] = ['Synthetic Vendor %d' % i, r'VAT\s+ID\s+XX%08d' % i]
+        tpl['issuer'] = 'Synthetic Vendor %d' % i
+        for k, v in tpl['fields'].items():
+            if k.startswith('static_'):
+                continue
+            if type(v) is list:
+                tpl['fields'][k] = ['%s(?:#%d)?' % (v_option, i) for v_option in v]
+            else:
+                tpl['fields'][k] = '%s(?:#%d)?' % (v, i)
+        output.append(InvoiceTemplate(tpl))
+    return output
+
+
+def write_templates(templates, folder):
+    "Write templates as .yml files to `folder`, eg. synthetic ones."
+    import yaml
+    for t in templates:
+        # Plain dicts and lists for `safe_dump`.
+        tpl = json.loads(json.dumps(dict((k, v) for k, v in t.items() if k != 'template_name')))
+        with open(os.path.join(folder, t['template_name']), 'w') as f:
+            yaml.safe_dump(tpl, f)
+
+
+def bench(func, repeat=5, number=1):
+    "Best wall time of `func` in seconds."
+    return min(timeit.repeat(func, repeat=repeat, number=number)) / number
+
+
+def report(title, rows):
+    "Print a small table of (label, seconds) rows."
+    print(title)
+    for label, seconds in rows:
+        print('  %-40s %10.3f ms' % (label, seconds * 1000))
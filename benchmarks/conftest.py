@@ -0,0 +1,22 @@
+"""
+Lets `pytest benchmarks/stages.py` run without pytest-benchmark, each
+stage once, as a smoke test.
+"""
+
+import logging
+
+import pytest
+
+try:
+    import pytest_benchmark  # noqa: F401
+except ImportError:
+    @pytest.fixture
+    def benchmark():
+        return lambda func, *args, **kwargs: func(*args, **kwargs)
+
+
+@pytest.fixture(autouse=True)
+def quiet_logging():
+    logging.disable(logging.CRITICAL)
+    yield
+    logging.disable(logging.NOTSET)
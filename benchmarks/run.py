@@ -0,0 +1,218 @@
+"""
+Runs the stage benchmarks of `stages.py` and end to end scenarios, and
+appends the results to a JSON history, so the numbers of two commits can
+be compared.
+
+    python benchmarks/run.py [--scale 4] [--filter extract] [--compare [COMMIT]]
+
+The scenarios run `extract_files` on the bundled PDFs, and on the same
+PDFs with the synthetic templates in a template folder. Each benchmark
+is run for about `--seconds`, at least `--rounds` times, and its min,
+median and max are kept. `--compare` prints the change against the last
+entry of another commit (or of COMMIT) and exits with 1 if a benchmark
+got slower than `--threshold`.
+"""
+
+from __future__ import print_function
+
+import argparse
+import datetime
+import json
+import logging
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import timeit
+import unittest
+
+import stages
+from common import ROOT, TEMPLATES_DIR, synthetic_templates, write_templates
+from invoice2data.batch import extract_files
+
+HISTORY = os.path.join(ROOT, '.benchmarks', 'history.json')
+
+
+class Timer(object):
+    """
+    Stand-in for the `benchmark` fixture of pytest-benchmark: runs `func`
+    `rounds` times or until `seconds` are spent, and keeps the timings.
+    """
+
+    def __init__(self, rounds=5, seconds=1.0):
+        self.rounds = rounds
+        self.seconds = seconds
+        self.times = []
+
+    def __call__(self, func, *args, **kwargs):
+        result = None
+        spent = 0.0
+        while len(self.times) < self.rounds or spent < self.seconds:
+            start = timeit.default_timer()
+            result = func(*args, **kwargs)
+            self.times.append(timeit.default_timer() - start)
+            spent += self.times[-1]
+            if len(self.times) >= 1000:
+                break
+        return result
+
+    def stats(self):
+        times = sorted(self.times)
+        return {'min': times[0], 'median': times[len(times) // 2], 'max': times[-1],
+                'rounds': len(times)}
+
+
+def scenario_extract_pdfs(benchmark):
+    "`extract_files` on the bundled PDFs, with the bundled templates."
+    stages.require_pdftotext()
+    files = stages.pdfs()
+    benchmark(lambda: list(extract_files(files, [TEMPLATES_DIR])))
+
+
+def scenario_extract_pdfs_many_templates(benchmark):
+    "Same, with the synthetic templates in a second template folder."
+    stages.require_pdftotext()
+    files = stages.pdfs()
+    folder = tempfile.mkdtemp(prefix='invoice2data-bench')
+    try:
+        write_templates(synthetic_templates(stages.templates(), stages.scaled(stages.TEMPLATES)),
+                        folder)
+        benchmark(lambda: list(extract_files(files, [TEMPLATES_DIR, folder])))
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+
+def benchmarks():
+    "(name, function) of all benchmarks, stages first."
+    found = []
+    for module, prefix in [(stages, 'test_'), (sys.modules[__name__], 'scenario_')]:
+        for name in sorted(vars(module)):
+            if name.startswith(prefix):
+                found.append((name, getattr(module, name)))
+    return found
+
+
+def run(names, rounds, seconds):
+    results = {}
+    for name, func in benchmarks():
+        if names and not any(n in name for n in names):
+            continue
+        timer = Timer(rounds, seconds)
+        try:
+            func(timer)
+        except unittest.SkipTest as e:
+            print('%-40s skipped: %s' % (name, e))
+            continue
+        results[name] = timer.stats()
+        print('%-40s %10.3f ms  (%d rounds)' % (name, results[name]['min'] * 1000,
+                                                results[name]['rounds']))
+    return results
+
+
+def git_commit():
+    "Commit of the tree, with `+dirty` if it has uncommitted changes."
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=ROOT).decode().strip()
+        status = subprocess.check_output(['git', 'status', '--porcelain', '--untracked-files=no'],
+                                         cwd=ROOT)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return commit + ('+dirty' if status.strip() else '')
+
+
+def read_history(path):
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return json.load(f)
+
+
+def write_history(path, history):
+    folder = os.path.dirname(path)
+    if folder and not os.path.isdir(folder):
+        os.makedirs(folder)
+    with open(path, 'w') as f:
+        json.dump(history, f, indent=2, sort_keys=True)
+
+
+def find_baseline(history, commit, ref=None):
+    "Last entry of commit `ref` (a prefix), or of another commit than `commit`."
+    for entry in reversed(history):
+        if ref and (entry['commit'] or '').startswith(ref):
+            return entry
+        if not ref and entry['commit'] != commit:
+            return entry
+    return None
+
+
+def compare(baseline, entry, threshold):
+    """
+    Print the change of the min time of each benchmark of `entry`.
+
+    Returns:
+        list[str]: benchmarks slower than `threshold` (0.1 for 10 %)
+    """
+    print('\ncompared to %s (%s)' % (baseline['commit'], baseline['date']))
+    slower = []
+    for name, stats in sorted(entry['results'].items()):
+        before = baseline['results'].get(name)
+        if before is None:
+            print('  %-40s %10s' % (name, 'new'))
+            continue
+        change = stats['min'] / before['min'] - 1 if before['min'] else 0.0
+        flag = ''
+        if change > threshold:
+            slower.append(name)
+            flag = '  slower'
+        print('  %-40s %10.3f -> %10.3f ms  %+6.1f %%%s' % (
+            name, before['min'] * 1000, stats['min'] * 1000, change * 100, flag))
+    return slower
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--filter', action='append', default=[],
+                        help='Only run benchmarks whose name contains this, can be repeated.')
+    parser.add_argument('--scale', type=float, default=stages.SCALE,
+                        help='Multiply the size of the synthetic inputs.')
+    parser.add_argument('--rounds', type=int, default=5, help='Minimum runs per benchmark.')
+    parser.add_argument('--seconds', type=float, default=1.0,
+                        help='Minimum time spent per benchmark.')
+    parser.add_argument('--history', default=HISTORY, help='JSON file keeping the results.')
+    parser.add_argument('--no-save', action='store_true', help="Don't add to the history.")
+    parser.add_argument('--compare', nargs='?', const='', metavar='COMMIT',
+                        help='Compare with the last results of COMMIT, or of another commit.')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='Change above which a benchmark is flagged as slower.')
+    args = parser.parse_args(args)
+
+    logging.disable(logging.CRITICAL)
+    stages.SCALE = args.scale
+    entry = {
+        'commit': git_commit(),
+        'date': datetime.datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'scale': args.scale,
+        'results': run(args.filter, args.rounds, args.seconds),
+    }
+
+    history = read_history(args.history)
+    slower = []
+    if args.compare is not None:
+        baseline = find_baseline([e for e in history if e.get('scale') == args.scale],
+                                 entry['commit'], args.compare or None)
+        if baseline is None:
+            print('\nno results to compare with in %s' % args.history)
+        else:
+            slower = compare(baseline, entry, args.threshold)
+    if not args.no_save:
+        history.append(entry)
+        write_history(args.history, history)
+    return 1 if slower else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,227 @@
+"""
+Micro benchmarks of each extraction stage, written for pytest-benchmark:
+
+    pytest benchmarks/stages.py --benchmark-autosave
+
+Each `test_*` function gets a `benchmark` callable and times one stage,
+on the bundled PDFs and on synthetic inputs: invoices with `LINES` line
+items and `TEMPLATES` extra templates, multiplied by `SCALE` (also the
+BENCH_SCALE environment variable). `run.py` runs the same functions
+without pytest and keeps a history of the results.
+
+Inputs are built once per process. Stages needing pdftotext are skipped
+when it isn't installed.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+from distutils import spawn  # py2 compat
+
+from common import load_corpus, synthetic_templates, pdftotext, PDFS_DIR
+from common import replace_unicode_characters, TEMPLATES_DIR
+from bench_lines import ITEMS, synthetic_body
+from invoice2data.index import TemplateIndex
+from invoice2data.out_csv import InvoicesCsvWriter, IssuerCsvWriter
+from invoice2data.template import read_templates
+
+SCALE = float(os.environ.get('BENCH_SCALE', 1))
+
+# Sizes of the synthetic inputs at scale 1.
+LINES = 2000
+TEMPLATES = 500
+INVOICES = 1000
+
+_inputs = {}
+
+
+def _memo(func):
+    "Build an input once per process."
+    def wrapper():
+        if func.__name__ not in _inputs:
+            _inputs[func.__name__] = func()
+        return _inputs[func.__name__]
+    wrapper.__name__ = func.__name__
+    return wrapper
+
+
+def scaled(count):
+    return max(1, int(count * SCALE))
+
+
+def require_pdftotext():
+    if not spawn.find_executable('pdftotext'):
+        raise unittest.SkipTest('pdftotext not installed')
+
+
+@_memo
+def pdfs():
+    return sorted(os.path.join(PDFS_DIR, name) for name in os.listdir(PDFS_DIR)
+                  if name.endswith('.pdf'))
+
+
+@_memo
+def raw_texts():
+    "Output of pdftotext for the bundled PDFs, before normalizing."
+    require_pdftotext()
+    return [pdftotext.to_text(path) for path in pdfs()]
+
+
+@_memo
+def corpus():
+    require_pdftotext()
+    return load_corpus()
+
+
+@_memo
+def templates():
+    return read_templates(TEMPLATES_DIR)
+
+
+@_memo
+def many_templates():
+    bundled = templates()
+    return synthetic_templates(bundled, scaled(TEMPLATES)) + bundled
+
+
+@_memo
+def matched():
+    "(template, optimized_str) of each corpus text with a template."
+    pairs = []
+    for name, text in corpus():
+        for t in templates():
+            optimized_str = t.prepare_input(text)
+            if t.matches_input(optimized_str):
+                pairs.append((t, optimized_str))
+                break
+    return pairs
+
+
+@_memo
+def long_invoices():
+    "(template, text) with about `LINES` lines per template with `lines`."
+    output = []
+    for t in templates():
+        name = t['template_name']
+        if name in ITEMS:
+            output.append((t, synthetic_body(name, scaled(LINES) // len(ITEMS[name][1]))))
+    return output
+
+
+@_memo
+def results():
+    "`INVOICES` extraction results, repeating those of the corpus."
+    extracted = [t.extract(optimized_str) for t, optimized_str in matched()]
+    extracted = [res for res in extracted if res]
+    if not extracted:
+        raise unittest.SkipTest('no invoice of the corpus is extracted')
+    count = scaled(INVOICES)
+    return [dict(extracted[i % len(extracted)], invoice_number='%s-%d' % (
+        extracted[i % len(extracted)].get('invoice_number'), i)) for i in range(count)]
+
+
+def _in_temp_folder(func):
+    folder = tempfile.mkdtemp(prefix='invoice2data-bench')
+    try:
+        return func(folder)
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+
+def test_read_templates(benchmark):
+    benchmark(read_templates, TEMPLATES_DIR)
+
+
+def test_read_templates_cached(benchmark):
+    def run(folder):
+        read_templates(TEMPLATES_DIR, folder)
+        benchmark(read_templates, TEMPLATES_DIR, folder)
+    _in_temp_folder(run)
+
+
+def test_pdftotext(benchmark):
+    require_pdftotext()
+    benchmark(lambda: [pdftotext.to_text(path) for path in pdfs()])
+
+
+def test_load_document(benchmark):
+    "pdftotext with pdfinfo running alongside, for the title in reports."
+    require_pdftotext()
+    benchmark(lambda: [pdftotext.load_document(path) for path in pdfs()])
+
+
+def test_replace_unicode_characters(benchmark):
+    texts = raw_texts()
+    benchmark(lambda: [replace_unicode_characters(text) for text in texts])
+
+
+def test_prepare_input(benchmark):
+    texts = [text for name, text in corpus()]
+    tpls = templates()
+    benchmark(lambda: [t.prepare_input(text) for text in texts for t in tpls])
+
+
+def test_matches_input(benchmark):
+    inputs = [(t, t.prepare_input(text)) for name, text in corpus() for t in templates()]
+    benchmark(lambda: [t.matches_input(optimized_str) for t, optimized_str in inputs])
+
+
+def test_match_all_templates(benchmark):
+    "Looping over the bundled and synthetic templates, like `extract_data`."
+    texts = [text for name, text in corpus()]
+    tpls = many_templates()
+
+    def run():
+        for text in texts:
+            for t in tpls:
+                if t.matches_input(t.prepare_input(text)):
+                    break
+    benchmark(run)
+
+
+def test_match_index(benchmark):
+    "Same as `test_match_all_templates`, through `TemplateIndex`."
+    texts = [text for name, text in corpus()]
+    index = TemplateIndex(many_templates())
+
+    def run():
+        for text in texts:
+            for t, optimized_str in index.candidates(text):
+                if t.matches_input(optimized_str):
+                    break
+    benchmark(run)
+
+
+def test_extract(benchmark):
+    pairs = matched()
+    benchmark(lambda: [t.extract(optimized_str) for t, optimized_str in pairs])
+
+
+def test_extract_lines(benchmark):
+    invoices = long_invoices()
+    benchmark(lambda: [t.extract_lines(text, {}) for t, text in invoices])
+
+
+def test_invoices_csv(benchmark):
+    rows = [res for res in results() if all(k in res for k in ('date', 'desc', 'amount'))]
+
+    def run(folder):
+        def write():
+            with InvoicesCsvWriter(os.path.join(folder, 'invoices.csv')) as writer:
+                for res in rows:
+                    writer.write(res)
+        benchmark(write)
+    _in_temp_folder(run)
+
+
+def test_issuer_csv(benchmark):
+    rows = results()
+
+    def run(folder):
+        def write():
+            with IssuerCsvWriter(folder, 'utf-8') as writer:
+                for res in rows:
+                    writer.write(res)
+        benchmark(write)
+    _in_temp_folder(run)
@@ -1 +1,7 @@
+import logging
+
 from .main import extract_data
+
+# Records of all modules go to the `invoice2data` logger, silent unless the
+# application configures logging.
+logging.getLogger(__name__).addHandler(logging.NullHandler())
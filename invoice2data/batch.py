@@ -0,0 +1,371 @@
+"""
+Extract data from many invoice files, optionally in a pool of worker
+processes.
+
+Each worker loads the templates once in its initializer. Errors and
+timeouts are returned per file, so one bad file doesn't stop the batch.
+
+`extract_files` takes paths, `extract_many` also takes the content of
+files and keeps a bounded number of them in flight. In a single process,
+`extract_files` can run pdftotext ahead on the next files, see
+`invoice2data.prefetch`.
+"""
+
+import logging
+import multiprocessing
+import os
+import re
+import signal
+import timeit
+from collections import Counter, namedtuple
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from invoice2data import budget, profiling, supervise
+from invoice2data import in_pdftotext as pdftotext
+from invoice2data.index import TemplateIndex
+from invoice2data.main import extract_with_template, builtin_templates_folder
+from invoice2data.prefetch import PrefetchCache, read_ahead
+from invoice2data.template import read_templates
+
+logger = logging.getLogger(__name__)
+
+# State of the current (worker) process, set by `init_worker`.
+_worker = {}
+
+
+class ExtractResult(namedtuple('ExtractResult', ['index', 'name', 'result', 'error', 'seconds'])):
+    """
+    Result of one item of `extract_many`.
+
+    Attributes:
+        index (int): position of the item in the input
+        name (str): path or name of the item
+        result (dict): extracted data, or False
+        error (str): why the item failed, None if it didn't raise or time out
+        seconds (float): time spent on the item in the worker
+    """
+    __slots__ = ()
+
+
+class FileTimeout(Exception):
+    pass
+
+
+def _raise_timeout(signum, frame):
+    raise FileTimeout()
+
+
+def load_templates(template_folders, template_cache=None):
+    """
+    Returns:
+        list[InvoiceTemplate]: the templates of all folders, in order
+    """
+    templates = []
+    for folder in template_folders:
+        templates += read_templates(folder, cache_folder=template_cache)
+    return templates
+
+
+def init_worker(template_folders, encoding='ASCII7', timeout=None, text_cache=None,
+                template_cache=None, first_pages=None, profile=False, hits=None, hints=(),
+                regex_budget=None, ocr=None, with_title=False, command_limits=None,
+                columnar_lines=False):
+    """
+    Load templates once per process.
+
+    Args:
+        template_folders (list[str]): folders to read templates from, in order
+        encoding (str): text encoding passed to `extract_data`
+        timeout (int): seconds after which a file is given up
+        text_cache (TextCache): cache passed to `extract_data`
+        template_cache (str): folder for the parsed templates cache
+        first_pages (int): passed to `extract_data`
+        profile (bool): record timings, see `invoice2data.profiling`
+        hits (Counter): matches per template name so far, to try the most
+            frequent templates first. None keeps the template order.
+        hints (list[tuple]): (regex, template name or issuer), the first
+            regex found in a file name gives its `hint`
+        regex_budget (Budget): time budget of the template regexes, see
+            `invoice2data.budget`
+        ocr (OcrOptions): passed to `extract_data`
+        with_title (bool): read the title of each PDF along with its text
+        command_limits (Limits): timeout, memory and CPU limits of the
+            pdftotext, pdfinfo and OCR commands, see `invoice2data.supervise`
+        columnar_lines (bool): passed to `extract_data`
+    """
+    if profile:
+        profiling.enable()
+    if regex_budget:
+        budget.enable(*regex_budget)
+    if command_limits:
+        supervise.enable(*command_limits)
+    # Keep the templates of the previous batch in this process.
+    templates_key = (tuple(template_folders), template_cache)
+    if _worker.get('templates_key') != templates_key:
+        _worker['templates'] = TemplateIndex(load_templates(template_folders, template_cache))
+        _worker['templates_key'] = templates_key
+    _worker['templates'].hits = Counter(hits) if hits is not None else None
+    _worker['hints'] = [(re.compile(pattern), hint) for pattern, hint in hints]
+    _worker['encoding'] = encoding
+    _worker['timeout'] = timeout
+    _worker['text_cache'] = text_cache
+    _worker['first_pages'] = first_pages
+    _worker['ocr'] = ocr
+    _worker['with_title'] = with_title
+    _worker['columnar_lines'] = columnar_lines
+    if timeout:
+        signal.signal(signal.SIGALRM, _raise_timeout)
+
+
+def extract_file(file_name):
+    """
+    Run `extract_data` on one file with the templates of this process.
+
+    Returns:
+        tuple: (file_name, result or False, error message or None,
+            name of the template that matched or None, title of the PDF
+            or None, timings recorded for the file or None)
+    """
+    result = _extract_file(file_name)
+    profile = profiling.current()
+    return result + (profile.pop() if profile else None,)
+
+
+def file_hint(file_name):
+    """The hint for a file name, see `init_worker`."""
+    base_name = os.path.basename(file_name)
+    for pattern, hint in _worker['hints']:
+        if pattern.search(base_name):
+            return hint
+    return None
+
+
+def _extract_file(file_name, data=None):
+    logger.debug("processing file %s", file_name)
+    timeout = _worker['timeout']
+    if timeout:
+        signal.alarm(timeout)
+    info = {} if _worker['with_title'] else None
+    try:
+        t, res = extract_with_template(
+            file_name, templates=_worker['templates'], encoding=_worker['encoding'],
+            text_cache=_worker['text_cache'], first_pages=_worker['first_pages'], data=data,
+            hint=file_hint(file_name), ocr=_worker['ocr'], info=info,
+            columnar_lines=_worker['columnar_lines'])
+        return file_name, res, None, t and t['template_name'], info and info.get('Title')
+    except FileTimeout:
+        # pdftotext may still be running for this file, eg. read ahead.
+        supervise.kill_running()
+        logger.error('Timeout after %d seconds for %s', timeout, file_name)
+        return file_name, False, 'Timeout after %d seconds' % timeout, None, None
+    except Exception as err:
+        if timeout:
+            # Don't time out while logging.
+            signal.alarm(0)
+        logger.exception('Failed to process %s', file_name)
+        return file_name, False, '%s: %s' % (err.__class__.__name__, err), None, None
+    finally:
+        if timeout:
+            signal.alarm(0)
+
+
+def extract_files(files, template_folders, jobs=1, keep_order=False,
+                  encoding='ASCII7', timeout=None, text_cache=None, template_cache=None,
+                  first_pages=None, profile=None, with_template=False, hits=None, hints=(),
+                  regex_budget=None, ocr=None, with_title=False, prefetch=None,
+                  command_limits=None, columnar_lines=False):
+    """
+    Extract data from each file and yield results as soon as they are ready.
+
+    Args:
+        files (iterable[str]): paths to invoice files
+        template_folders (list[str]): folders to read templates from, in order
+        jobs (int): number of worker processes, 1 runs in this process
+        keep_order (bool): yield results in the order of `files`
+        encoding (str): text encoding passed to `extract_data`
+        timeout (int): seconds after which a file is given up
+        text_cache (TextCache): cache passed to `extract_data`
+        template_cache (str): folder for the parsed templates cache
+        first_pages (int): passed to `extract_data`
+        profile (Profile): add the timings of all processes to this profile
+        with_template (bool): add the name of the template that matched,
+            or None, to the results
+        hits (Counter): see `init_worker`
+        hints (list[tuple]): see `init_worker`
+        regex_budget (Budget): see `init_worker`
+        ocr (OcrOptions): see `init_worker`
+        with_title (bool): add the title of the PDF, or None, to the
+            results, after the template name if `with_template` is set
+        prefetch (int): with one process, run pdftotext on up to this
+            many next files while the current one is matched
+        command_limits (Limits): see `init_worker`
+        columnar_lines (bool): see `init_worker`
+
+    Yields:
+        tuple: (file_name, result or False, error message or None)
+    """
+    initargs = (template_folders, encoding, timeout, text_cache, template_cache, first_pages,
+                profile is not None, hits, hints, regex_budget, ocr, with_title, command_limits,
+                columnar_lines)
+    if jobs <= 1:
+        init_worker(*initargs)
+        if prefetch:
+            _worker['text_cache'] = PrefetchCache(text_cache)
+            files = read_ahead(files, _read_ahead, prefetch)
+        for file_name in files:
+            yield _collect(extract_file(file_name), profile, with_template, with_title)
+        return
+
+    pool = multiprocessing.Pool(jobs, initializer=init_worker, initargs=initargs)
+    try:
+        if keep_order:
+            results = pool.imap(extract_file, files)
+        else:
+            results = pool.imap_unordered(extract_file, files)
+        for result in results:
+            yield _collect(result, profile, with_template, with_title)
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def _read_ahead(file_name):
+    """Run pdftotext like `extract_data` will, to fill the `PrefetchCache`."""
+    if file_name.lower().endswith('.txt'):
+        return
+    pdftotext.load_document(file_name, _worker['encoding'], _worker['text_cache'],
+                            last_page=_worker['first_pages'], with_info=_worker['with_title'])
+
+
+def _collect(result, profile, with_template, with_title):
+    """Add the timings of a worker result to `profile`, return the result."""
+    timings = result[5]
+    if profile is not None and timings:
+        profile.merge(timings)
+    output = result[:3]
+    if with_template:
+        output += (result[3],)
+    if with_title:
+        output += (result[4],)
+    return output
+
+
+def extract_item(index, name, data):
+    """
+    Worker side of `extract_many`: run `extract_data` on a path (`data`
+    is None) or on the content of a file.
+
+    Returns:
+        ExtractResult
+    """
+    start = timeit.default_timer()
+    try:
+        file_name, res, error = _extract_file(name, data)[:3]
+    except Exception as err:
+        # Eg. the timeout of the file, just after another error.
+        res, error = False, '%s: %s' % (err.__class__.__name__, err)
+    return ExtractResult(index, name, res, error, timeit.default_timer() - start)
+
+
+def _extract_item_pickled(index, name, data):
+    """
+    `extract_item` in a pool worker, pickled here. On Python 2, a task
+    that raises, or whose result can't be pickled, never calls back
+    `extract_many`, which would then wait for it forever.
+
+    Returns:
+        bytes: the pickled ExtractResult
+    """
+    start = timeit.default_timer()
+    try:
+        return pickle.dumps(extract_item(index, name, data), pickle.HIGHEST_PROTOCOL)
+    except BaseException as err:
+        result = ExtractResult(index, name, False, '%s: %s' % (err.__class__.__name__, err),
+                               timeit.default_timer() - start)
+        return pickle.dumps(result, pickle.HIGHEST_PROTOCOL)
+
+
+def _read_item(index, item):
+    """
+    Returns:
+        tuple: (name, content or None for paths)
+    """
+    if hasattr(item, 'read'):
+        data = item.read()
+        name = getattr(item, 'name', None)
+        if not isinstance(name, str):
+            name = '<file %d>' % index
+        return name, data
+    if isinstance(item, (bytearray, memoryview)):
+        item = bytes(item)
+    if isinstance(item, bytes) and item.startswith(b'%PDF'):
+        return '<bytes %d>' % index, item
+    return item, None
+
+
+def extract_many(items, template_folders=None, jobs=1, max_pending=None, encoding='ASCII7',
+                 timeout=None, text_cache=None, template_cache=None, first_pages=None,
+                 regex_budget=None, ocr=None, command_limits=None, columnar_lines=False):
+    """
+    Extract data from a stream of invoices and yield the results as soon
+    as they are ready, in any order.
+
+    At most `max_pending` items are read ahead of the results the caller
+    consumed, so memory doesn't grow with the length of `items`. PDF
+    content is piped to pdftotext without temporary files.
+
+    Args:
+        items (iterable): paths, PDF content as bytes (starting with
+            '%PDF') or file objects opened in binary mode. Each file is
+            read in this process.
+        template_folders (list[str]): folders to read templates from, in
+            order. Defaults to the built-in templates.
+        jobs (int): number of worker processes, 1 runs in this process
+        max_pending (int): items in flight, defaults to twice `jobs`
+        encoding, timeout, text_cache, template_cache, first_pages,
+        regex_budget, ocr, command_limits, columnar_lines: see `extract_files`
+
+    Yields:
+        ExtractResult
+    """
+    if template_folders is None:
+        template_folders = [builtin_templates_folder()]
+    initargs = (template_folders, encoding, timeout, text_cache, template_cache, first_pages,
+                False, None, (), regex_budget, ocr, False, command_limits, columnar_lines)
+    if jobs <= 1:
+        init_worker(*initargs)
+        for index, item in enumerate(items):
+            name, data = _read_item(index, item)
+            yield extract_item(index, name, data)
+        return
+
+    if max_pending is None:
+        max_pending = 2 * jobs
+    done = queue.Queue()
+    pending = 0
+    pool = multiprocessing.Pool(jobs, initializer=init_worker, initargs=initargs)
+    try:
+        for index, item in enumerate(items):
+            while pending >= max_pending:
+                yield pickle.loads(done.get())
+                pending -= 1
+            name, data = _read_item(index, item)
+            pool.apply_async(_extract_item_pickled, (index, name, data), callback=done.put)
+            pending += 1
+        while pending:
+            yield pickle.loads(done.get())
+            pending -= 1
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
@@ -0,0 +1,140 @@
+"""
+Time budget for each regex of the templates.
+
+Budgets are off unless `enable` was called. A regex running longer than
+the budget raises `RegexTimeout`, and `InvoiceTemplate.extract` then
+skips the field or gives up the template, as set by `enable`.
+
+The budget is a SIGALRM timer, which also stops regexes running in C.
+It only works in the main thread on Unix: elsewhere regexes run without
+a budget. A timer already set, like the `--timeout` of each file, is
+kept and wins when it is due first.
+"""
+
+import signal
+import timeit
+from collections import namedtuple
+
+clock = timeit.default_timer
+
+ACTIONS = ('skip', 'abort')
+
+Budget = namedtuple('Budget', 'seconds action')
+
+# The `Budget` of this process, None while budgets are off.
+_current = None
+
+
+class RegexTimeout(Exception):
+    """A regex ran longer than its budget."""
+
+    def __init__(self, seconds, template=None, field=None, pattern=None):
+        Exception.__init__(self, seconds, template, field, pattern)
+        self.seconds = seconds
+        self.template = template
+        self.field = field
+        self.pattern = pattern
+
+    def __str__(self):
+        message = 'Regex of %s in template %s ran longer than %s seconds' % (
+            self.field, self.template, self.seconds)
+        if self.pattern is not None:
+            message += ': %s' % self.pattern
+        return message
+
+
+def enable(seconds, action='skip'):
+    """
+    Give each regex of the templates `seconds` in this process.
+
+    Args:
+        action (str): 'skip' the field, or 'abort' the template
+
+    Returns:
+        Budget
+    """
+    global _current
+    assert action in ACTIONS, 'Unknown action %r' % action
+    _current = Budget(seconds, action)
+    return _current
+
+
+def disable():
+    """Stop the budgets, return the `Budget` (or None)."""
+    global _current
+    budget, _current = _current, None
+    return budget
+
+
+def current():
+    return _current
+
+
+class _NullGuard(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+NULL_GUARD = _NullGuard()
+
+
+class _Guard(object):
+
+    def __init__(self, seconds, template, field, pattern):
+        self.seconds = seconds
+        self.template = template
+        self.field = field
+        self.pattern = pattern
+
+    def _raise(self, signum, frame):
+        raise RegexTimeout(self.seconds, self.template, self.field, self.pattern)
+
+    def __enter__(self):
+        self.start = clock()
+        try:
+            self.outer_handler = signal.signal(signal.SIGALRM, self._raise)
+        except ValueError:
+            # Not in the main thread.
+            self.outer_handler = False
+            return self
+        self.outer_delay = signal.setitimer(signal.ITIMER_REAL, self.seconds)[0]
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.outer_handler is False:
+            return False
+        try:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+        finally:
+            # Even if the timer fired right after the body.
+            signal.signal(signal.SIGALRM, self.outer_handler or signal.SIG_DFL)
+            if self.outer_delay:
+                # Give the outer timer what is left, and fire it right away
+                # if it was due.
+                left = self.outer_delay - (clock() - self.start)
+                signal.setitimer(signal.ITIMER_REAL, max(left, 1e-6))
+        return False
+
+
+def guard(template=None, field=None, pattern=None, seconds=None):
+    """
+    Context manager raising `RegexTimeout` if its body runs longer than
+    the budget. The other arguments only describe the regex in the error.
+
+    Args:
+        seconds (float): the budget, default the one given to `enable`
+    """
+    if seconds is None:
+        if _current is None:
+            return NULL_GUARD
+        seconds = _current.seconds
+    if not hasattr(signal, 'setitimer'):
+        return NULL_GUARD
+    outer_delay = signal.getitimer(signal.ITIMER_REAL)[0]
+    if outer_delay and outer_delay <= seconds:
+        return NULL_GUARD
+    return _Guard(seconds, template, field, pattern)
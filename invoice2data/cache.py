@@ -0,0 +1,137 @@
+"""
+Persistent cache for text extracted from PDF files.
+
+Entries are keyed by a hash of the file content plus the backend and its
+flags, so renamed or copied files hit the cache and edited files don't.
+"""
+
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+
+logger = logging.getLogger(__name__)
+
+CACHE_ROOT = os.path.join(os.path.expanduser('~'), '.cache', 'invoice2data')
+DEFAULT_FOLDER = os.path.join(CACHE_ROOT, 'text')
+DEFAULT_MAX_SIZE = 512 * 1024 * 1024
+
+# Eviction goes down to this part of `max_size`, so that it doesn't scan
+# the folder again on the next writes.
+EVICT_TO = 0.9
+
+
+def content_key(data, backend, *flags):
+    """
+    Args:
+        data (bytes): content of the input file
+        backend (str): name of the text extraction tool
+        flags: anything else that changes the extracted text
+    """
+    digest = hashlib.sha256(data)
+    digest.update(repr((backend,) + flags).encode('utf-8'))
+    return digest.hexdigest()
+
+
+class TextCache(object):
+    """
+    Folder with one file per cached text. The least recently used entries
+    are removed once the folder grows over `max_size` bytes, down to
+    `EVICT_TO` of it.
+
+    Safe to share between processes: entries are written to a temporary
+    file and renamed into place.
+    """
+
+    def __init__(self, folder=DEFAULT_FOLDER, max_size=DEFAULT_MAX_SIZE):
+        self.folder = folder
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        # Bytes in the folder, counted on first write.
+        self._size = None
+
+    def key(self, data, backend, *flags):
+        return content_key(data, backend, *flags)
+
+    def _path(self, key):
+        return os.path.join(self.folder, key[:2], key)
+
+    def get(self, key):
+        """Return the cached text or None."""
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                text = f.read()
+        except IOError:
+            self.misses += 1
+            return None
+        # The modification time tracks the last use.
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        self.hits += 1
+        return text
+
+    def set(self, key, text):
+        path = self._path(key)
+        folder = os.path.dirname(path)
+        if not os.path.isdir(folder):
+            try:
+                os.makedirs(folder)
+            except OSError:
+                # Created by another process in the meantime.
+                if not os.path.isdir(folder):
+                    raise
+        fd, tmp_path = tempfile.mkstemp(dir=folder, prefix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(text)
+        os.rename(tmp_path, path)
+
+        if self._size is None:
+            self._size = self.size()
+        else:
+            self._size += len(text)
+        if self._size > self.max_size:
+            self.evict()
+
+    def _entries(self):
+        """Yield (mtime, size, path) of all entries."""
+        if not os.path.isdir(self.folder):
+            return
+        for path, subdirs, files in os.walk(self.folder):
+            for name in files:
+                file_path = os.path.join(path, name)
+                try:
+                    stat = os.stat(file_path)
+                except OSError:
+                    continue
+                yield stat.st_mtime, stat.st_size, file_path
+
+    def size(self):
+        """Total size of the cached texts in bytes."""
+        return sum(size for mtime, size, path in self._entries())
+
+    def evict(self):
+        """Remove least recently used entries until the cache fits in `EVICT_TO` of `max_size`."""
+        entries = sorted(self._entries())
+        total = sum(size for mtime, size, path in entries)
+        target = self.max_size * EVICT_TO
+        for mtime, size, path in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+        logger.debug('Text cache is %d bytes after eviction', total)
+        self._size = total
+
+    def clear(self):
+        """Remove all entries."""
+        if os.path.isdir(self.folder):
+            shutil.rmtree(self.folder)
+        self._size = 0
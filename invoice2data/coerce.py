@@ -0,0 +1,138 @@
+"""
+Numbers of the fields and line items, read with the `decimal_separator`
+of a template.
+
+`parse_number` removes the thousands separators with a translation table
+instead of a regex. `coerce_rows` converts the typed columns of the line
+items: each column is joined into one string, cleaned with a few string
+operations and split again, so the cost per cell is mostly `float`.
+Columns this can't convert exactly like `coerce` (a value that isn't a
+number, a separator char in a value...) are converted cell by cell,
+which also raises the same errors.
+"""
+
+import re
+import sys
+
+PY2 = sys.version_info[0] == 2
+
+text_type = type(u'')
+
+TYPES = ('int', 'float')
+
+# Reference for the translation tables below.
+THOUSANDS_SEPARATORS = re.compile(r'[.,\s]')
+
+# Chars matched by `\s`: ASCII whitespace, except for text on Python 3
+# where it is all Unicode whitespace (none is above U+3000).
+ASCII_WHITESPACE = ' \t\n\r\x0b\x0c'
+if PY2:
+    _BYTES_SEPARATORS = '.,' + ASCII_WHITESPACE
+    _TEXT_SEPARATORS = dict.fromkeys(ord(c) for c in u'.,' + ASCII_WHITESPACE)
+else:
+    _TEXT_SEPARATORS = dict.fromkeys(
+        [ord('.'), ord(',')] + [c for c in range(0x3001) if chr(c).isspace()])
+
+# Joins the cells of a column, kept by all the string operations.
+_CELL_SEPARATOR = '\0'
+
+
+def remove_separators(value):
+    """Same as `THOUSANDS_SEPARATORS.sub('', value)`."""
+    if type(value) is text_type:
+        return value.translate(_TEXT_SEPARATORS)
+    if PY2 and type(value) is str:
+        return value.translate(None, _BYTES_SEPARATORS)
+    return THOUSANDS_SEPARATORS.sub('', value)
+
+
+def parse_number(value, decimal_separator='.'):
+    assert value.count(decimal_separator) < 2,\
+        'Decimal separator cannot be present several times'
+    # remove dollar sign if it's there
+    value = value.replace('$', '')
+    # replace decimal separator by a |
+    amount_pipe = value.replace(decimal_separator, '|')
+    # remove all possible thousands separators, put dot as decimal sep
+    return float(remove_separators(amount_pipe).replace('|', '.'))
+
+
+def coerce(value, target_type, decimal_separator='.'):
+    if target_type == 'int':
+        if not value.strip():
+            return 0
+        return int(parse_number(value, decimal_separator))
+    elif target_type == 'float':
+        if not value.strip():
+            return 0.0
+        return float(parse_number(value, decimal_separator))
+    assert False, 'Unknown type'
+
+
+def coerce_column(values, target_type, decimal_separator='.'):
+    """
+    Returns:
+        list: `coerce` of each value, or None if the column can't be
+            converted at once
+    """
+    if target_type not in TYPES or len(set(map(type, values))) != 1:
+        return None
+    kind = type(values[0])
+    if kind is not text_type and not (PY2 and kind is str):
+        return None
+    separator = kind(_CELL_SEPARATOR)
+    if separator in decimal_separator:
+        return None
+    joined = separator.join(values)
+    if '|' in joined or joined.count(separator) != len(values) - 1:
+        return None
+
+    joined = joined.replace('$', '').replace(decimal_separator, '|')
+    parts = remove_separators(joined).replace('|', '.').split(separator)
+    try:
+        if '' in parts:
+            numbers = []
+            for value, part in zip(values, parts):
+                if part:
+                    numbers.append(float(part))
+                elif value.strip():
+                    # Only separators, not a number.
+                    return None
+                else:
+                    numbers.append(0.0)
+        else:
+            numbers = list(map(float, parts))
+        if target_type == 'int':
+            # Infinity and NaN raise here.
+            return list(map(int, numbers))
+    except (ValueError, OverflowError):
+        return None
+    return numbers
+
+
+def coerce_rows(rows, types, decimal_separator='.'):
+    """
+    Convert the fields of the rows listed in `types` ({field: 'int' or
+    'float'}), in place.
+    """
+    columns = []
+    for name, target_type in types.items():
+        cells = [row[name] for row in rows if name in row]
+        if not cells:
+            continue
+        converted = coerce_column(cells, target_type, decimal_separator)
+        if converted is None:
+            break
+        columns.append((name, converted))
+    else:
+        for name, converted in columns:
+            converted = iter(converted)
+            for row in rows:
+                if name in row:
+                    row[name] = next(converted)
+        return
+
+    for row in rows:
+        for name in row.keys():
+            if name in types:
+                row[name] = coerce(row[name], types[name], decimal_separator)
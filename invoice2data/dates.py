@@ -0,0 +1,179 @@
+"""
+Parse the dates found by `date*` fields.
+
+`parse_date` tries, in order:
+
+1. the template's numeric `date_formats` (only %d, %m, %Y and %y), with a
+   compiled regex per format instead of `strptime`;
+2. a cache of the previous results for the same string, formats and
+   languages;
+3. `dateparser.parse`.
+
+Formats with month or day names are left to dateparser, which translates
+them from the template's languages first.
+"""
+
+import datetime
+import re
+from collections import Counter, OrderedDict
+
+# Same as the `strptime` regexes for these directives.
+NUMERIC_DIRECTIVES = {
+    'd': r'(?P<d>3[0-1]|[1-2]\d|0[1-9]|[1-9]| [1-9])',
+    'm': r'(?P<m>1[0-2]|0[1-9]|[1-9])',
+    'Y': r'(?P<Y>\d\d\d\d)',
+    'y': r'(?P<y>\d\d)',
+}
+
+# Directives that only match letters.
+NAME_DIRECTIVES = set('aAbBpZ')
+
+NO_MATCH = object()
+
+# Raw dates the fast path is tried on: three numbers with a punctuation
+# character between them. dateparser reads plain numbers as timestamps,
+# removes some punctuation and fails on the formats with trailing spaces.
+NUMERIC_DATE = re.compile(r'\d+[^\w\s]\d+[^\w\s]\d+\Z')
+
+CACHE_SIZE = 1024
+
+# Totals of this process: 'fast', 'cached', 'dateparser' and 'failed'.
+date_stats = Counter()
+
+# Format -> result of `compile_format`.
+_handlers = {}
+
+# (raw date, formats, languages, day) -> result of dateparser, most recent
+# last. Relative dates like 'yesterday' depend on the day they're read.
+_cache = OrderedDict()
+
+today = datetime.date.today
+
+
+def compile_format(date_format):
+    """
+    Returns:
+        a regex for a format of %d, %m and %Y or %y separated by
+        punctuation, `NO_MATCH` if the format can't match a numeric date
+        (it has letters, spaces or month names), None if it may
+    """
+    parts = []
+    directives = set()
+    i = 0
+    while i < len(date_format):
+        char = date_format[i]
+        if char == '%':
+            directive = date_format[i + 1:i + 2]
+            if directive in NAME_DIRECTIVES:
+                return NO_MATCH
+            if directive == '%':
+                parts.append(re.escape('%'))
+            elif directive in NUMERIC_DIRECTIVES and directive not in directives:
+                directives.add(directive)
+                parts.append(NUMERIC_DIRECTIVES[directive])
+            else:
+                return None
+            i += 2
+            continue
+        if char.isalpha() or char.isspace():
+            return NO_MATCH
+        if char.isdigit():
+            return None
+        parts.append(re.escape(char))
+        i += 1
+    if not {'d', 'm'} <= directives or not directives & {'Y', 'y'}:
+        return None
+    return re.compile(''.join(parts) + r'\Z')
+
+
+def _handler(date_format):
+    try:
+        return _handlers[date_format]
+    except KeyError:
+        handler = _handlers[date_format] = compile_format(date_format)
+        return handler
+
+
+def parse_numeric(raw_date, date_formats):
+    """
+    Returns:
+        datetime: the date for the first numeric format matching the
+            whole string, or None
+    """
+    if not NUMERIC_DATE.match(raw_date):
+        return None
+    for date_format in date_formats:
+        handler = _handler(date_format)
+        if handler is NO_MATCH:
+            continue
+        if handler is None:
+            # Leave the formats `strptime` would try before to dateparser.
+            return None
+        match = handler.match(raw_date)
+        if match is None:
+            continue
+        values = match.groupdict()
+        if 'Y' in values:
+            year = int(values['Y'])
+        else:
+            year = int(values['y'])
+            # Same pivot as `strptime`.
+            year += 2000 if year <= 68 else 1900
+        try:
+            return datetime.datetime(year, int(values['m']), int(values['d']))
+        except ValueError:
+            continue
+    return None
+
+
+def parse_date(raw_date, date_formats=(), languages=(), detect_language=True):
+    """
+    Args:
+        raw_date (str): text matched by the field
+        date_formats (list[str]): `strptime` formats to try first
+        languages (list[str]): languages for dateparser
+        detect_language (bool): let dateparser guess the language when
+            `languages` is empty. If False, English is used.
+
+    Returns:
+        datetime or None
+    """
+    try:
+        date = parse_numeric(raw_date, date_formats)
+    except TypeError:
+        # Not a string, eg. a tuple from a regex with several groups.
+        date = None
+    if date is not None:
+        date_stats['fast'] += 1
+        return date
+
+    if not languages and not detect_language:
+        languages = ['en']
+    key = (raw_date, tuple(date_formats), tuple(languages), today())
+    try:
+        date = _cache.pop(key)
+    except KeyError:
+        pass
+    except TypeError:
+        # Not hashable, dateparser will tell what's wrong with it.
+        key = None
+    else:
+        _cache[key] = date
+        date_stats['cached'] += 1
+        return date
+
+    import dateparser
+
+    date_stats['dateparser'] += 1
+    date = dateparser.parse(raw_date, date_formats=list(date_formats), languages=list(languages))
+    if date is None:
+        date_stats['failed'] += 1
+    if key is not None:
+        _cache[key] = date
+        if len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    return date
+
+
+def clear_cache():
+    _cache.clear()
@@ -1,25 +1,162 @@
 # -*- coding: utf-8 -*-
-import subprocess
-import logging as logger
-import shutil
-from distutils import spawn #py2 compat
-from PyPDF2 import PdfFileReader
+import logging
+import threading
+from collections import namedtuple
 
+try:
+    from shutil import which as find_executable
+except ImportError:  # Python 2
+    from distutils.spawn import find_executable
 
-def to_text(path, encoding='ASCII7'):
+from invoice2data import profiling, supervise
+
+logger = logging.getLogger(__name__)
+
+
+def to_text(path, encoding='ASCII7', cache=None, first_page=None, last_page=None, data=None):
     """
     Wrapper around Poppler pdftotext.
+
+    Args:
+        path (str): a path to the PDF file
+        encoding (str): output encoding of pdftotext
+        cache (TextCache): optional cache for the extracted text
+        first_page (int): first page to convert, starting at 1
+        last_page (int): last page to convert
+        data (bytes): content of the PDF, piped to pdftotext instead of
+            reading `path`
+
+    Each page ends with a form feed, so `out.count('\\f')` is the number
+    of pages converted.
+
+    Raises:
+        CommandFailed: pdftotext failed, or was stopped by the limits of
+            `invoice2data.supervise`
     """
+    args = ['-layout', '-enc', encoding]
+    if first_page:
+        args += ['-f', str(first_page)]
+    if last_page:
+        args += ['-l', str(last_page)]
+
+    if cache is not None:
+        if data is None:
+            with open(path, 'rb') as f:
+                key = cache.key(f.read(), 'pdftotext', *args)
+        else:
+            key = cache.key(data, 'pdftotext', *args)
+        out = cache.get(key)
+        if out is not None:
+            return out
 
-    if spawn.find_executable("pdftotext"): #shutil.which('pdftotext'):
-        out, err = subprocess.Popen(
-            ["pdftotext", '-layout', '-enc', encoding, path, '-'],
-            stdout=subprocess.PIPE).communicate()
+    if find_executable("pdftotext"): #shutil.which('pdftotext'):
+        with profiling.timer('pdftotext'):
+            result = supervise.run(
+                ["pdftotext"] + args + [path if data is None else '-', '-'], data=data)
+        if result.failed:
+            raise supervise.CommandFailed(result)
+        out = result.out
+        if cache is not None:
+            cache.set(key, out)
         return out
     else:
         raise EnvironmentError('pdftotext not installed. Can be downloaded from https://poppler.freedesktop.org/')
 
 
+class Document(namedtuple('Document', ['text', 'pages', 'info'])):
+    """
+    Text and metadata of a PDF, see `load_document`.
+
+    Attributes:
+        text (bytes): output of pdftotext
+        pages (int): number of pages of the document, None if unknown
+        info (dict): info dictionary as printed by pdfinfo, like
+            {'Title': u'Invoice 42', 'Pages': u'3', ...}
+    """
+
+    __slots__ = ()
+
+
+PDFINFO_ARGS = ['-enc', 'UTF-8']
+
+
+def _pdfinfo(path, cache=None, data=None):
+    """
+    Returns:
+        bytes: UTF-8 output of pdfinfo, empty if pdfinfo isn't installed
+            or fails
+    """
+    if cache is not None:
+        if data is None:
+            with open(path, 'rb') as f:
+                key = cache.key(f.read(), 'pdfinfo', *PDFINFO_ARGS)
+        else:
+            key = cache.key(data, 'pdfinfo', *PDFINFO_ARGS)
+        out = cache.get(key)
+        if out is not None:
+            return out
+
+    if not find_executable('pdfinfo'):
+        logger.debug('pdfinfo not installed, no metadata for %s', path)
+        return b''
+    with profiling.timer('pdfinfo'):
+        result = supervise.run(['pdfinfo'] + PDFINFO_ARGS + [path if data is None else '-'],
+                               data=data)
+    if result.failed:
+        return b''
+    out = result.out
+    if cache is not None and out:
+        cache.set(key, out)
+    return out
+
+
+def parse_info(out):
+    """
+    Args:
+        out (bytes): UTF-8 output of pdfinfo
+
+    Returns:
+        dict: text value of each key
+    """
+    info = {}
+    for line in out.decode('utf-8', 'replace').splitlines():
+        key, sep, value = line.partition(':')
+        if sep and key.strip():
+            info[str(key.strip())] = value.strip()
+    return info
+
+
+def load_document(path, encoding='ASCII7', cache=None, first_page=None, last_page=None,
+                  data=None, with_info=True):
+    """
+    Text, page count and info dictionary of a PDF in one pass: pdfinfo
+    runs in a thread while pdftotext converts the pages, so the metadata
+    costs no time over the text. Both are cached like the text.
+
+    Args:
+        path, encoding, cache, first_page, last_page, data: see `to_text`
+        with_info (bool): run pdfinfo, else `pages` is None and `info`
+            is empty
+
+    Returns:
+        Document
+    """
+    if not with_info:
+        return Document(to_text(path, encoding, cache, first_page, last_page, data), None, {})
+
+    info_out = []
+    thread = threading.Thread(target=lambda: info_out.append(_pdfinfo(path, cache, data)))
+    thread.daemon = True
+    thread.start()
+    try:
+        text = to_text(path, encoding, cache, first_page, last_page, data)
+    finally:
+        thread.join()
+    info = parse_info(info_out[0]) if info_out else {}
+    pages = info.get('Pages')
+    return Document(text, int(pages) if pages and pages.isdigit() else None, info)
+
+
 def document_metadata(filepath):
     """ Extract the file metadata
 
@@ -27,10 +164,9 @@ def document_metadata(filepath):
         filepath (str): a path to the PDF file
 
     Returns:
-        dict: The elements of the PDF's metadata
+        dict: The elements of the PDF's metadata, see `parse_info`
     """
-    pdf_toread = PdfFileReader(open(filepath, "rb"))
-    return pdf_toread.getDocumentInfo()
+    return parse_info(_pdfinfo(filepath))
 
 
 def get_document_title(filepath):
@@ -42,4 +178,4 @@ def get_document_title(filepath):
     Returns:
         str: title of the file
     """
-    return document_metadata(filepath)['/Title']
+    return document_metadata(filepath)['Title']
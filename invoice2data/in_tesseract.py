@@ -1,17 +1,203 @@
 # -*- coding: utf-8 -*-
-import subprocess
+"""
+Tesseract OCR, for scanned PDFs without a text layer.
 
+Pages are rendered by Poppler pdftoppm, then each distinct page image is
+read by its own tesseract process, `jobs` pages at a time. The text of a
+page is cached by the hash of its image: in the `TextCache` if one is
+given, else for the last pages read in this process.
 
-def to_text(path):
-    """Wraps Tesseract OCR."""
+The commands run with the limits of `invoice2data.supervise`, and raise
+`CommandFailed` if one fails.
+"""
 
-    convert = "convert -density 350 %s -depth 8 tiff:-" % (path)
-    p1 = subprocess.Popen(convert.split(' '), stdout=subprocess.PIPE)
+import hashlib
+import logging
+import multiprocessing
+import os
+import re
+import shutil
+import tempfile
+import threading
+from collections import namedtuple, OrderedDict
+from multiprocessing.pool import ThreadPool
 
-    p2 = subprocess.Popen("tesseract stdin stdout".split(' '),
-                          stdin=p1.stdout, stdout=subprocess.PIPE)
-    out, err = p2.communicate()
+try:
+    from shutil import which as find_executable
+except ImportError:  # Python 2
+    from distutils.spawn import find_executable
 
-    extracted_str = out.decode('utf-8')
+from invoice2data import profiling, supervise
 
-    return extracted_str
+logger = logging.getLogger(__name__)
+
+
+class OcrOptions(namedtuple('OcrOptions', 'min_chars dpi jobs lang first_pages')):
+    """
+    OCR fallback of `extract_data`.
+
+    Args:
+        min_chars (int): OCR a PDF whose pdftotext output has fewer
+            non-blank characters than this
+        dpi (int): resolution the pages are rendered at
+        jobs (int): pages read in parallel, defaults to the number of CPUs
+        lang (str): tesseract languages, like 'deu+eng'
+        first_pages (int): pages read to match a template, the others are
+            only read if the template needs them
+    """
+
+    __slots__ = ()
+
+    def __new__(cls, min_chars=40, dpi=350, jobs=None, lang=None, first_pages=1):
+        return super(OcrOptions, cls).__new__(cls, min_chars, dpi, jobs, lang, first_pages)
+
+
+# Pages kept in memory without a `TextCache`.
+MEMORY_PAGES = 64
+
+_pages = OrderedDict()
+_pages_lock = threading.Lock()
+
+PAGES_RE = re.compile(br'^Pages:\s+(\d+)', re.MULTILINE)
+
+
+def _require(*commands):
+    for command in commands:
+        if not find_executable(command):
+            raise EnvironmentError('%s not installed, it is needed for OCR.' % command)
+
+
+def _check(result):
+    if result.failed:
+        raise supervise.CommandFailed(result)
+    return result.out
+
+
+def page_count(path):
+    out = _check(supervise.run(['pdfinfo', path]))
+    match = PAGES_RE.search(out)
+    return int(match.group(1)) if match else 0
+
+
+def render_page(path, page, dpi, folder):
+    """
+    Returns:
+        bytes: grayscale PNG of a page
+    """
+    root = os.path.join(folder, 'page-%d' % page)
+    _check(supervise.run(['pdftoppm', '-r', str(dpi), '-gray', '-png', '-singlefile',
+                          '-f', str(page), '-l', str(page), path, root]))
+    with open(root + '.png', 'rb') as f:
+        return f.read()
+
+
+def ocr_image(image_path, lang=None, threads=None):
+    """
+    Returns:
+        bytes: UTF-8 text tesseract reads on an image file
+    """
+    args = ['tesseract', image_path, 'stdout']
+    if lang:
+        args += ['-l', lang]
+    env = None
+    if threads:
+        # Pages are already read in parallel.
+        env = dict(os.environ, OMP_THREAD_LIMIT=str(threads))
+    return _check(supervise.run(args, env=env))
+
+
+def _cached_page(cache, key):
+    if cache is not None:
+        return cache.get(key)
+    with _pages_lock:
+        text = _pages.pop(key, None)
+        if text is not None:
+            _pages[key] = text
+        return text
+
+
+def _cache_page(cache, key, text):
+    if cache is not None:
+        cache.set(key, text)
+        return
+    with _pages_lock:
+        _pages[key] = text
+        while len(_pages) > MEMORY_PAGES:
+            _pages.popitem(last=False)
+
+
+def page_key(image, options):
+    """Same as `TextCache.key(image, 'tesseract', dpi, lang)`."""
+    digest = hashlib.sha256(image)
+    digest.update(repr(('tesseract', options.dpi, options.lang)).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def _map(func, items, jobs):
+    """`map` with `jobs` threads, each running a command."""
+    if jobs <= 1 or len(items) <= 1:
+        return [func(item) for item in items]
+    pool = ThreadPool(min(jobs, len(items)))
+    try:
+        return pool.map(func, items)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def to_text(path, options=None, cache=None, first_page=None, last_page=None, data=None,
+            info=None):
+    """
+    OCR a PDF.
+
+    Args:
+        path (str): a path to the PDF file
+        options (OcrOptions): DPI, parallel pages and languages
+        cache (TextCache): optional cache for the text of the pages
+        first_page (int): first page to read, starting at 1
+        last_page (int): last page to read
+        data (bytes): content of the PDF, if it isn't read from `path`
+        info (dict): if set, the number of pages of the PDF is added to it
+            as 'Pages', like pdfinfo prints it
+
+    Returns:
+        bytes: UTF-8 text, each page ending with a form feed like the
+            output of pdftotext
+    """
+    _require('pdfinfo', 'pdftoppm', 'tesseract')
+    if options is None:
+        options = OcrOptions()
+    jobs = options.jobs or multiprocessing.cpu_count()
+
+    folder = tempfile.mkdtemp(prefix='invoice2data-ocr')
+    try:
+        if data is not None:
+            path = os.path.join(folder, 'input.pdf')
+            with open(path, 'wb') as f:
+                f.write(data)
+        count = page_count(path)
+        if info is not None:
+            info['Pages'] = count
+        pages = list(range(first_page or 1, min(last_page or count, count) + 1))
+
+        with profiling.timer('ocr'):
+            images = _map(lambda page: render_page(path, page, options.dpi, folder), pages, jobs)
+            keys = [page_key(image, options) for image in images]
+            texts = {}
+            todo = OrderedDict()
+            for page, key in zip(pages, keys):
+                if key not in texts:
+                    texts[key] = _cached_page(cache, key)
+                    if texts[key] is None:
+                        todo[key] = os.path.join(folder, 'page-%d.png' % page)
+
+            threads = 1 if jobs > 1 else None
+            read = _map(lambda image_path: ocr_image(image_path, options.lang, threads),
+                        list(todo.values()), jobs)
+            for key, text in zip(todo, read):
+                texts[key] = text
+                _cache_page(cache, key, text)
+        logger.debug('OCR of %d pages of %s, %d cached', len(pages), path, len(pages) - len(todo))
+        return b''.join(texts[key].rstrip(b'\f') + b'\f' for key in keys)
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
@@ -0,0 +1,315 @@
+"""
+Keyword index over a list of templates.
+
+Instead of running `matches_input` for every template, all keywords are
+searched once per text. Only templates whose keywords were all found are
+returned as candidates, still in their original order.
+
+With hit counts, the templates that matched most often are tried before
+the keyword search. A template is only tried early once the templates
+before it that conflict with it are ruled out by a missing keyword: two
+templates conflict when the keywords of one are all found in the keywords
+of the other, so every text matching one matches the other. The first
+template that matches is then the same as in the original order, unless
+the text has all keywords of two templates that don't conflict, like an
+invoice quoting another vendor.
+"""
+
+import json
+import re
+from collections import Counter, OrderedDict
+
+from invoice2data import unicode
+from invoice2data.template import PreparedInput
+
+# A keyword without any of those characters means the same as regex and
+# as plain substring.
+REGEX_METACHARS = re.compile(r'[.^$*+?{}\[\]\\|()]')
+
+# Number of most frequent templates tried before the keyword search.
+HOT_TEMPLATES = 10
+
+
+def read_hits(path):
+    """
+    Returns:
+        Counter: matches per template name saved by `write_hits`, empty if
+            the file doesn't exist
+    """
+    try:
+        with open(path) as f:
+            return Counter(json.load(f))
+    except IOError:
+        return Counter()
+
+
+def write_hits(path, hits):
+    with open(path, 'w') as f:
+        json.dump(dict(hits), f, indent=2, sort_keys=True)
+
+
+def _normalize(text):
+    # Each `prepare_input` option only makes more keywords found in the
+    # result of this, so the comparisons hold whatever the options.
+    text = unicode.asciify(text)
+    if not isinstance(text, str):
+        text = text.decode('ascii')
+    return ''.join(text.split()).lower()
+
+
+def regex_literals(keyword):
+    """
+    Literal parts of a regex that any match contains, e.g. `ACME Corp`
+    for `ACME Corp.`. A keyword found as substring contains them too.
+    """
+    if '|' in keyword:
+        return []
+    literals = []
+    run = ''
+    depth = 0
+    i = 0
+    while i < len(keyword):
+        c = keyword[i]
+        i += 1
+        if c not in '\\[](){}.^$*+?':
+            if depth == 0:
+                run += c
+            continue
+        if c in '?*{':
+            # The character before is optional.
+            run = run[:-1]
+        if run:
+            literals.append(run)
+        run = ''
+        if c == '\\':
+            i += 1
+        elif c == '[':
+            # Skip the class, where `]` can come first or escaped.
+            i += 1
+            while i < len(keyword) and keyword[i] != ']':
+                i += 2 if keyword[i] == '\\' else 1
+            i += 1
+        elif c == '{':
+            i = keyword.find('}', i) + 1 or len(keyword)
+        elif c == '(':
+            depth += 1
+        elif c == ')':
+            depth -= 1
+    if run:
+        literals.append(run)
+    return literals
+
+
+def keyword_strings(template):
+    """
+    Returns:
+        tuple: normalized strings that any text matching the template
+            contains, and normalized literal keywords of the template.
+            Both are empty if the template replaces parts of the text.
+    """
+    if template.options['replace']:
+        return [], []
+    required = []
+    literals = []
+    for keyword in template['keywords']:
+        if REGEX_METACHARS.search(keyword):
+            required.extend(_normalize(k) for k in regex_literals(keyword))
+        else:
+            literals.append(_normalize(keyword))
+    return required + literals, literals
+
+
+def covers(required, literals):
+    """
+    True if each of `literals` is part of one of `required`: a text
+    matching the template with `required` also matches the template with
+    `literals`, at least for its literal keywords.
+    """
+    return all(any(keyword in string for string in required) for keyword in literals)
+
+
+class KeywordGroup(object):
+    """
+    Templates whose `prepare_input` options are identical, so their
+    keywords are all tested against the same string.
+    """
+
+    def __init__(self, positions, templates):
+        self.positions = positions
+        self.templates = templates
+
+        literals = set()
+        regexes = OrderedDict()
+        # Per template: literal keywords and non-literal keywords.
+        self.keywords = []
+        for t in templates:
+            t_literals = []
+            t_regexes = []
+            for keyword, pattern in zip(t['keywords'], t.keyword_patterns):
+                if REGEX_METACHARS.search(keyword):
+                    regexes[keyword] = pattern
+                    t_regexes.append(keyword)
+                elif keyword:
+                    literals.add(keyword)
+                    t_literals.append(keyword)
+            self.keywords.append((t_literals, t_regexes))
+        self.regexes = regexes
+
+        # Longest keywords first, so the alternation returns the longest
+        # keyword starting at a position. Shorter keywords at the same
+        # position are its prefixes.
+        self.literals_re = None
+        if literals:
+            self.literals_re = re.compile('|'.join(
+                re.escape(k) for k in sorted(literals, key=len, reverse=True)))
+        self.prefixes = {}
+        for k in literals:
+            self.prefixes[k] = [k[:i] for i in range(1, len(k) + 1) if k[:i] in literals]
+
+    def find_literals(self, optimized_str):
+        """Return the set of literal keywords found in the string."""
+        found = set()
+        if self.literals_re is None:
+            return found
+        search = self.literals_re.search
+        prefixes = self.prefixes
+        match = search(optimized_str)
+        while match:
+            found.update(prefixes.get(match.group(), ()))
+            # Restart right after the match start to catch overlapping keywords.
+            match = search(optimized_str, match.start() + 1)
+        return found
+
+    def candidates(self, optimized_str):
+        """Yield the positions of templates whose keywords are all present."""
+        found = self.find_literals(optimized_str)
+        regex_found = {}
+        for position, (t_literals, t_regexes) in zip(self.positions, self.keywords):
+            if not all(k in found for k in t_literals):
+                continue
+            missing = False
+            for k in t_regexes:
+                if k not in regex_found:
+                    # Keywords are tried as substring and as regex.
+                    regex_found[k] = bool(k in optimized_str or self.regexes[k].search(optimized_str))
+                if not regex_found[k]:
+                    missing = True
+                    break
+            if not missing:
+                yield position
+
+
+class TemplateIndex(object):
+    """
+    Prefilter for a list of templates. Use `candidates` instead of looping
+    over all templates.
+
+    Args:
+        templates (list[InvoiceTemplate]): templates in the order they are tried
+        hits (Counter): matches per template name, to try the most frequent
+            templates first. Updated by `add_hit`.
+    """
+
+    def __init__(self, templates, hits=None):
+        self.templates = list(templates)
+        self.hits = hits
+        self._conflicts = {}
+        self._keywords = [keyword_strings(t) for t in self.templates]
+
+        # Template name or issuer -> positions, for hints.
+        self.by_name = {}
+        # Per position, a literal keyword whose absence rules the template out.
+        self.blockers = []
+        for position, t in enumerate(self.templates):
+            for name in set([t['template_name'], t['issuer']]):
+                self.by_name.setdefault(name, []).append(position)
+            literals = [k for k in t['keywords'] if k and not REGEX_METACHARS.search(k)]
+            self.blockers.append(max(literals, key=len) if literals else None)
+
+        positions = OrderedDict()
+        for position, t in enumerate(self.templates):
+            positions.setdefault(t.input_key, []).append(position)
+        self.groups = [
+            KeywordGroup(group_positions, [self.templates[i] for i in group_positions])
+            for group_positions in positions.values()]
+
+    def __len__(self):
+        return len(self.templates)
+
+    def __iter__(self):
+        return iter(self.templates)
+
+    def add_hit(self, template):
+        if self.hits is not None:
+            self.hits[template['template_name']] += 1
+
+    def hot_positions(self):
+        """Positions of the most frequent templates, most frequent first."""
+        positions = []
+        for name, count in self.hits.most_common(HOT_TEMPLATES):
+            positions.extend(self.by_name.get(name, ()))
+        return positions
+
+    def conflicts(self, position):
+        """
+        Positions before this one of the templates that match whenever it
+        does, or the other way around.
+        """
+        try:
+            return self._conflicts[position]
+        except KeyError:
+            required, literals = self._keywords[position]
+            conflicts = self._conflicts[position] = [
+                other for other, (other_required, other_literals) in enumerate(
+                    self._keywords[:position])
+                if covers(required, other_literals) or covers(other_required, literals)]
+            return conflicts
+
+    def _ruled_out(self, position, prepared):
+        """True if the template at this position can't match the text."""
+        t = self.templates[position]
+        blocker = self.blockers[position]
+        if blocker is not None:
+            return blocker not in prepared.get(t)
+        return not t.matches_input(prepared.get(t))
+
+    def candidates(self, prepared, hint=None):
+        """
+        Yield (template, optimized_str) for all templates that could match,
+        in the order the templates were given.
+
+        Args:
+            prepared (PreparedInput or str): the extracted text
+            hint (str): name or issuer of the templates to try first,
+                whatever their order
+        """
+        if not isinstance(prepared, PreparedInput):
+            prepared = PreparedInput(prepared)
+
+        tried = set()
+        if hint is not None:
+            for position in self.by_name.get(hint, ()):
+                tried.add(position)
+                t = self.templates[position]
+                yield t, prepared.get(t)
+
+        if self.hits:
+            for position in self.hot_positions():
+                if position in tried:
+                    continue
+                # The caller stops at the first template that matches.
+                if all(other in tried or self._ruled_out(other, prepared)
+                       for other in self.conflicts(position)):
+                    tried.add(position)
+                    t = self.templates[position]
+                    yield t, prepared.get(t)
+
+        found = []
+        for group in self.groups:
+            found.extend(group.candidates(prepared.get(group.templates[0])))
+
+        for position in sorted(found):
+            if position in tried:
+                continue
+            t = self.templates[position]
+            yield t, prepared.get(t)
@@ -0,0 +1,214 @@
+"""
+Classify the lines of an invoice body for `InvoiceTemplate.extract_lines`.
+
+A line is checked against the `ignore_line`, `first_line`, `last_line` and
+`line` regexes of a template, in this order, and belongs to the first one
+that matches anywhere in it.
+
+The lines found are a list of dicts, or with `columnar_lines` a
+`LineItems`, which keeps a list or array of values per field instead.
+"""
+
+from array import array
+from collections import OrderedDict
+
+from invoice2data import coerce
+
+# In the order they are tried.
+LINE_KINDS = ['ignore_line', 'first_line', 'last_line', 'line']
+
+
+class LineScanner(object):
+    """
+    Args:
+        patterns (dict): compiled regexes by kind, see `LINE_KINDS`
+
+    A single alternation of all patterns, with lookaheads to keep their
+    priority, was tried and is slower with `re`: it can't use the
+    literal prefix search of the individual patterns.
+    """
+
+    def __init__(self, patterns):
+        self.searches = [(kind, patterns[kind].search)
+                         for kind in LINE_KINDS if kind in patterns]
+
+    def classify(self, line):
+        """
+        Returns:
+            tuple: the kind of the first pattern matching the line and the
+                match, or (None, None)
+        """
+        for kind, search in self.searches:
+            match = search(line)
+            if match:
+                return kind, match
+        return None, None
+
+
+def join_values(values, separator):
+    """
+    Join the values collected for a field of a row over several lines.
+    Empty values are skipped until the first non-empty one.
+    """
+    for i, value in enumerate(values):
+        if value:
+            return separator.join(values[i:])
+    return ''
+
+
+# Array type of the typed columns found on every line.
+ARRAY_TYPECODES = {'float': 'd', 'int': 'l'}
+
+
+class LineItems(object):
+    """
+    Lines of an invoice, stored by column.
+
+    The dicts of the default output repeat the field names and box each
+    number on every line: a big invoice is mostly dict overhead. Here
+    `columns` maps each field to its values in line order, None where a
+    line doesn't have the field. After `coerce`, a typed column present on
+    every line is an `array` of floats ('d') or ints ('l').
+
+    Iterating gives a `LineItem` per line, which reads like the dict of
+    the default output; `to_dicts` gives these dicts.
+    """
+
+    def __init__(self, columns=(), length=0):
+        self.columns = OrderedDict(columns)
+        self.length = length
+
+    @classmethod
+    def from_dicts(cls, rows):
+        lines = cls()
+        for row in rows:
+            lines.append(row)
+        return lines
+
+    def append(self, row):
+        """Add a line given as {field: value}, before `coerce`."""
+        columns = self.columns
+        for name, value in row.items():
+            column = columns.get(name)
+            if column is None:
+                column = columns[name] = [None] * self.length
+            column.append(value)
+        self.length += 1
+        if len(row) < len(columns):
+            for column in columns.values():
+                if len(column) < self.length:
+                    column.append(None)
+
+    def coerce(self, types, decimal_separator='.'):
+        """
+        Convert the columns listed in `types` ({field: 'int' or 'float'})
+        like `coerce.coerce_rows`.
+        """
+        for name, target_type in types.items():
+            column = self.columns.get(name)
+            if column is None:
+                continue
+            cells = [value for value in column if value is not None]
+            converted = coerce.coerce_column(cells, target_type, decimal_separator)
+            if converted is None:
+                converted = [coerce.coerce(value, target_type, decimal_separator)
+                             for value in cells]
+            if len(cells) == len(column):
+                self.columns[name] = _compact(converted, target_type)
+            else:
+                converted = iter(converted)
+                self.columns[name] = [None if value is None else next(converted)
+                                      for value in column]
+
+    def to_dicts(self):
+        """
+        Returns:
+            list[dict]: the lines as `extract_lines` returns them by default
+        """
+        return [dict(line.items()) for line in self]
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        for index in range(self.length):
+            yield LineItem(self, index)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self.length
+        if not 0 <= index < self.length:
+            raise IndexError('line index out of range')
+        return LineItem(self, index)
+
+    def __repr__(self):
+        return '<LineItems: %d lines of %s>' % (self.length, ', '.join(self.columns))
+
+
+def _compact(values, target_type):
+    try:
+        return array(ARRAY_TYPECODES[target_type], values)
+    except OverflowError:
+        # An int too big for a C long.
+        return values
+
+
+class LineItem(object):
+    """
+    View of a line of `LineItems`, with the read methods of a dict of its
+    fields.
+    """
+
+    __slots__ = ('lines', 'index')
+
+    def __init__(self, lines, index):
+        self.lines = lines
+        self.index = index
+
+    def get(self, name, default=None):
+        column = self.lines.columns.get(name)
+        if column is None:
+            return default
+        value = column[self.index]
+        return default if value is None else value
+
+    def __getitem__(self, name):
+        value = self.get(name)
+        if value is None:
+            raise KeyError(name)
+        return value
+
+    def __contains__(self, name):
+        return self.get(name) is not None
+
+    def keys(self):
+        index = self.index
+        return [name for name, column in self.lines.columns.items()
+                if column[index] is not None]
+
+    def values(self):
+        index = self.index
+        return [column[index] for column in self.lines.columns.values()
+                if column[index] is not None]
+
+    def items(self):
+        index = self.index
+        return [(name, column[index]) for name, column in self.lines.columns.items()
+                if column[index] is not None]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def __eq__(self, other):
+        return dict(self.items()) == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+    def __repr__(self):
+        return 'LineItem(%r)' % dict(self.items())
@@ -0,0 +1,222 @@
+"""
+Time the regexes of the templates on a corpus of texts and flag the ones
+whose run time grows faster than the text, like `(.*)\\s+(.*)Total`.
+
+Each regex is run the way extraction runs it on every text of the
+corpus. The text it is slowest on is then repeated 2, 4 and 8 times: a
+regex taking 8 times longer on 8 times the text is linear, one taking 64
+times longer is quadratic. Line regexes get the longest line of the text
+repeated instead.
+
+    invoice2data-lint --corpus ~/.cache/invoice2data/text
+
+The folder of `--text-cache` makes a good corpus. Exits with 1 if a
+regex was flagged.
+"""
+
+import argparse
+import io
+import logging
+import math
+import os
+import sys
+import timeit
+from collections import namedtuple
+
+from invoice2data import budget
+from invoice2data.budget import RegexTimeout
+from invoice2data.template import read_templates
+from invoice2data.unicode import replace_unicode_characters
+
+clock = timeit.default_timer
+
+# Sizes of the input, as multiples of the text.
+FACTORS = (1, 2, 4, 8)
+
+# Growth of the run time with the input size above which a regex is
+# flagged: 1 is linear, 2 quadratic.
+MAX_GROWTH = 1.5
+
+# Run times below this are noise.
+MIN_SECONDS = 0.001
+
+Finding = namedtuple('Finding', 'template field pattern text seconds growth')
+
+
+def read_corpus(folder):
+    """
+    Returns:
+        list[tuple]: (name, text) of the files in `folder`, read recursively
+    """
+    corpus = []
+    for path, subdirs, files in os.walk(folder):
+        for name in sorted(files):
+            if name.startswith('.'):
+                continue
+            file_path = os.path.join(path, name)
+            with io.open(file_path, encoding='utf-8', errors='replace') as f:
+                text = f.read()
+            corpus.append((os.path.relpath(file_path, folder), replace_unicode_characters(text)))
+    return corpus
+
+
+def template_patterns(template):
+    """
+    Returns:
+        list[tuple]: (field, compiled regex, whether it runs per line) of
+            all regexes of the template
+    """
+    patterns = [('keywords', p, False) for p in template.keyword_patterns]
+    for field, field_patterns in template.field_patterns.items():
+        patterns.extend((field, p, False) for p in field_patterns)
+    for kind, p in sorted(template.lines_patterns.items()):
+        patterns.append(('lines.%s' % kind, p, kind not in ('start', 'end')))
+    return patterns
+
+
+def scaled_input(text, factor, per_line):
+    if per_line:
+        line = max(text.splitlines() or [''], key=len)
+        return ' '.join([line] * factor)
+    return '\n'.join([text] * factor)
+
+
+def run_time(pattern, string, per_line, limit, repeat=3):
+    """
+    Returns:
+        float: best run time in seconds, None if a run took over `limit`
+    """
+    run = pattern.search if per_line else pattern.findall
+    best = None
+    for _ in range(repeat):
+        start = clock()
+        try:
+            with budget.guard(seconds=limit):
+                run(string)
+        except RegexTimeout:
+            return None
+        seconds = clock() - start
+        best = seconds if best is None else min(best, seconds)
+    return best
+
+
+def growth(seconds, factors=FACTORS):
+    """
+    Returns:
+        float: exponent of the run time against the input size between the
+            smallest and the largest input, None if the regex ran out of time
+    """
+    if None in seconds:
+        return None
+    first = max(seconds[0], MIN_SECONDS)
+    last = max(seconds[-1], MIN_SECONDS)
+    return math.log(last / first) / math.log(float(factors[-1]) / factors[0])
+
+
+def lint_template(template, corpus, limit=2.0, max_growth=MAX_GROWTH):
+    """
+    Returns:
+        list[Finding]: the regexes of the template that grow faster than
+            `max_growth` or take over `limit` seconds
+    """
+    texts = [(name, template.prepare_input(text)) for name, text in corpus]
+    findings = []
+    for field, pattern, per_line in template_patterns(template):
+        slowest = None
+        for name, text in texts:
+            string = scaled_input(text, 1, per_line)
+            seconds = run_time(pattern, string, per_line, limit, repeat=1)
+            if seconds is None:
+                slowest = (float('inf'), name, text)
+                break
+            if slowest is None or seconds > slowest[0]:
+                slowest = (seconds, name, text)
+        if slowest is None:
+            continue
+
+        seconds = []
+        for factor in FACTORS:
+            seconds.append(run_time(pattern, scaled_input(slowest[2], factor, per_line),
+                                    per_line, limit))
+            if seconds[-1] is None:
+                break
+        rate = growth(seconds, FACTORS[:len(seconds)])
+        if rate is None or rate > max_growth:
+            findings.append(Finding(template['template_name'], field, pattern.pattern,
+                                    slowest[1], seconds, rate))
+    return findings
+
+
+def format_finding(finding):
+    times = ', '.join('%dx: %s' % (factor, 'over the limit' if seconds is None
+                                   else '%.1f ms' % (seconds * 1000))
+                      for factor, seconds in zip(FACTORS, finding.seconds))
+    if finding.growth is None:
+        verdict = 'out of time'
+    else:
+        verdict = 'grows as size^%.1f' % finding.growth
+    return '%s: %s %s on %s (%s)\n    %s' % (
+        finding.template, finding.field, verdict, finding.text, times, finding.pattern)
+
+
+def main(args=None):
+    if args is None:
+        parser = create_parser()
+        args = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR)
+
+    template_folders = []
+    if args.template_folder:
+        template_folders.append(os.path.abspath(args.template_folder))
+    if not args.exclude_built_in_templates:
+        from invoice2data.main import builtin_templates_folder
+
+        template_folders.append(builtin_templates_folder())
+
+    templates = []
+    for folder in template_folders:
+        templates += read_templates(folder)
+    if args.template:
+        templates = [t for t in templates if t['template_name'] in args.template]
+
+    corpus = read_corpus(args.corpus)
+    if not corpus:
+        print('No texts in %s' % args.corpus)
+        return 2
+
+    flagged = 0
+    for template in templates:
+        for finding in lint_template(template, corpus, args.limit, args.max_growth):
+            print(format_finding(finding))
+            flagged += 1
+    print('%d regexes flagged in %d templates, %d texts' % (flagged, len(templates), len(corpus)))
+    return 1 if flagged else 0
+
+
+def create_parser():
+    parser = argparse.ArgumentParser(description='Find slow regexes in invoice2data templates.')
+
+    parser.add_argument('--corpus', required=True,
+                        help='Folder with the extracted texts of invoices, read recursively.')
+
+    parser.add_argument('--template-folder', '-t', dest='template_folder',
+                        help='Folder containing invoice templates in yml file.')
+
+    parser.add_argument('--exclude-built-in-templates', dest='exclude_built_in_templates',
+                        default=False, help='Ignore built-in templates.', action='store_true')
+
+    parser.add_argument('--template', action='append', default=[],
+                        help='Only lint the template with this name. Can be repeated.')
+
+    parser.add_argument('--limit', type=float, default=2.0,
+                        help='Seconds after which a regex run is stopped and flagged.')
+
+    parser.add_argument('--max-growth', type=float, default=MAX_GROWTH, dest='max_growth',
+                        help='Flag regexes whose run time grows faster than size^N.')
+
+    return parser
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -8,60 +8,325 @@ from os.path import join
 import argparse
 import glob
 import shutil
-import pkg_resources
+import timeit
+from collections import Counter
 
 from invoice2data import in_pdftotext as pdftotext
-from invoice2data.template import read_templates
-from invoice2data.out_csv import invoices_to_csv, write_issuer_invoices
+from invoice2data import in_tesseract as tesseract
+from invoice2data import budget, profiling, supervise
+from invoice2data.cache import TextCache, CACHE_ROOT
+from invoice2data.cache import DEFAULT_FOLDER as DEFAULT_CACHE_FOLDER
+from invoice2data.cache import DEFAULT_MAX_SIZE as DEFAULT_CACHE_SIZE
+from invoice2data.dates import date_stats
+from invoice2data.index import TemplateIndex, read_hits, write_hits
+from invoice2data.manifest import Manifest, DEFAULT_PATH as DEFAULT_MANIFEST
+from invoice2data.template import read_templates, PreparedInput, normalization_stats
+from invoice2data.out_csv import InvoicesCsvWriter, IssuerCsvWriter
 from invoice2data.unicode import replace_unicode_characters
 
 logger = logging.getLogger(__name__)
+summary_logger = logging.getLogger('invoice2data.summary')
+
+clock = timeit.default_timer
 
 FILENAME = "{date} {desc}.pdf"
 
 
-def extract_data(invoicefile, templates=None, debug=False, encoding='ASCII7'):
+def builtin_templates_folder():
+    """Folder of the templates shipped with invoice2data."""
+    import pkg_resources
+
+    return pkg_resources.resource_filename('invoice2data', 'templates')
+
+
+_builtin_templates = None
+
+
+def builtin_templates():
+    """Index of the built-in templates, loaded once per process."""
+    global _builtin_templates
+    if _builtin_templates is None:
+        _builtin_templates = TemplateIndex(read_templates(builtin_templates_folder()))
+    return _builtin_templates
+
+
+# The list of templates last passed to `extract_data` and its index.
+_last_index = (None, None)
+
+
+def template_index(templates):
+    """
+    Index of a list of templates, reused while the same unchanged list is
+    passed again, eg. `extract_data(path, templates)` in a loop.
+
+    Returns:
+        TemplateIndex
+    """
+    global _last_index
+    if isinstance(templates, TemplateIndex):
+        return templates
+    last, index = _last_index
+    if (last is templates and len(index.templates) == len(templates) and
+            all(a is b for a, b in zip(index.templates, templates))):
+        return index
+    index = TemplateIndex(templates)
+    _last_index = (templates, index)
+    return index
+
+
+def read_text(invoicefile, encoding='ASCII7', text_cache=None, last_page=None, data=None,
+              info=None):
+    """
+    Text of a .txt or PDF file, up to `last_page` for PDFs if set.
+    If `data` is set, it is used as the content of the file. If `info`
+    is a dict, the info dictionary of a PDF is read along with the text
+    and added to it.
+    """
+    if (invoicefile.lower().endswith(".txt")):
+        if data is None:
+            textfile = open(invoicefile, "r")
+            extracted_str = textfile.read()
+        else:
+            extracted_str = data
+    else:
+        document = pdftotext.load_document(
+            invoicefile, encoding=encoding, cache=text_cache, last_page=last_page, data=data,
+            with_info=info is not None)
+        extracted_str = document.text
+        if info is not None:
+            info.update(document.info)
+    return _normalize_text(extracted_str, encoding)
+
+
+def read_ocr_text(invoicefile, ocr, encoding='ASCII7', text_cache=None, first_page=None,
+                  last_page=None, data=None, info=None):
+    """
+    Text of the pages of a PDF read by OCR, like `read_text`. If `info` is
+    a dict, the number of pages is added to it as 'Pages'.
+    """
+    extracted_str = tesseract.to_text(invoicefile, ocr, cache=text_cache, first_page=first_page,
+                                      last_page=last_page, data=data, info=info)
+    if encoding not in ('ASCII7', 'UTF-8'):
+        extracted_str = extracted_str.decode('utf-8').encode(encoding, 'replace')
+    return _normalize_text(extracted_str, encoding)
+
+
+def _normalize_text(extracted_str, encoding):
+    if encoding=='ASCII7':
+        with profiling.timer('unicode'):
+            extracted_str = replace_unicode_characters(extracted_str)
+    return extracted_str
+
+
+def needs_ocr(extracted_str, ocr):
+    """True if the text is too short and the OCR fallback is on."""
+    return ocr is not None and len(''.join(extracted_str.split())) < ocr.min_chars
+
+
+def match_template(templates, extracted_str, hint=None):
+    """
+    Args:
+        hint (str): name or issuer of the template to try first
+
+    Returns:
+        tuple: the first template matching the text and the text as
+            prepared for it, or (None, None)
+    """
+    prepared = PreparedInput(extracted_str)
+    for t, optimized_str in templates.candidates(prepared, hint):
+        logger.debug('Trying template %s', t['template_name'])
+        profiling.template_tried()
+        if t.matches_input(optimized_str):
+            logger.debug('Normalization cache: %d hits, %d misses', prepared.hits, prepared.misses)
+            return t, optimized_str
+    return None, None
+
+
+def extract_data(invoicefile, templates=None, debug=False, encoding='ASCII7', text_cache=None,
+                 first_pages=None, data=None, hint=None, ocr=None, info=None,
+                 columnar_lines=False):
     """
     Args:
         invoicefile (str): a path to an invoice file
+        templates (list or TemplateIndex): templates to try, in this order.
+            Pass a `TemplateIndex` when calling this for many files.
+            Defaults to the built-in templates.
+        text_cache (TextCache): reuse text already extracted from the same PDF
+        first_pages (int): match templates on the first pages of a PDF only.
+            The rest of the document is read if the template has `lines`,
+            or if a field isn't found on these pages.
+        data (bytes): content of the file, if it isn't read from
+            `invoicefile`. See also `invoice2data.batch.extract_many`.
+        hint (str): name or issuer of the template to try first, eg. when
+            the file name tells the vendor. Other templates are tried if
+            it doesn't match.
+        ocr (OcrOptions): OCR the PDFs with too little text, see
+            `invoice2data.in_tesseract`. Off by default.
+        info (dict): if set, the info dictionary of a PDF (Title, Author,
+            Pages...) is added to it, read by pdfinfo along with the text
+        columnar_lines (bool): return the `lines` as a `LineItems`, stored
+            by column, instead of a list of dicts. Uses much less memory
+            for invoices with many lines.
 
     Returns:
 
 
     """
-    if templates is None:
-        templates = read_templates(
-            pkg_resources.resource_filename('invoice2data', 'templates'))
+    return extract_with_template(invoicefile, templates, encoding, text_cache, first_pages,
+                                 data, hint, ocr, info, columnar_lines)[1]
 
-    if (invoicefile.lower().endswith(".txt")):
-        textfile = open(invoicefile, "r")
-        extracted_str = textfile.read()
+
+def extract_with_template(invoicefile, templates=None, encoding='ASCII7', text_cache=None,
+                          first_pages=None, data=None, hint=None, ocr=None, info=None,
+                          columnar_lines=False):
+    """
+    Same as `extract_data`.
+
+    Returns:
+        tuple: the template that matched or None, and the extracted data
+            or False
+    """
+    start = clock()
+    with profiling.document(invoicefile):
+        t, res = _extract_data(invoicefile, templates, encoding, text_cache, first_pages, data,
+                               hint, ocr, info, columnar_lines)
+    if summary_logger.isEnabledFor(logging.INFO):
+        log_summary(invoicefile, t, res, clock() - start)
+    return t, res
+
+
+def document_summary(invoicefile, t, res, seconds):
+    """
+    Returns:
+        dict: file, status ('extracted', 'no template' or 'failed'),
+            template name or None, extracted fields, fields of the template
+            that weren't found, number of lines and seconds
+    """
+    if res:
+        status = 'extracted'
+    elif t is None:
+        status = 'no template'
     else:
-        extracted_str = pdftotext.to_text(invoicefile, encoding=encoding)
+        status = 'failed'
+    res = res or {}
+    fields = sorted(k for k in res if k != 'lines')
+    missing = []
+    if t is not None:
+        missing = [k for k in t['fields'] if not k.startswith('static_') and k not in res]
+    return {
+        'file': invoicefile,
+        'status': status,
+        'template': t and t['template_name'],
+        'fields': fields,
+        'missing': missing,
+        'lines': len(res.get('lines', ())),
+        'seconds': seconds,
+    }
+
+
+def log_summary(invoicefile, t, res, seconds):
+    """
+    Log one record per document on the `invoice2data.summary` logger,
+    with the `document_summary` as `document` attribute.
+    """
+    summary = document_summary(invoicefile, t, res, seconds)
+    summary_logger.info(
+        '%s: %s, template %s, %d fields, missing %s, %d lines, %.1f ms',
+        invoicefile, summary['status'], summary['template'], len(summary['fields']),
+        ', '.join(summary['missing']) or 'none', summary['lines'], seconds * 1000,
+        extra={'document': summary})
 
-    if encoding=='ASCII7':
-        extracted_str = replace_unicode_characters(extracted_str)
-
-    charcount = len(extracted_str)
-    logger.debug('number of char in pdf2text extract: %d', charcount)
-    # Disable Tesseract for now.
-    #if charcount < 40:
-        #logger.info('Starting OCR')
-        #extracted_str = image_to_text.to_text(invoicefile)
-    logger.debug('START pdftotext result ===========================')
-    logger.debug(extracted_str)
-    logger.debug('END pdftotext result =============================')
-
-    logger.debug('Testing {} template files'.format(len(templates)))
-    for t in templates:
-        logger.debug('Trying template {}'.format(t))
-        optimized_str = t.prepare_input(extracted_str)
 
-        if t.matches_input(optimized_str):
-            return t.extract(optimized_str)
+def _extract_data(invoicefile, templates, encoding, text_cache, first_pages, data, hint, ocr,
+                  info, columnar_lines):
+    if templates is None:
+        templates = builtin_templates()
+    templates = template_index(templates)
+
+    is_pdf = not invoicefile.lower().endswith(".txt")
+    extracted_str = None
+    if first_pages and is_pdf:
+        partial_str = read_text(invoicefile, encoding, text_cache, last_page=first_pages, data=data,
+                                info=info)
+        # The info dictionary is already read.
+        info = None
+        if needs_ocr(partial_str, ocr):
+            return _extract_ocr(invoicefile, templates, encoding, text_cache, data, hint, ocr,
+                                columnar_lines)
+        if partial_str.count('\f') < first_pages:
+            # The document doesn't have more pages.
+            extracted_str = partial_str
+        else:
+            found = _match_first_pages(templates, partial_str, first_pages, hint,
+                                       columnar_lines)
+            if found:
+                return found
+
+    if extracted_str is None:
+        extracted_str = read_text(invoicefile, encoding, text_cache, data=data, info=info)
+
+    logger.debug('number of char in pdf2text extract: %d', len(extracted_str))
+    if is_pdf and needs_ocr(extracted_str, ocr):
+        return _extract_ocr(invoicefile, templates, encoding, text_cache, data, hint, ocr,
+                            columnar_lines)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug('START pdftotext result ===========================\n%s\n'
+                     'END pdftotext result =============================', extracted_str)
+
+    return _match_and_extract(invoicefile, templates, extracted_str, hint, columnar_lines)
+
+
+def _match_first_pages(templates, partial_str, first_pages, hint, columnar_lines):
+    """
+    Returns:
+        tuple: the template and the extracted data if the first pages are
+            enough, else None
+    """
+    t, optimized_str = match_template(templates, partial_str, hint)
+    if t is None:
+        logger.debug('No template on the first %d pages', first_pages)
+    elif 'lines' in t:
+        logger.debug('Template %s has lines', t['template_name'])
+    else:
+        missing = t.missing_fields(optimized_str)
+        if not missing:
+            templates.add_hit(t)
+            return t, t.extract(optimized_str, columnar_lines)
+        logger.debug('Fields %s not on the first %d pages', missing, first_pages)
+    logger.debug('Reading the whole document')
+    return None
+
+
+def _match_and_extract(invoicefile, templates, extracted_str, hint, columnar_lines):
+    logger.debug('Testing %d template files', len(templates))
+    t, optimized_str = match_template(templates, extracted_str, hint)
+    if t is not None:
+        templates.add_hit(t)
+        return t, t.extract(optimized_str, columnar_lines)
 
     logger.error('No template for %s', invoicefile)
-    return False
+    return None, False
+
+
+def _extract_ocr(invoicefile, templates, encoding, text_cache, data, hint, ocr, columnar_lines):
+    """OCR the first pages to match a template, then the others if needed."""
+    logger.info('Starting OCR of %s', invoicefile)
+    first_pages = ocr.first_pages
+    info = {}
+    extracted_str = read_ocr_text(invoicefile, ocr, encoding, text_cache, last_page=first_pages,
+                                  data=data, info=info)
+    if first_pages and info.get('Pages', 0) > first_pages:
+        found = _match_first_pages(templates, extracted_str, first_pages, hint, columnar_lines)
+        if found:
+            return found
+        extracted_str += read_ocr_text(invoicefile, ocr, encoding, text_cache,
+                                       first_page=first_pages + 1, data=data)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug('START OCR result ===========================\n%s\n'
+                     'END OCR result =============================', extracted_str)
+
+    return _match_and_extract(invoicefile, templates, extracted_str, hint, columnar_lines)
+
 
 def main():
     "Take folder or single file and analyze each."
@@ -98,68 +363,234 @@ def main():
     parser.add_argument('--output-directory', type=str, default='.', dest='output_dir',
                         help='Out directory for the report files.')
 
+    parser.add_argument('--jobs', '-j', type=int, default=1, dest='jobs',
+                        help='Number of worker processes.')
+
+    parser.add_argument('--keep-order', dest='keep_order', default=False, action='store_true',
+                        help='Report files in input order when using several jobs.')
+
+    parser.add_argument('--timeout', type=int, dest='timeout',
+                        help='Give up a file after this many seconds.')
+
+    parser.add_argument('--prefetch', type=int, dest='prefetch',
+                        help='With one job, run pdftotext on the next N files while '
+                             'templates are matched.')
+
+    parser.add_argument('--columnar-lines', dest='columnar_lines', default=False,
+                        action='store_true',
+                        help='Keep the invoice lines by column instead of a dict per line, '
+                             'for invoices with very many lines.')
+
+    parser.add_argument('--text-cache', nargs='?', const=DEFAULT_CACHE_FOLDER, dest='text_cache',
+                        help='Cache extracted text in this folder (default: %s).' % DEFAULT_CACHE_FOLDER)
+
+    parser.add_argument('--text-cache-size', type=int, default=DEFAULT_CACHE_SIZE // 2**20,
+                        dest='text_cache_size', help='Maximum size of the text cache in MB.')
+
+    parser.add_argument('--clear-text-cache', dest='clear_text_cache', default=False,
+                        action='store_true',
+                        help='Empty the text cache before processing, with --text-cache.')
+
+    parser.add_argument('--first-pages', type=int, dest='first_pages',
+                        help='Match templates on the first N pages, read the rest only if needed.')
+
+    parser.add_argument('--template-cache', nargs='?', const=join(CACHE_ROOT, 'templates'),
+                        dest='template_cache',
+                        help='Keep parsed templates in this folder (default: %s).' % join(CACHE_ROOT, 'templates'))
+
+    parser.add_argument('--incremental', nargs='?', const=DEFAULT_MANIFEST, dest='incremental',
+                        help='Only extract new or changed files, keep results in this '
+                             'manifest (default: %s).' % DEFAULT_MANIFEST)
+
+    parser.add_argument('--adaptive-order', dest='adaptive_order', default=False,
+                        action='store_true',
+                        help='Try the templates that matched most often first.')
+
+    parser.add_argument('--template-hits', dest='template_hits',
+                        help='Keep the matches per template in this JSON file across runs '
+                             '(implies --adaptive-order).')
+
+    parser.add_argument('--hint', dest='hints', action='append', default=[],
+                        metavar='REGEX=TEMPLATE',
+                        help='Try this template name or issuer first for the file names '
+                             'matching the regex. Can be repeated.')
+
+    parser.add_argument('--ocr', dest='ocr', default=False, action='store_true',
+                        help='Read the PDFs with too little text with tesseract. The first pages '
+                             '(see --first-pages, default 1) are read to match a template, the '
+                             'others only if needed.')
+
+    parser.add_argument('--ocr-min-chars', type=int, dest='ocr_min_chars', default=40,
+                        help='OCR the PDFs with fewer non-blank characters than this.')
+
+    parser.add_argument('--ocr-dpi', type=int, dest='ocr_dpi', default=350,
+                        help='Resolution the pages are rendered at for OCR.')
+
+    parser.add_argument('--ocr-jobs', type=int, dest='ocr_jobs',
+                        help='Pages read in parallel by OCR (default: number of CPUs). '
+                             'Use 1 with --jobs.')
+
+    parser.add_argument('--ocr-lang', dest='ocr_lang',
+                        help='Languages of tesseract, like deu+eng.')
+
+    parser.add_argument('--regex-timeout', type=float, dest='regex_timeout',
+                        help='Give each regex of the templates at most this many seconds.')
+
+    parser.add_argument('--regex-timeout-action', dest='regex_timeout_action', default='skip',
+                        choices=budget.ACTIONS,
+                        help='Skip the field of a regex out of time, or abort its template.')
+
+    parser.add_argument('--command-timeout', type=float, dest='command_timeout',
+                        help='Kill pdftotext, pdfinfo and OCR commands after this many seconds.')
+
+    parser.add_argument('--command-memory', type=int, dest='command_memory',
+                        help='Limit the address space of these commands to this many MB.')
+
+    parser.add_argument('--command-cpu', type=int, dest='command_cpu',
+                        help='Limit the CPU time of these commands to this many seconds.')
+
+    parser.add_argument('--profile', dest='profile', default=False, action='store_true',
+                        help='Print the time spent per stage, template and file.')
+
+    parser.add_argument('--profile-json', dest='profile_json',
+                        help='Write the profile summary to this JSON file.')
+
     parser.add_argument('input_directory', help='Input directory with PDF files to analyze.')
 
     args = parser.parse_args()
 
+    hints = []
+    for hint in args.hints:
+        if '=' not in hint:
+            parser.error('--hint must be REGEX=TEMPLATE, not %r' % hint)
+        hints.append(tuple(hint.rsplit('=', 1)))
+    if args.clear_text_cache and not args.text_cache:
+        parser.error('--clear-text-cache needs --text-cache')
+
     if args.debug:
         logging.basicConfig(level=logging.DEBUG)
     else:
         logging.basicConfig(level=logging.INFO)
 
-    templates = []
+    from invoice2data.batch import extract_files, load_templates
+
+    profile = None
+    if args.profile or args.profile_json:
+        profile = profiling.enable()
+
+    ocr = None
+    if args.ocr:
+        ocr = tesseract.OcrOptions(args.ocr_min_chars, args.ocr_dpi, args.ocr_jobs, args.ocr_lang,
+                                   args.first_pages or 1)
+
+    regex_budget = None
+    if args.regex_timeout:
+        regex_budget = budget.enable(args.regex_timeout, args.regex_timeout_action)
+
+    command_limits = None
+    if args.command_timeout or args.command_memory or args.command_cpu:
+        command_limits = supervise.enable(args.command_timeout, args.command_memory,
+                                          args.command_cpu)
+
+    text_cache = None
+    if args.text_cache:
+        text_cache = TextCache(os.path.abspath(args.text_cache), args.text_cache_size * 2**20)
+        if args.clear_text_cache:
+            text_cache.clear()
+
+    template_folders = []
 
     # Load templates from external folder if set.
     if args.template_folder:
-        templates += read_templates(os.path.abspath(args.template_folder))
+        template_folders.append(os.path.abspath(args.template_folder))
 
     # Load internal templates, if not disabled.
     if not args.exclude_built_in_templates:
-        templates += read_templates(pkg_resources.resource_filename('invoice2data', 'templates'))
+        template_folders.append(builtin_templates_folder())
 
-    output = []
-    out_per_issuer = dict()
     if args.input_files:
         files = args.input_files
     else:
         files = glob.iglob(args.input_directory + '/*.'+args.extension)
 
-    for file_name in files:
-        logging.info("processing file %s" % file_name)
-        res = extract_data(file_name, templates=templates, encoding=args.encoding)
-
-        if res:
-            if res['issuer'] in out_per_issuer.keys():
-                out_per_issuer[res['issuer']].append(res)
-            else:
-                out_per_issuer[res['issuer']] = [res]
-
-            if args.include_file_name:
-                basename = os.path.basename(file_name)
-                res['file_name'] = basename
-                pdf_file_name = basename.replace('.txt','.pdf')
-                res['hyperlink'] =  '=HYPERLINK("%s", "%s")' % ('Q:\\'+pdf_file_name, basename[11:27])
-
-            try:
-                pdf_title = pdftotext.get_document_title(file_name)
-                logging.info("file title: %s" % pdf_title)
-                res['title'] = pdf_title
-            except:
-                logging.info("%s doesn't have a title... using filename instaed" % file_name)
-                res['title'] = file_name
-            logger.info(res)
-            output.append(res)
-            if args.copy:
-                filename = FILENAME.format(
-                    date=res['date'].strftime('%Y-%m-%d'),
-                    desc=res['desc'])
-                shutil.copyfile(f.name, join(args.copy, filename))
+    hits = None
+    if args.template_hits:
+        hits = read_hits(args.template_hits)
+    elif args.adaptive_order:
+        hits = Counter()
+
+    manifest = None
+    stored = []
+    if args.incremental:
+        templates = load_templates(template_folders, args.template_cache)
+        manifest = Manifest(args.incremental, templates,
+                            settings=(args.encoding, args.first_pages, args.include_file_name,
+                                      regex_budget, ocr and ocr._replace(jobs=None),
+                                      args.columnar_lines))
+        stored, files = manifest.split(files)
 
     if args.report_per_vendor:
-        for issuer, invoices in out_per_issuer.iteritems():
-            write_issuer_invoices(issuer, invoices, args.encoding, args.output_dir)
+        report = IssuerCsvWriter(args.output_dir, args.encoding)
     else:
-        invoices_to_csv(output, os.path.join(args.output_dir, 'invoices-output.csv'))
+        report = InvoicesCsvWriter(os.path.join(args.output_dir, 'invoices-output.csv'))
+
+    results = extract_files(files, template_folders, jobs=args.jobs, keep_order=args.keep_order,
+                            encoding=args.encoding, timeout=args.timeout, text_cache=text_cache,
+                            template_cache=args.template_cache, first_pages=args.first_pages,
+                            profile=profile, with_template=True, with_title=True, hits=hits,
+                            hints=hints, regex_budget=regex_budget, ocr=ocr,
+                            prefetch=args.prefetch, command_limits=command_limits,
+                            columnar_lines=args.columnar_lines)
+    try:
+        with report:
+            for file_name in stored:
+                res = manifest.result(file_name)
+                if res:
+                    logger.info(res)
+                    report.write(res)
+
+            for file_name, res, error, template_name, pdf_title in results:
+                if res:
+                    if args.include_file_name:
+                        basename = os.path.basename(file_name)
+                        res['file_name'] = basename
+                        pdf_file_name = basename.replace('.txt','.pdf')
+                        res['hyperlink'] =  '=HYPERLINK("%s", "%s")' % ('Q:\\'+pdf_file_name, basename[11:27])
+
+                    if pdf_title:
+                        logger.info("file title: %s", pdf_title)
+                        res['title'] = pdf_title
+                    else:
+                        logger.info("%s doesn't have a title... using filename instaed", file_name)
+                        res['title'] = file_name
+                    logger.info(res)
+                    report.write(res)
+                    if args.copy:
+                        filename = FILENAME.format(
+                            date=res['date'].strftime('%Y-%m-%d'),
+                            desc=res['desc'])
+                        shutil.copyfile(f.name, join(args.copy, filename))
+                if manifest is not None:
+                    manifest.store(file_name, template_name, res, error)
+                if hits is not None and template_name:
+                    hits[template_name] += 1
+    finally:
+        if manifest is not None:
+            manifest.close()
+
+    logger.debug('Normalization cache: %d hits, %d misses',
+                 normalization_stats['hits'], normalization_stats['misses'])
+    logger.debug('Dates: %d fast, %d cached, %d dateparser, %d failed',
+                 date_stats['fast'], date_stats['cached'], date_stats['dateparser'],
+                 date_stats['failed'])
+
+    if args.template_hits:
+        write_hits(args.template_hits, hits)
+
+    if args.profile:
+        print(profile.report())
+    if args.profile_json:
+        profile.to_json(args.profile_json)
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,182 @@
+"""
+Manifest of the files already processed, for incremental runs.
+
+For each file it keeps the size, mtime and SHA-256 of the content, the
+template that matched with a fingerprint of it, and the result. A file is
+extracted again when:
+
+- it is new, or its content changed;
+- the template that matched it changed or was removed;
+- no template matched it and the set of templates changed;
+- it failed (error or timeout) last time;
+- it was extracted with other settings: encoding, `first_pages`, OCR,
+  regex budget, columnar lines...
+
+A new template placed before the one that matched a file doesn't make
+the file run again: delete the manifest for a full run. The stored
+results only go to the reports: files aren't copied again (`--copy`).
+"""
+
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+from invoice2data.cache import CACHE_ROOT
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PATH = os.path.join(CACHE_ROOT, 'manifest.sqlite')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    size INTEGER,
+    mtime REAL,
+    sha256 TEXT,
+    template TEXT,
+    template_version TEXT,
+    templates_version TEXT,
+    settings TEXT,
+    result BLOB,
+    error TEXT
+)
+"""
+
+# Rows stored between two commits.
+COMMIT_EVERY = 100
+
+
+def template_fingerprint(template):
+    """
+    Returns:
+        str: a hash of everything in the template, including its name
+    """
+    dump = json.dumps(template, sort_keys=True, default=repr)
+    return hashlib.sha1(dump.encode('utf-8')).hexdigest()
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class Manifest(object):
+    """
+    sqlite file of the processed files, keyed by absolute path.
+
+    Args:
+        path (str): the sqlite file, created if needed
+        templates (list[InvoiceTemplate]): the templates of this run, in order
+        settings (tuple): anything else that changes the results, like the
+            encoding
+    """
+
+    def __init__(self, path, templates, settings=()):
+        self.path = path
+        self.versions = {}
+        digest = hashlib.sha1()
+        for template in templates:
+            fingerprint = template_fingerprint(template)
+            self.versions.setdefault(template['template_name'], fingerprint)
+            digest.update(fingerprint.encode('ascii'))
+        self.templates_version = digest.hexdigest()
+        self.settings = repr(tuple(settings))
+        # Absolute path -> (size, mtime, sha256) of the files to extract.
+        self._pending = {}
+        self._uncommitted = 0
+
+        folder = os.path.dirname(os.path.abspath(path))
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        self.db = sqlite3.connect(path)
+        self.db.execute(SCHEMA)
+
+    def _is_current(self, row, sha256):
+        (old_sha256, template, template_version, templates_version, settings, error) = row
+        if old_sha256 != sha256 or settings != self.settings or error is not None:
+            return False
+        if template is not None:
+            return self.versions.get(template) == template_version
+        return templates_version == self.templates_version
+
+    def split(self, files):
+        """
+        Returns:
+            tuple: list of the files that don't need to be extracted
+                again, see `result`, and list of the other files
+        """
+        done = []
+        todo = []
+        for file_name in files:
+            path = os.path.abspath(file_name)
+            stat = os.stat(path)
+            row = self.db.execute(
+                'SELECT size, mtime, sha256, template, template_version, templates_version, '
+                'settings, error FROM files WHERE path = ?', (path,)).fetchone()
+            if row is not None and (row[0], row[1]) == (stat.st_size, stat.st_mtime):
+                sha256 = row[2]
+            else:
+                sha256 = file_sha256(path)
+            if row is not None and self._is_current(row[2:], sha256):
+                if (row[0], row[1]) != (stat.st_size, stat.st_mtime):
+                    self.db.execute('UPDATE files SET size = ?, mtime = ? WHERE path = ?',
+                                    (stat.st_size, stat.st_mtime, path))
+                done.append(file_name)
+            else:
+                self._pending[path] = (stat.st_size, stat.st_mtime, sha256)
+                todo.append(file_name)
+        logger.info('Manifest: %d files unchanged, %d to extract', len(done), len(todo))
+        return done, todo
+
+    def result(self, file_name):
+        """
+        Returns:
+            dict: the stored result of a file, or False
+        """
+        row = self.db.execute('SELECT result FROM files WHERE path = ?',
+                              (os.path.abspath(file_name),)).fetchone()
+        return pickle.loads(bytes(row[0]))
+
+    def store(self, file_name, template_name, result, error=None):
+        """
+        Keep the result of a file returned by `split`.
+
+        Args:
+            template_name (str): name of the template that matched, or None
+            result (dict): extracted data, or False
+            error (str): why the file failed, if it did
+        """
+        path = os.path.abspath(file_name)
+        size, mtime, sha256 = self._pending.pop(path)
+        self.db.execute(
+            'INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (path, size, mtime, sha256, template_name, self.versions.get(template_name),
+             self.templates_version, self.settings,
+             sqlite3.Binary(pickle.dumps(result, pickle.HIGHEST_PROTOCOL)), error))
+        self._uncommitted += 1
+        if self._uncommitted >= COMMIT_EVERY:
+            self.commit()
+
+    def commit(self):
+        self.db.commit()
+        self._uncommitted = 0
+
+    def close(self):
+        self.commit()
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -1,10 +1,87 @@
+"""
+CSV reports, written while the invoices are extracted.
+
+`InvoicesCsvWriter` writes one row per invoice as it comes.
+`IssuerCsvWriter` needs the columns of all the rows of an issuer before
+the header: the rows are spilled to a temporary file per issuer and the
+union of their columns, with the type of each column, is kept in memory.
+The files are written on `close`, reading back one row at a time.
+Invoices whose `lines` are a `LineItems` are spilled whole and written
+column by column, without a dict per row.
+
+The per-issuer files are the same as `pandas.DataFrame(rows)
+.set_index(['title', 'invoice_number']).to_csv()` used to write, except
+that strings holding a date don't turn a column of datetimes into dates,
+and an issuer without rows or `invoice_number` gets a file instead of
+an error.
+"""
+
+import csv
+import datetime
+import itertools
 import logging
+import numbers
 import os
+import sys
+import tempfile
+from collections import OrderedDict
 
-import csv
-import pandas as pd
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+from invoice2data.lines import LineItems
+from invoice2data.utils import remove_empty_lines
+
+PY2 = sys.version_info[0] == 2
+
+if PY2:
+    zip = itertools.izip
+
+text_type = type(u'')
+
+logger = logging.getLogger(__name__)
+
+INDEX_COLUMNS = ['title', 'invoice_number']
+
+# Range of the datetimes pandas stores as datetime64[ns].
+DATETIME_YEARS = (1678, 2261)
+
+# Time part of the datetimes, by `_Column.time_unit`.
+TIME_UNITS = (None, 'seconds', 'milliseconds', 'microseconds')
+
+# Strings pandas reads as a missing datetime.
+NAT_STRINGS = frozenset(['', 'NaT', 'nat', 'NAT', 'nan', 'NaN', 'NAN'])
+
+
+class InvoicesCsvWriter(object):
+    """
+    Writes the date, desc and amount of each invoice to a CSV file.
+
+    Args:
+        path (str): a path for the output CSV file
+    """
+
+    def __init__(self, path):
+        self.file = open(path, "w")
+        self.writer = csv.writer(self.file, delimiter=',')
+        self.writer.writerow(['date', 'desc', 'amount'])
+
+    def write(self, invoice):
+        self.writer.writerow([
+            invoice['date'].strftime('%d/%m/%Y'),
+            invoice['desc'],
+            invoice['amount']])
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
 
-from utils import remove_empty_lines
+    def __exit__(self, *exc_info):
+        self.close()
 
 
 def invoices_to_csv(data, path):
@@ -15,15 +92,360 @@ def invoices_to_csv(data, path):
         path (str): a path for the output CSV file
 
     """
-    with open(path, "w") as csv_file:
-        writer = csv.writer(csv_file, delimiter=',')
-
-        writer.writerow(['date', 'desc', 'amount'])
+    with InvoicesCsvWriter(path) as writer:
         for line in data:
-            writer.writerow([
-                line['date'].strftime('%d/%m/%Y'),
-                line['desc'],
-                line['amount']])
+            writer.write(line)
+
+
+class _Column(object):
+    """
+    What was seen in a column: `kinds` of values (see `value_kind`), number
+    of rows with a value and, for datetimes, the smallest time unit used.
+    """
+
+    __slots__ = ('kinds', 'count', 'time_unit', 'leading_nat')
+
+    def __init__(self):
+        self.kinds = set()
+        self.count = 0
+        self.time_unit = 0
+        # pandas gives up on datetimes after 3 strings without one.
+        self.leading_nat = 0
+
+    def add(self, value):
+        kind = value_kind(value)
+        self.kinds.add(kind)
+        self.count += 1
+        if kind == 'nat' and 'datetime' not in self.kinds:
+            self.leading_nat += 1
+        if kind == 'datetime':
+            if value.microsecond % 1000:
+                unit = 3
+            elif value.microsecond:
+                unit = 2
+            elif value.hour or value.minute or value.second:
+                unit = 1
+            else:
+                unit = 0
+            self.time_unit = max(self.time_unit, unit)
+
+    def dtype(self, row_count):
+        """
+        Returns:
+            str: 'int', 'float', 'bool', 'datetime' or 'object', as pandas
+                infers it from the values
+        """
+        kinds = self.kinds
+        if self.count < row_count:
+            # pandas fills the missing values with NaN.
+            kinds = kinds | {'nan'}
+        if 'datetime' in kinds:
+            if kinds <= {'datetime', 'date', 'nat', 'nan', 'none'} and self.leading_nat < 3:
+                return 'datetime'
+            return 'object'
+        if kinds & {'object', 'date', 'nat'}:
+            return 'object'
+        if 'bool' in kinds:
+            return 'bool' if kinds == {'bool'} else 'object'
+        if kinds == {'int'}:
+            return 'int'
+        if kinds & {'int', 'float', 'nan'}:
+            return 'float'
+        return 'object'
+
+
+def value_kind(value):
+    if value is None:
+        return 'none'
+    if isinstance(value, bool):
+        return 'bool'
+    if isinstance(value, numbers.Integral):
+        return 'int'
+    if isinstance(value, float):
+        return 'nan' if value != value else 'float'
+    if (isinstance(value, datetime.datetime) and value.tzinfo is None and
+            DATETIME_YEARS[0] <= value.year <= DATETIME_YEARS[1]):
+        return 'datetime'
+    if isinstance(value, datetime.date) and not isinstance(value, datetime.datetime):
+        return 'date'
+    if isinstance(value, (str, text_type)) and value in NAT_STRINGS:
+        return 'nat'
+    return 'object'
+
+
+def formatter(dtype, time_unit):
+    """
+    Returns:
+        function: value or None if missing -> cell
+    """
+    if dtype == 'float':
+        return _format_float
+    if dtype in ('int', 'bool'):
+        return str
+    if dtype == 'datetime':
+        unit = TIME_UNITS[time_unit]
+        return lambda value: _format_datetime(value, unit)
+    return _format_object
+
+
+def _is_missing(value):
+    return value is None or (isinstance(value, float) and value != value)
+
+
+def _format_float(value):
+    if _is_missing(value):
+        return ''
+    return repr(float(value))
+
+
+def _format_datetime(value, unit):
+    if not isinstance(value, datetime.date):
+        return ''
+    cell = '%04d-%02d-%02d' % (value.year, value.month, value.day)
+    if unit is None:
+        return cell
+    if not isinstance(value, datetime.datetime):
+        value = datetime.datetime.combine(value, datetime.time())
+    cell += ' %02d:%02d:%02d' % (value.hour, value.minute, value.second)
+    if unit == 'milliseconds':
+        cell += '.%03d' % (value.microsecond // 1000)
+    elif unit == 'microseconds':
+        cell += '.%06d' % value.microsecond
+    return cell
+
+
+def _format_object(value):
+    if _is_missing(value):
+        return ''
+    return value
+
+
+def _open_csv(path, encoding):
+    """
+    Returns:
+        tuple: the file and a function encoding the cells of a row, or None
+    """
+    if not PY2:
+        return open(path, 'w', encoding=encoding, newline=''), None
+    if encoding == 'ascii':
+        return open(path, 'w'), None
+
+    def encode(row):
+        # Same as the UnicodeWriter of pandas: byte strings are taken as UTF-8.
+        return [cell.decode('utf-8').encode(encoding) if isinstance(cell, str)
+                else text_type(cell).encode(encoding) for cell in row]
+
+    return open(path, 'w'), encode
+
+
+class IssuerRows(object):
+    """
+    Rows of an issuer, pickled to a temporary file, and their columns.
+    """
+
+    def __init__(self):
+        self.file = tempfile.TemporaryFile()
+        self.count = 0
+        # Pickled rows and invoices with `LineItems`.
+        self.entries = 0
+        self.columns = {}
+        self.names = []
+        self.ordered = False
+
+    def column(self, name):
+        try:
+            return self.columns[name]
+        except KeyError:
+            column = self.columns[name] = _Column()
+            self.names.append(name)
+            return column
+
+    def append(self, row):
+        pickle.dump(row, self.file, pickle.HIGHEST_PROTOCOL)
+        self.entries += 1
+        self.count += 1
+        # Like pandas, keep the column order of ordered dicts.
+        self.ordered = self.ordered or isinstance(row, OrderedDict)
+        for name, value in row.items():
+            self.column(name).add(value)
+
+    def append_lines(self, invoice):
+        """
+        Add the rows of an invoice whose `lines` are a `LineItems`, the
+        same as appending each of `invoice_rows(invoice)`.
+        """
+        invoice = invoice.copy()
+        invoice.pop('desc', None)
+        lines = invoice.pop('lines')
+        columns = list(lines.columns.values())
+        # Same as `remove_empty_lines`.
+        kept = [index for index in range(len(lines))
+                if any(column[index] for column in columns)]
+        if not kept:
+            return
+        pickle.dump((invoice, lines, kept), self.file, pickle.HIGHEST_PROTOCOL)
+        self.entries += 1
+        self.count += len(kept)
+        self.ordered = self.ordered or isinstance(invoice, OrderedDict)
+
+        # Line fields in the order rows would show them first.
+        first_index = {}
+        for position, (name, column) in enumerate(lines.columns.items()):
+            if name in invoice:
+                continue
+            index = next((index for index in kept if column[index] is not None), None)
+            if index is not None:
+                first_index[name] = (index, position)
+        names = list(invoice) + sorted(first_index, key=first_index.get)
+        for name, values in zip(names, _invoice_columns(invoice, lines, kept, names)):
+            column = self.column(name)
+            for value in values:
+                if value is not None or name in invoice:
+                    column.add(value)
+
+    def __iter__(self):
+        """
+        Yields:
+            the pickled rows, and (invoice, lines, kept line indexes) of
+                the invoices added with `append_lines`
+        """
+        self.file.seek(0)
+        for _ in range(self.entries):
+            yield pickle.load(self.file)
+
+    def cells(self, header):
+        """
+        Yields:
+            list: the values of each row for the columns in `header`, None
+                if missing
+        """
+        for entry in self:
+            if isinstance(entry, tuple):
+                invoice, lines, kept = entry
+                for values in zip(*_invoice_columns(invoice, lines, kept, header)):
+                    yield values
+            else:
+                yield [entry.get(name) for name in header]
+
+    def header(self):
+        names = list(self.names)
+        if not self.ordered:
+            try:
+                names.sort()
+            except TypeError:
+                pass
+        return INDEX_COLUMNS + [name for name in names if name not in INDEX_COLUMNS]
+
+    def write_csv(self, path, encoding):
+        header = self.header()
+        dtypes = dict((name, column.dtype(self.count))
+                      for name, column in self.columns.items() if name not in INDEX_COLUMNS)
+        # pandas formats all the datetime columns together, with the time
+        # unit the most precise of them needs.
+        time_unit = max([self.columns[name].time_unit
+                         for name, dtype in dtypes.items() if dtype == 'datetime'] or [0])
+        formatters = [formatter(dtypes.get(name, 'object'), time_unit) for name in header]
+
+        csv_file, encode = _open_csv(path, encoding)
+        with csv_file:
+            writer = csv.writer(csv_file, lineterminator='\n')
+            writer.writerow(header)
+            for values in self.cells(header):
+                cells = [format_value(value) for value, format_value in zip(values, formatters)]
+                if encode is not None:
+                    cells = encode(cells)
+                writer.writerow(cells)
+
+    def close(self):
+        self.file.close()
+
+
+def _invoice_columns(invoice, lines, kept, names):
+    """
+    Returns:
+        list: for each name, the values of the rows of the `kept` lines:
+            the field of the line if it has one, else of the invoice
+    """
+    columns = []
+    for name in names:
+        column = lines.columns.get(name)
+        default = invoice.get(name)
+        if column is None:
+            columns.append(itertools.repeat(default, len(kept)))
+        elif default is None:
+            columns.append([column[index] for index in kept])
+        else:
+            columns.append([default if column[index] is None else column[index]
+                            for index in kept])
+    return columns
+
+
+def invoice_rows(invoice):
+    """
+    Returns:
+        list[dict]: the invoice without `desc`, once per non-empty line if
+            it has `lines`. See `IssuerRows.append_lines` for `LineItems`.
+    """
+    invoice = invoice.copy()
+    invoice.pop('desc', None)
+    if 'lines' not in invoice:
+        return [invoice]
+    rows = []
+    for line in remove_empty_lines(invoice.pop('lines')):
+        row = invoice.copy()
+        row.update(line)
+        rows.append(row)
+    return rows
+
+
+class IssuerCsvWriter(object):
+    """
+    Writes the invoices of each issuer to `<issuer>_summary.csv`, with a
+    row per invoice line.
+
+    Args:
+        output_dir (str): directory for the output files
+        encoding (str): text encoding
+    """
+
+    def __init__(self, output_dir, encoding):
+        self.output_dir = output_dir
+        if encoding in ('ASCII7', None):
+            encoding = 'ascii'
+        self.encoding = encoding
+        self.issuers = {}
+
+    def write(self, invoice, issuer=None):
+        if issuer is None:
+            issuer = invoice['issuer']
+        try:
+            rows = self.issuers[issuer]
+        except KeyError:
+            rows = self.issuers[issuer] = IssuerRows()
+        if isinstance(invoice.get('lines'), LineItems):
+            rows.append_lines(invoice)
+            return
+        for row in invoice_rows(invoice):
+            rows.append(row)
+
+    def close(self):
+        for issuer, rows in sorted(self.issuers.items()):
+            out_filename = os.path.join(self.output_dir, (issuer + "_summary.csv").replace(' ', '_'))
+            logger.info("Writing output summary for %s into %s", issuer, out_filename)
+            try:
+                rows.write_csv(out_filename, self.encoding)
+            except UnicodeDecodeError:
+                logger.warning('Encoding error for file %s', out_filename)
+                rows.write_csv(out_filename, 'ascii')
+            finally:
+                rows.close()
+        self.issuers = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
 
 
 def write_issuer_invoices(issuer, invoices, encoding, output_dir):
@@ -34,44 +456,6 @@ def write_issuer_invoices(issuer, invoices, encoding, output_dir):
         encoding (str): text encoding
         output_dir (str): directory for the output files
     """
-
-    # if there are 'lines' we look for the union of the fields names
-    has_lines = False
-    for invoice in invoices:
-         if 'lines' in invoice:
-             logging.info("lines is in invoice")
-             has_lines = True
-             break
-
-    rows = []
-    for invoice in invoices:
-        try:    
-            invoice.pop("desc")
-        except:
-            pass
-        if has_lines:
-            try:
-                lines = remove_empty_lines(invoice.pop("lines"))
-                for line in lines:
-                    full_line = invoice.copy()
-                    full_line.update(line)
-                    rows.append(full_line)
-            except KeyError as ke:
-                logging.warning('No lines found: %s',ke)
-                #print(invoice)
-                rows.append(invoice)
-        else:
-            rows.append(invoice)
-            
-    out_filename = os.path.join(output_dir ,(issuer + "_summary.csv").replace(' ', '_'))
-    logging.info("Writing output summary for %s into %s" % (issuer, out_filename))
-    summary = pd.DataFrame(rows).set_index(['title', 'invoice_number'])
-    if encoding == 'ASCII7':
-        encoding = 'ascii'
-    try:
-        summary.to_csv(out_filename, index=True, encoding=encoding)
-    except UnicodeDecodeError:
-        logging.warning('Encoding error for file %s' % out_filename)
-        summary.to_csv(out_filename, index=True)
-
-    
+    with IssuerCsvWriter(output_dir, encoding) as writer:
+        for invoice in invoices:
+            writer.write(invoice, issuer)
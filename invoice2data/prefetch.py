@@ -0,0 +1,85 @@
+"""
+Read-ahead of pdftotext in a single process.
+
+With `extract_files(..., jobs=1, prefetch=N)`, pdftotext and pdfinfo run
+in threads for the next N files while the templates are matched against
+the current one. The subprocesses don't hold the GIL, so waiting for
+them overlaps with the regex work without worker processes. Their output
+is handed over in a `PrefetchCache`.
+
+The `pdftotext` times of the profile are recorded when the read-ahead
+runs, so they count for the file being matched at that moment.
+"""
+
+import logging
+import threading
+from collections import OrderedDict, deque
+from multiprocessing.pool import ThreadPool
+
+from invoice2data.cache import content_key
+
+logger = logging.getLogger(__name__)
+
+
+class PrefetchCache(object):
+    """
+    Text cache keeping texts in memory until they are read once, in
+    front of an optional `TextCache`. At most `size` texts are kept.
+    """
+
+    def __init__(self, cache=None, size=64):
+        self.cache = cache
+        self.size = size
+        self._texts = OrderedDict()
+        self._lock = threading.Lock()
+
+    def key(self, data, backend, *flags):
+        return content_key(data, backend, *flags)
+
+    def get(self, key):
+        with self._lock:
+            text = self._texts.pop(key, None)
+        if text is None and self.cache is not None:
+            return self.cache.get(key)
+        return text
+
+    def set(self, key, text):
+        with self._lock:
+            self._texts[key] = text
+            while len(self._texts) > self.size:
+                self._texts.popitem(last=False)
+        if self.cache is not None:
+            self.cache.set(key, text)
+
+
+def read_ahead(items, read, ahead):
+    """
+    Yield the items in order, each once `read(item)` has returned, with
+    `read` running for up to `ahead` next items in threads. Exceptions
+    of `read` are logged and ignored: the item is read again when it is
+    processed.
+    """
+    pool = ThreadPool(ahead)
+    pending = deque()
+    try:
+        for item in items:
+            pending.append((item, pool.apply_async(_read, (read, item))))
+            if len(pending) > ahead:
+                item, result = pending.popleft()
+                result.wait()
+                yield item
+        while pending:
+            item, result = pending.popleft()
+            result.wait()
+            yield item
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def _read(read, item):
+    try:
+        read(item)
+    except Exception:
+        logger.debug('Reading %s ahead failed', item, exc_info=True)
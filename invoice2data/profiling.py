@@ -0,0 +1,312 @@
+"""
+Wall time per processing stage, per template and per file.
+
+Profiling is off unless `enable` was called. The hooks then cost one
+global lookup per call, so they can stay in the code.
+
+Stages are nested: `extract` includes `fields`, `dates` and `lines`,
+and `document` is the whole `extract_data` call.
+
+A `Profile` keeps running totals, not each timing, so its size doesn't
+grow with the number of files: the percentiles come from a histogram
+with buckets about 5% wide, and only the slowest files are kept.
+"""
+
+import functools
+import heapq
+import json
+import math
+import timeit
+from collections import defaultdict
+
+clock = timeit.default_timer
+
+# Stages summed up for the slowest templates. The others are nested in
+# these, or shared by the templates with the same input options.
+TEMPLATE_STAGES = ('matches_input', 'extract')
+
+# Times in [BUCKET_BASE ** i, BUCKET_BASE ** (i + 1)) seconds go to the
+# bucket i of the histogram of their stage.
+BUCKET_BASE = 1.05
+MIN_SECONDS = 1e-9
+
+# Slowest files kept for the summary.
+MAX_FILES = 100
+
+# The `Profile` of this process, None while profiling is off.
+_current = None
+
+
+def enable():
+    """Start profiling in this process, return the `Profile`."""
+    global _current
+    if _current is None:
+        _current = Profile()
+    return _current
+
+
+def disable():
+    """Stop profiling, return the `Profile` (or None)."""
+    global _current
+    profile, _current = _current, None
+    return profile
+
+
+def current():
+    return _current
+
+
+class _NullTimer(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+NULL_TIMER = _NullTimer()
+
+
+class _Timer(object):
+
+    def __init__(self, profile, stage, template):
+        self.profile = profile
+        self.stage = stage
+        self.template = template
+
+    def __enter__(self):
+        self.start = clock()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.profile.add(self.stage, clock() - self.start, self.template)
+        return False
+
+
+class _DocumentTimer(object):
+
+    def __init__(self, profile, file_name):
+        self.profile = profile
+        self.file_name = file_name
+
+    def __enter__(self):
+        self.profile.file_name = self.file_name
+        self.profile.templates_tried = 0
+        self.start = clock()
+        return self
+
+    def __exit__(self, *exc_info):
+        profile = self.profile
+        seconds = clock() - self.start
+        profile.add('document', seconds)
+        profile.add_document(self.file_name, seconds, profile.templates_tried)
+        profile.file_name = None
+        return False
+
+
+def timer(stage, template=None):
+    """
+    Context manager that records the time spent in the block.
+
+    Args:
+        stage (str): name of the stage
+        template (str): name of the template the time is spent for
+    """
+    if _current is None:
+        return NULL_TIMER
+    return _Timer(_current, stage, template)
+
+
+def document(file_name):
+    """Context manager around the processing of one file."""
+    if _current is None:
+        return NULL_TIMER
+    return _DocumentTimer(_current, file_name)
+
+
+def template_tried():
+    """Count a template checked against the current file."""
+    if _current is not None:
+        _current.templates_tried += 1
+
+
+def timed(stage):
+    """
+    Decorator for `InvoiceTemplate` methods: record the time of each call
+    for the template it is called on.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            profile = _current
+            if profile is None:
+                return func(self, *args, **kwargs)
+            start = clock()
+            try:
+                return func(self, *args, **kwargs)
+            finally:
+                profile.add(stage, clock() - start, self.get('template_name'))
+        return wrapper
+    return decorator
+
+
+def percentile(values, percent):
+    """Nearest-rank percentile of a sorted list."""
+    if not values:
+        return 0.0
+    rank = int(math.ceil(percent / 100.0 * len(values))) - 1
+    return values[max(rank, 0)]
+
+
+def histogram_percentile(histogram, count, percent):
+    """
+    Nearest-rank percentile of the times counted in a histogram.
+
+    Returns:
+        float: upper bound of the bucket of the percentile
+    """
+    if not count:
+        return 0.0
+    rank = max(int(math.ceil(percent / 100.0 * count)), 1)
+    seen = 0
+    for index in sorted(histogram):
+        seen += histogram[index]
+        if seen >= rank:
+            break
+    return BUCKET_BASE ** (index + 1)
+
+
+class Profile(object):
+    """
+    Timings of one process, added up. Timings from worker processes are
+    added with `merge(worker_profile.pop())`.
+    """
+
+    def __init__(self):
+        self._reset()
+        self.file_name = None
+        self.templates_tried = 0
+
+    def _reset(self):
+        # Stage -> [count, total, max, {histogram bucket: count}]
+        self.stages = {}
+        # Template -> seconds in `TEMPLATE_STAGES`
+        self.templates = defaultdict(float)
+        # Heap of the slowest (seconds, file, number of templates tried)
+        self.documents = []
+        # Files, sum and max of the templates tried per file
+        self.tried = [0, 0, 0]
+
+    def add(self, stage, seconds, template=None):
+        stats = self.stages.get(stage)
+        if stats is None:
+            stats = self.stages[stage] = [0, 0.0, 0.0, {}]
+        stats[0] += 1
+        stats[1] += seconds
+        stats[2] = max(stats[2], seconds)
+        index = int(math.floor(math.log(max(seconds, MIN_SECONDS), BUCKET_BASE)))
+        stats[3][index] = stats[3].get(index, 0) + 1
+        if template is not None and stage in TEMPLATE_STAGES:
+            self.templates[template] += seconds
+
+    def add_document(self, file_name, seconds, templates_tried):
+        self._keep_document((seconds, file_name, templates_tried))
+        self._add_tried(1, templates_tried, templates_tried)
+
+    def _keep_document(self, document):
+        if len(self.documents) < MAX_FILES:
+            heapq.heappush(self.documents, document)
+        elif document > self.documents[0]:
+            heapq.heapreplace(self.documents, document)
+
+    def _add_tried(self, files, total, most):
+        tried = self.tried
+        tried[0] += files
+        tried[1] += total
+        tried[2] = max(tried[2], most)
+
+    def pop(self):
+        """Return and forget the timings recorded so far."""
+        data = {'stages': self.stages, 'templates': dict(self.templates),
+                'documents': self.documents, 'tried': self.tried}
+        self._reset()
+        return data
+
+    def merge(self, data):
+        for stage, (count, total, most, histogram) in data['stages'].items():
+            stats = self.stages.get(stage)
+            if stats is None:
+                stats = self.stages[stage] = [0, 0.0, 0.0, {}]
+            stats[0] += count
+            stats[1] += total
+            stats[2] = max(stats[2], most)
+            for index, n in histogram.items():
+                stats[3][index] = stats[3].get(index, 0) + n
+        for template, seconds in data['templates'].items():
+            self.templates[template] += seconds
+        for document in data['documents']:
+            self._keep_document(tuple(document))
+        self._add_tried(*data['tried'])
+
+    def summary(self, top=10):
+        """
+        Aggregate the timings.
+
+        Returns:
+            dict: `stages` with count, total, p50, p95 and max seconds per
+                stage, the `top` slowest `templates` and `files` (at most
+                `MAX_FILES`)
+        """
+        stages = {}
+        for stage, (count, total, most, histogram) in self.stages.items():
+            stages[stage] = {
+                'count': count,
+                'total': total,
+                'p50': min(histogram_percentile(histogram, count, 50), most),
+                'p95': min(histogram_percentile(histogram, count, 95), most),
+                'max': most,
+            }
+
+        templates = sorted(self.templates.items(), key=lambda item: -item[1])[:top]
+        files = sorted(self.documents, reverse=True)[:top]
+        files_count, tried, most_tried = self.tried
+        return {
+            'stages': stages,
+            'templates': [{'template': name, 'total': total} for name, total in templates],
+            'files': [{'file': name, 'seconds': seconds, 'templates_tried': count}
+                      for seconds, name, count in files],
+            'templates_tried': {
+                'mean': float(tried) / files_count if files_count else 0.0,
+                'max': most_tried,
+            },
+        }
+
+    def to_json(self, path, top=10):
+        with open(path, 'w') as f:
+            json.dump(self.summary(top), f, indent=2, sort_keys=True)
+
+    def report(self, top=10):
+        """Return the summary as a text table, times in milliseconds."""
+        summary = self.summary(top)
+        lines = ['%-16s %8s %10s %9s %9s %9s' % (
+            'stage', 'count', 'total', 'p50', 'p95', 'max')]
+        for stage, s in sorted(summary['stages'].items(), key=lambda item: -item[1]['total']):
+            lines.append('%-16s %8d %10.1f %9.2f %9.2f %9.2f' % (
+                stage, s['count'], s['total'] * 1e3,
+                s['p50'] * 1e3, s['p95'] * 1e3, s['max'] * 1e3))
+        lines.append('')
+        lines.append('templates tried per file: %.1f mean, %d max' % (
+            summary['templates_tried']['mean'], summary['templates_tried']['max']))
+        if summary['templates']:
+            lines.append('')
+            lines.append('slowest templates (total ms):')
+            for t in summary['templates']:
+                lines.append('  %10.1f  %s' % (t['total'] * 1e3, t['template']))
+        if summary['files']:
+            lines.append('')
+            lines.append('slowest files (ms, templates tried):')
+            for f in summary['files']:
+                lines.append('  %10.1f  %4d  %s' % (
+                    f['seconds'] * 1e3, f['templates_tried'], f['file']))
+        return '\n'.join(lines)
@@ -0,0 +1,217 @@
+"""
+Supervised external commands: pdftotext, pdfinfo, pdftoppm, tesseract.
+
+Limits are off unless `enable` was called. Each command then gets a wall
+clock timeout, after which it is killed and reaped, and on Unix a cap on
+its address space and CPU time. These are set by `ulimit` in a shell
+that then execs the command: unlike `preexec_fn`, this is safe while
+other threads start commands (pdfinfo, read ahead, OCR pages).
+
+`run` returns a `CommandResult` in all cases; a failed text extraction
+raises `CommandFailed` with it, which the batch functions report as the
+error of the file.
+
+Commands still running when a file is given up (`--timeout`) are killed
+with `kill_running`.
+"""
+
+import logging
+import os
+import subprocess
+import threading
+import timeit
+from collections import namedtuple
+
+clock = timeit.default_timer
+
+logger = logging.getLogger(__name__)
+
+
+class Limits(namedtuple('Limits', 'seconds memory cpu')):
+    """
+    Limits of each command.
+
+    Args:
+        seconds (float): wall clock time
+        memory (int): address space in MB
+        cpu (int): CPU time in seconds
+    """
+
+    __slots__ = ()
+
+    def __new__(cls, seconds=None, memory=None, cpu=None):
+        return super(Limits, cls).__new__(cls, seconds, memory, cpu)
+
+
+# The `Limits` of this process, None while limits are off.
+_current = None
+
+# Commands running in this process, and calls to `kill_running` so far.
+_running = set()
+_running_lock = threading.Lock()
+_kills = 0
+
+POSIX = os.name == 'posix'
+
+
+def enable(seconds=None, memory=None, cpu=None):
+    """
+    Limit each command started in this process.
+
+    Returns:
+        Limits
+    """
+    global _current
+    _current = Limits(seconds, memory, cpu)
+    return _current
+
+
+def disable():
+    """Stop the limits, return the `Limits` (or None)."""
+    global _current
+    limits, _current = _current, None
+    return limits
+
+
+def current():
+    return _current
+
+
+class CommandResult(namedtuple('CommandResult', 'args returncode out err seconds timed_out')):
+    """
+    Outcome of `run`.
+
+    Attributes:
+        args (list[str]): the command
+        returncode (int): exit code, negative for the signal that killed it
+        out (bytes): standard output
+        err (bytes): standard error
+        seconds (float): wall clock time
+        timed_out (bool): the command was killed after the timeout
+    """
+
+    __slots__ = ()
+
+    @property
+    def failed(self):
+        return self.timed_out or self.returncode != 0
+
+    def describe(self):
+        """One line about the failure, like 'pdftotext timed out after 30 s'."""
+        name = self.args[0]
+        if self.timed_out:
+            return '%s timed out after %.3g s' % (name, self.seconds)
+        if self.returncode < 0:
+            return '%s killed by signal %d (memory or CPU limit?)' % (name, -self.returncode)
+        message = '%s exited with %d' % (name, self.returncode)
+        lines = self.err.decode('utf-8', 'replace').strip().splitlines()
+        if lines:
+            message += ': %s' % lines[-1]
+        return message
+
+
+class CommandFailed(EnvironmentError):
+    """A command failed, timed out or hit a limit."""
+
+    def __init__(self, result):
+        EnvironmentError.__init__(self, result.describe())
+        self.result = result
+
+    def __str__(self):
+        return self.result.describe()
+
+
+def _with_limits(args, limits):
+    """
+    Returns:
+        list: `args` run by a shell that sets the limits with `ulimit`
+    """
+    script = []
+    if limits.memory:
+        script.append('ulimit -v %d' % (limits.memory * 1024))
+    if limits.cpu:
+        # SIGXCPU at the soft limit, SIGKILL a second later.
+        # The soft limit first: a hard limit below it is rejected.
+        script.append('ulimit -S -t %d' % limits.cpu)
+        script.append('ulimit -H -t %d' % (limits.cpu + 1))
+    script.append('exec "$@"')
+    return ['sh', '-c', '; '.join(script), 'sh'] + list(args)
+
+
+def _kill(process):
+    try:
+        process.kill()
+    except OSError:
+        # Already exited.
+        pass
+
+
+def run(args, data=None, env=None, limits=None):
+    """
+    Run a command with the limits, feeding it `data` on its standard input.
+
+    Args:
+        limits (Limits): defaults to the ones given to `enable`
+
+    Returns:
+        CommandResult
+    """
+    if limits is None:
+        limits = _current or Limits()
+    command = args
+    if POSIX and (limits.memory or limits.cpu):
+        command = _with_limits(args, limits)
+
+    kills = _kills
+    start = clock()
+    # Without close_fds, a command started meanwhile by another thread
+    # keeps the pipes of this one open on Python 2, and communicate waits
+    # for it too.
+    process = subprocess.Popen(
+        command, stdin=subprocess.PIPE if data is not None else None, stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE, env=env, close_fds=POSIX)
+    with _running_lock:
+        _running.add(process)
+        if _kills != kills:
+            # `kill_running` was called while it started.
+            _kill(process)
+    timed_out = []
+    timer = None
+    try:
+        if limits.seconds:
+            def expire():
+                timed_out.append(True)
+                _kill(process)
+            timer = threading.Timer(limits.seconds, expire)
+            timer.daemon = True
+            timer.start()
+        out, err = process.communicate(data)
+    except BaseException:
+        # Given up, eg. by the timeout of the file: don't leave it running.
+        _kill(process)
+        process.wait()
+        raise
+    finally:
+        if timer is not None:
+            timer.cancel()
+        with _running_lock:
+            _running.discard(process)
+
+    result = CommandResult(list(args), process.returncode, out, err, clock() - start,
+                           bool(timed_out))
+    if result.failed:
+        logger.warning('%s', result.describe())
+    return result
+
+
+def kill_running():
+    """
+    Kill the commands running in this process. Each is reaped by the
+    thread waiting for it in `run`.
+    """
+    global _kills
+    with _running_lock:
+        _kills += 1
+        processes = list(_running)
+    for process in processes:
+        _kill(process)
@@ -4,17 +4,25 @@ This module abstracts templates for invoice providers.
 Templates are initially read from .yml files and then kept as class.
 """
 
-import yaml
+import hashlib
 import os
 import re
-import dateparser
-from unidecode import unidecode
-import unicode
-import logging as logger
-from collections import OrderedDict
+import tempfile
+import logging
+from collections import OrderedDict, Counter
 
-# from invoice2data.utils import ordered_load
-from utils import ordered_load
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+from invoice2data import budget, coerce, profiling, unicode
+from invoice2data.budget import RegexTimeout
+from invoice2data.dates import parse_date
+from invoice2data.lines import LineItems, LineScanner, join_values
+from invoice2data.utils import ordered_load
+
+logger = logging.getLogger(__name__)
 
 OPTIONS_DEFAULT = {
     'remove_whitespace': False,
@@ -23,6 +31,7 @@ OPTIONS_DEFAULT = {
     'currency': 'EUR',
     'date_formats': [],
     'languages': [],
+    'detect_language': True,  # let dateparser guess when `languages` is empty
     'decimal_separator': '.',
     'replace': [],  # example: see templates/fr/fr.free.mobile.yml
     'field_separator': r'\s+',
@@ -30,36 +39,133 @@ OPTIONS_DEFAULT = {
     'append_separator': ' '
 }
 
-def read_templates(folder):
+# Keys of the `lines` section that hold a regex.
+LINES_PATTERNS = ['start', 'end', 'line', 'first_line', 'last_line', 'ignore_line']
+
+MULTIPLE_SPACES = re.compile(' +')
+
+# Bump when the format of parsed templates changes.
+TEMPLATE_CACHE_VERSION = 1
+
+# Totals of all `PreparedInput` instances in this process.
+normalization_stats = Counter()
+
+def read_templates(folder, cache_folder=None):
     """
     Load yaml templates from template folder. Return list of dicts.
+
+    Args:
+        folder (str): folder with .yml templates, read recursively
+        cache_folder (str): keep parsed templates in this folder, so
+            unchanged template files aren't parsed again
     """
-    output = []
+    paths = []
     for path, subdirs, files in os.walk(folder):
         for name in sorted(files):
             if name.endswith('.yml'):
-                tpl = ordered_load(open(os.path.join(path, name)).read())
-                tpl['template_name'] = name
+                paths.append(os.path.join(path, name))
 
-                # Test if all required fields are in template:
-                assert 'keywords' in tpl.keys(), 'Missing keywords field.'
-                required_fields = ['date', 'amount', 'invoice_number']
-                assert len(set(required_fields).intersection(tpl['fields'].keys())) == len(required_fields), \
-                    'Missing required key in template {} {}. Found {}'.format(name, path, tpl['fields'].keys())
+    cached = {}
+    cache_path = None
+    if cache_folder:
+        cache_path = os.path.join(cache_folder, 'templates-%s.pickle' % hashlib.sha1(
+            os.path.abspath(folder).encode('utf-8')).hexdigest()[:16])
+        cached = load_template_cache(cache_path)
 
-                # Keywords as list, if only one.
-                if type(tpl['keywords']) is not list:
-                    tpl['keywords'] = [tpl['keywords']]
-
-                if 'lines' in tpl:
-                    assert 'start' in tpl['lines'], 'Lines start regex missing'
-                    assert 'end' in tpl['lines'], 'Lines end regex missing'
-                    assert 'line' in tpl['lines'], 'Line regex missing'
+    output = []
+    entries = {}
+    changed = False
+    for tpl_path in paths:
+        stat = os.stat(tpl_path)
+        stamp = (stat.st_mtime, stat.st_size)
+        if tpl_path in cached and cached[tpl_path][0] == stamp:
+            tpl = cached[tpl_path][1]
+        else:
+            tpl = parse_template(tpl_path)
+            changed = True
+        entries[tpl_path] = (stamp, tpl)
+        output.append(InvoiceTemplate(tpl))
 
-                output.append(InvoiceTemplate(tpl))
+    if cache_path and (changed or set(entries) != set(cached)):
+        save_template_cache(cache_path, entries)
     return output
 
 
+def parse_template(tpl_path):
+    """Parse and check a single .yml template."""
+    path, name = os.path.split(tpl_path)
+    with open(tpl_path) as f:
+        tpl = ordered_load(f.read())
+    tpl['template_name'] = name
+
+    # Test if all required fields are in template:
+    assert 'keywords' in tpl.keys(), 'Missing keywords field.'
+    required_fields = ['date', 'amount', 'invoice_number']
+    assert len(set(required_fields).intersection(tpl['fields'].keys())) == len(required_fields), \
+        'Missing required key in template {} {}. Found {}'.format(name, path, tpl['fields'].keys())
+
+    # Keywords as list, if only one.
+    if type(tpl['keywords']) is not list:
+        tpl['keywords'] = [tpl['keywords']]
+
+    if 'lines' in tpl:
+        assert 'start' in tpl['lines'], 'Lines start regex missing'
+        assert 'end' in tpl['lines'], 'Lines end regex missing'
+        assert 'line' in tpl['lines'], 'Line regex missing'
+
+    return tpl
+
+
+def load_template_cache(cache_path):
+    """Return {path: ((mtime, size), template data)} from a cache file."""
+    try:
+        with open(cache_path, 'rb') as f:
+            version, entries = pickle.load(f)
+    except Exception:
+        return {}
+    if version != TEMPLATE_CACHE_VERSION:
+        return {}
+    return entries
+
+
+def save_template_cache(cache_path, entries):
+    folder = os.path.dirname(cache_path)
+    if not os.path.isdir(folder):
+        os.makedirs(folder)
+    # Write and rename, in case several processes refresh the cache.
+    fd, tmp_path = tempfile.mkstemp(dir=folder, prefix='.tmp')
+    with os.fdopen(fd, 'wb') as f:
+        pickle.dump((TEMPLATE_CACHE_VERSION, entries), f, pickle.HIGHEST_PROTOCOL)
+    os.rename(tmp_path, cache_path)
+
+
+class PreparedInput(object):
+    """
+    The variants of one extracted text, as returned by `prepare_input`.
+
+    Templates with the same `input_key` share a variant, so each variant is
+    computed once per document.
+    """
+
+    def __init__(self, extracted_str):
+        self.extracted_str = extracted_str
+        self.variants = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, template):
+        """Return the text as prepared for the given template."""
+        key = template.input_key
+        if key in self.variants:
+            self.hits += 1
+            normalization_stats['hits'] += 1
+            return self.variants[key]
+        self.misses += 1
+        normalization_stats['misses'] += 1
+        optimized_str = self.variants[key] = template.prepare_input(self.extracted_str)
+        return optimized_str
+
+
 class InvoiceTemplate(OrderedDict):
     """
     Represents single template files that live as .yml files on the disk.
@@ -77,10 +183,44 @@ class InvoiceTemplate(OrderedDict):
         if 'options' in self:
             self.options.update(self['options'])
 
+        # Options that change the output of `prepare_input`.
+        self.input_key = (
+            bool(self.options['remove_whitespace']),
+            bool(self.options['remove_accents']),
+            bool(self.options['lowercase']),
+            tuple(tuple(replace) for replace in self.options['replace']))
+
         # Set issuer, if it doesn't exist.
         if 'issuer' not in self.keys():
             self['issuer'] = self['keywords'][0]
 
+        self.compile_patterns()
+
+    def compile_patterns(self):
+        """
+        Compile all regexes of the template once, so extraction doesn't
+        depend on the (small) cache of the `re` module.
+        """
+        self.keyword_patterns = [re.compile(k) for k in self['keywords']]
+
+        # Fields can have multiple expressions, static fields have none.
+        self.field_patterns = OrderedDict()
+        for k, v in self['fields'].items():
+            if k.startswith('static_'):
+                continue
+            if type(v) is not list:
+                v = [v]
+            self.field_patterns[k] = [re.compile(v_option, re.DOTALL) for v_option in v]
+
+        self.lines_patterns = {}
+        if 'lines' in self:
+            for k in LINES_PATTERNS:
+                if k in self['lines']:
+                    self.lines_patterns[k] = re.compile(self['lines'][k])
+        self.line_scanner = LineScanner(self.lines_patterns)
+        self.line_separator = re.compile(self.options['line_separator'])
+
+    @profiling.timed('prepare_input')
     def prepare_input(self, extracted_str):
         """
         Input raw string and do transformations, as set in template file.
@@ -88,7 +228,7 @@ class InvoiceTemplate(OrderedDict):
 
         # Remove withspace
         if self.options['remove_whitespace']:
-            optimized_str = re.sub(' +', '', extracted_str)
+            optimized_str = MULTIPLE_SPACES.sub('', extracted_str)
         else:
             optimized_str = extracted_str
 
@@ -107,55 +247,49 @@ class InvoiceTemplate(OrderedDict):
 
         return optimized_str
 
+    @profiling.timed('matches_input')
     def matches_input(self, optimized_str):
         """See if string matches keywords set in template file"""
 
         if all([keyword in optimized_str for keyword in self['keywords']]):
-            logger.info('Matched template %s', self['template_name'])
+            logger.debug('Matched template %s', self['template_name'])
             return True
 
-        if all([re.search(k,optimized_str) for k in self['keywords']]):
-            logger.info('Matched template %s', self['template_name'])
+        if all([k.search(optimized_str) for k in self.keyword_patterns]):
+            logger.debug('Matched template %s', self['template_name'])
             return True
 
+    def missing_fields(self, optimized_str):
+        """Names of the fields none of whose regexes match the string."""
+        return [k for k, patterns in self.field_patterns.items()
+                if not any(p.search(optimized_str) for p in patterns)]
+
     def parse_number(self, value):
-        assert value.count(self.options['decimal_separator']) < 2,\
-            'Decimal separator cannot be present several times'
-        # remove dollar sign if it's there
-        value = value.replace('$','')
-        # replace decimal separator by a |
-        amount_pipe = value.replace(self.options['decimal_separator'], '|')
-        # remove all possible thousands separators
-        amount_pipe_no_thousand_sep = re.sub(
-            '[.,\s]', '', amount_pipe)
-        # put dot as decimal sep
-        return float(amount_pipe_no_thousand_sep.replace('|', '.'))
+        return coerce.parse_number(value, self.options['decimal_separator'])
 
     def coerce_type(self, value, target_type):
-        if target_type == 'int':
-            if not value.strip():
-                return 0
-            return int(self.parse_number(value))
-        elif target_type == 'float':
-            if not value.strip():
-                return 0.0
-            return float(self.parse_number(value))
-        assert False, 'Unknown type'
-
-    def extract(self, optimized_str):
+        return coerce.coerce(value, target_type, self.options['decimal_separator'])
+
+    @profiling.timed('extract')
+    def extract(self, optimized_str, columnar_lines=False):
         """
         Given a template file and a string, extract matching data fields.
+
+        Args:
+            columnar_lines (bool): `lines` as `LineItems` instead of a list
+                of dicts, see `invoice2data.lines`
         """
 
-        logger.debug('START optimized_str ========================')
-        logger.debug(optimized_str)
-        logger.debug('END optimized_str ==========================')
-        logger.debug(
-            'Date parsing: languages=%s date_formats=%s',
-            self.options['languages'], self.options['date_formats'])
-        logger.debug('Float parsing: decimal separator=%s', self.options['decimal_separator'])
-        logger.debug("keywords=%s", self['keywords'])
-        logger.debug(self.options)
+        debug = logger.isEnabledFor(logging.DEBUG)
+        if debug:
+            logger.debug('START optimized_str ========================\n%s\n'
+                         'END optimized_str ==========================', optimized_str)
+            logger.debug(
+                'Date parsing: languages=%s date_formats=%s',
+                self.options['languages'], self.options['date_formats'])
+            logger.debug('Float parsing: decimal separator=%s', self.options['decimal_separator'])
+            logger.debug("keywords=%s", self['keywords'])
+            logger.debug('%s', self.options)
 
         # Try to find data for each field.
         output = {}
@@ -163,27 +297,38 @@ class InvoiceTemplate(OrderedDict):
 
         for k, v in self['fields'].items():
             if k.startswith('static_'):
-                logger.debug("field=%s | static value=%s", k, v)
+                if debug:
+                    logger.debug("field=%s | static value=%s", k, v)
                 output[k.replace('static_', '')] = v
             else:
-                logger.debug("field=%s | regexp=%s", k, v)
+                if debug:
+                    logger.debug("field=%s | regexp=%s", k, v)
 
                 # Fields can have multiple expressions
-                if type(v) is list:
-                    for v_option in v:
-                        res_find = re.findall(v_option, optimized_str, re.DOTALL)
-                        if res_find:
-                            break
-                else:
-                    res_find = re.findall(v, optimized_str, re.DOTALL)
+                with profiling.timer('fields', self['template_name']):
+                    try:
+                        for v_option in self.field_patterns[k]:
+                            with budget.guard(self['template_name'], k, v_option.pattern):
+                                res_find = v_option.findall(optimized_str)
+                            if res_find:
+                                break
+                    except RegexTimeout as err:
+                        logger.error('%s', err)
+                        if budget.current().action == 'abort':
+                            return None
+                        res_find = []
                 if res_find:
-                    logger.debug("res_find=%s", res_find)
+                    if debug:
+                        logger.debug("res_find=%s", res_find)
                     if k.startswith('date'):
                         raw_date = res_find[0]
-                        output[k] = dateparser.parse(
-                            raw_date, date_formats=self.options['date_formats'],
-                            languages=self.options['languages'])
-                        logger.debug("result of date parsing=%s", output[k])
+                        with profiling.timer('dates', self['template_name']):
+                            output[k] = parse_date(
+                                raw_date, date_formats=self.options['date_formats'],
+                                languages=self.options['languages'],
+                                detect_language=self.options['detect_language'])
+                        if debug:
+                            logger.debug("result of date parsing=%s", output[k])
                         if not output[k]:
                             logger.error(
                                 "Date parsing failed on date '%s'", raw_date)
@@ -192,11 +337,18 @@ class InvoiceTemplate(OrderedDict):
                         output[k] = self.parse_number(res_find[0])
                     else:
                         output[k] = res_find[0]
-                else:
-                    logger.warning("regexp for field %s didn't match", k)
+                elif debug:
+                    # Listed in the summary of the document.
+                    logger.debug("regexp for field %s didn't match", k)
 
         if 'lines' in self:
-            self.extract_lines(optimized_str, output)
+            try:
+                with budget.guard(self['template_name'], 'lines'):
+                    self.extract_lines(optimized_str, output, columnar_lines)
+            except RegexTimeout as err:
+                logger.error('%s', err)
+                if budget.current().action == 'abort':
+                    return None
 
         output['currency'] = self.options['currency']
 
@@ -204,100 +356,95 @@ class InvoiceTemplate(OrderedDict):
             try:
                 output['desc'] = 'Invoice %s from %s' % (
                     output['invoice_number'], self['issuer'])
-                logger.debug(output)
+                if debug:
+                    logger.debug('%s', output)
                 return output
             except KeyError as err:
-                logger.warning("Failed to process file: %s" % err)
+                logger.warning("Failed to process file: %s", err)
                 return output
         else:
-            logger.error("Only %s keys in output: %s" % (len(output.keys()), output.keys()) )
+            logger.error("Only %s keys in output: %s", len(output.keys()), output.keys())
             return None
 
-    def extract_lines(self, content, output):
-        """Try to extract lines from the invoice"""
-        start = re.search(self['lines']['start'], content)
+    @profiling.timed('lines')
+    def extract_lines(self, content, output, columnar=False):
+        """
+        Try to extract lines from the invoice
+
+        Args:
+            columnar (bool): store the lines as `LineItems` instead of a
+                list of dicts
+        """
+        patterns = self.lines_patterns
+        start = patterns['start'].search(content)
         if start==None:
-            logger.warn("Could not match 'start' line.")
+            logger.warning("Could not match 'start' line.")
             return
-        end = re.search(self['lines']['end'], content[start.end():])
+        end = patterns['end'].search(content[start.end():])
         if end==None:
-            logger.warn("Could not match 'end' line.")
+            logger.warning("Could not match 'end' line.")
             return
         _end_start = end.start() + start.end()
         if not start or not end:
             logger.warning('no lines found - start %s, end %s', start, end)
             return
         content = content[start.end():_end_start]
-        content_lines = re.split(self.options['line_separator'], content)
-        logger.info("content has %s characters and %s lines" % (len(content),len(content_lines)))
-        lines = []
-        current_row = {}
+        content_lines = self.line_separator.split(content)
+        debug = logger.isEnabledFor(logging.DEBUG)
+        if debug:
+            logger.debug("content has %s characters and %s lines", len(content), len(content_lines))
+        classify = self.line_scanner.classify
         separator = self.options['append_separator']
         if separator == 'newline':
             separator = '\n'
+        lines = LineItems() if columnar else []
+
+        def add_row(row):
+            lines.append({field: join_values(values, separator) for field, values in row.items()})
+
+        # Field -> list of values of the current row, joined when it ends.
+        current_row = {}
         for line in content_lines:
-            logger.debug('Lines[ ]: %s', line)
-            if "ignore_line" in self['lines']:
-                match = re.search(self['lines']['ignore_line'], line)
-                if match:
-                    logger.debug("Lines[ignore]: %s",line)
-                    continue
-            if 'first_line' in self['lines']:
-                match = re.search(self['lines']['first_line'], line)
-                if match:
-                    logger.debug("Lines[first]: %s",line)
-                    if current_row:
-                        lines.append(current_row)
-                    current_row = {
-                        field: value.strip()
-                        for field, value in match.groupdict().items()
-                        if value != None
-                    }
-                    continue
-            if 'last_line' in self['lines']:
-                match = re.search(self['lines']['last_line'], line)
-                if match:
-                    logger.debug("Lines[last]: %s",line)
-                    for field, value in match.groupdict().items():
-                        try:
-                            value = value.strip()
-                        except AttributeError as err:
-                            logger.warning("Couldn't find value for %s: %s" % (field, err))
-                            value = ''
-                        current_row[field] = '%s%s%s' % (
-                            current_row.get(field, ''),
-                            current_row.get(field, '') and separator or '',
-                            value
-                            )
-                    lines.append(current_row)
-                    current_row = {}
-                    continue
-            match = re.search(self['lines']['line'], line)
-            if match:
-                logger.debug("Lines[line]: %s",line)
-                for field, value in match.groupdict().items():
-                    try:
-                        value = value.strip()
-                    except AttributeError as err:
-                        logger.warning("Couldn't find value for %s: %s" % (field, err))
-                        value = ''
-                    current_row[field] = '%s%s%s' % (
-                        current_row.get(field, ''),
-                        current_row.get(field, '') and separator or '',
-                        value
-                        )
+            if debug:
+                logger.debug('Lines[ ]: %s', line)
+            kind, match = classify(line)
+            if kind is None:
+                if debug:
+                    logger.debug(
+                        'ignoring "%s" because it doesn\'t match anything', line
+                    )
                 continue
-            logger.debug(
-                'ignoring "%s" because it doesn\'t match anything', line
-            )
+            if debug:
+                logger.debug("Lines[%s]: %s", kind.replace('_line', ''), line)
+            if kind == 'ignore_line':
+                continue
+            if kind == 'first_line':
+                if current_row:
+                    add_row(current_row)
+                current_row = {
+                    field: [value.strip()]
+                    for field, value in match.groupdict().items()
+                    if value != None
+                }
+                continue
+            for field, value in match.groupdict().items():
+                try:
+                    value = value.strip()
+                except AttributeError as err:
+                    logger.warning("Couldn't find value for %s: %s", field, err)
+                    value = ''
+                current_row.setdefault(field, []).append(value)
+            if kind == 'last_line':
+                add_row(current_row)
+                current_row = {}
         if current_row:
-            lines.append(current_row)
+            add_row(current_row)
 
-        types = self['lines'].get('types', [])
-        for row in lines:
-            for name in row.keys():
-                if name in types:
-                    row[name] = self.coerce_type(row[name], types[name])
+        types = self['lines'].get('types')
+        if types and columnar:
+            lines.coerce(types, self.options['decimal_separator'])
+        elif types:
+            coerce.coerce_rows(lines, types, self.options['decimal_separator'])
 
         if lines:
             output['lines'] = lines
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+
+import signal
+import unittest
+
+from invoice2data import budget
+from invoice2data.budget import RegexTimeout
+from invoice2data.test.test_template import SAMPLE_TEXT, make_template
+
+# Backtracks exponentially on a run of "a" without "b".
+SLOW_REGEX = r'(a+)+b'
+SLOW_TEXT = SAMPLE_TEXT + 'a' * 40 + 'c'
+
+
+class TestBudget(unittest.TestCase):
+
+    def setUp(self):
+        self.addCleanup(budget.disable)
+
+    def test_guard(self):
+        template = make_template(fields={'amount': SLOW_REGEX})
+        with self.assertRaises(RegexTimeout) as context:
+            with budget.guard('com.acme.yml', 'amount', SLOW_REGEX, seconds=0.05):
+                template.field_patterns['amount'][0].findall(SLOW_TEXT)
+        self.assertEqual(str(context.exception),
+                         'Regex of amount in template com.acme.yml ran longer than 0.05 seconds: '
+                         '(a+)+b')
+
+    def test_outer_timer_kept(self):
+        outer = signal.signal(signal.SIGALRM, signal.SIG_IGN)
+        self.addCleanup(signal.signal, signal.SIGALRM, outer)
+        self.addCleanup(signal.setitimer, signal.ITIMER_REAL, 0)
+        signal.setitimer(signal.ITIMER_REAL, 10)
+        with budget.guard(seconds=0.05):
+            pass
+        self.assertEqual(signal.getsignal(signal.SIGALRM), signal.SIG_IGN)
+        self.assertAlmostEqual(signal.getitimer(signal.ITIMER_REAL)[0], 10, places=1)
+
+        # The outer timer is due first, no budget.
+        self.assertIs(budget.guard(seconds=20), budget.NULL_GUARD)
+
+    def test_extract(self):
+        template = make_template()
+        template['fields']['amount'] = SLOW_REGEX
+        template.compile_patterns()
+        text = template.prepare_input(SLOW_TEXT)
+
+        budget.enable(0.05)
+        res = template.extract(text)
+        self.assertNotIn('amount', res)
+        self.assertEqual(res['invoice_number'], '2017-0042')
+        self.assertEqual(len(res['lines']), 2)
+
+        budget.enable(0.05, 'abort')
+        self.assertIsNone(template.extract(text))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from invoice2data import in_pdftotext, supervise
+from invoice2data.cache import TextCache
+
+
+class TestTextCache(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+        self.cache = TextCache(os.path.join(self.folder, 'cache'), max_size=25)
+
+    def test_key_depends_on_content_and_flags(self):
+        key = self.cache.key(b'%PDF-1.4 a', 'pdftotext', '-layout')
+        self.assertEqual(key, self.cache.key(b'%PDF-1.4 a', 'pdftotext', '-layout'))
+        self.assertNotEqual(key, self.cache.key(b'%PDF-1.4 b', 'pdftotext', '-layout'))
+        self.assertNotEqual(key, self.cache.key(b'%PDF-1.4 a', 'pdftotext', '-raw'))
+
+    def test_get_set(self):
+        self.assertIsNone(self.cache.get('ab12'))
+        self.cache.set('ab12', b'some text')
+        self.assertEqual(self.cache.get('ab12'), b'some text')
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+
+    def test_evict_least_recently_used(self):
+        self.cache.set('aa01', b'0123456789')
+        self.cache.set('aa02', b'0123456789')
+        past = time.time() - 60
+        os.utime(self.cache._path('aa01'), (past, past))
+        os.utime(self.cache._path('aa02'), (past - 60, past - 60))
+        self.cache.get('aa02')
+        self.cache.set('aa03', b'0123456789')
+        self.assertIsNone(self.cache.get('aa01'))
+        self.assertIsNotNone(self.cache.get('aa02'))
+        self.assertIsNotNone(self.cache.get('aa03'))
+
+    def test_evict_below_max_size(self):
+        cache = TextCache(os.path.join(self.folder, 'big'), max_size=100)
+        scans = []
+        entries = cache._entries
+        cache._entries = lambda: scans.append(1) or entries()
+        for i in range(11):
+            cache.set('aa%02d' % i, b'0123456789')
+        self.assertLessEqual(cache.size(), 90)
+        scans[:] = []
+        cache.set('aa11', b'0123456789')
+        self.assertEqual(scans, [])
+
+    def test_to_text_cache_hit_skips_pdftotext(self):
+        pdf = os.path.join(self.folder, 'invoice.pdf')
+        with open(pdf, 'wb') as f:
+            f.write(b'%PDF-1.4 not a real pdf')
+        with open(pdf, 'rb') as f:
+            key = self.cache.key(f.read(), 'pdftotext', '-layout', '-enc', 'ASCII7')
+        self.cache.set(key, b'cached text')
+
+        popen = supervise.subprocess.Popen
+        supervise.subprocess.Popen = None
+        try:
+            self.assertEqual(in_pdftotext.to_text(pdf, cache=self.cache), b'cached text')
+        finally:
+            supervise.subprocess.Popen = popen
+
+
+if __name__ == '__main__':
+    unittest.main()
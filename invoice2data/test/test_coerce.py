@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from invoice2data.coerce import (THOUSANDS_SEPARATORS, coerce, coerce_column, coerce_rows,
+                                 parse_number, remove_separators)
+
+try:
+    unichr
+except NameError:
+    unichr = chr
+
+
+class TestCoerce(unittest.TestCase):
+
+    def test_remove_separators_like_regex(self):
+        text = u''.join(unichr(c) for c in range(0x3100))
+        self.assertEqual(remove_separators(text), THOUSANDS_SEPARATORS.sub(u'', text))
+        data = text[:256].encode('latin-1') if str is bytes else text[:256]
+        self.assertEqual(remove_separators(data), THOUSANDS_SEPARATORS.sub('', data))
+
+    def test_parse_number(self):
+        self.assertEqual(parse_number('$1,234.50'), 1234.5)
+        self.assertEqual(parse_number('1.234,50', ','), 1234.5)
+        self.assertEqual(parse_number(u'1 234,50 ', ','), 1234.5)
+        self.assertRaises(AssertionError, parse_number, '1,234,50', ',')
+        self.assertEqual((coerce(' ', 'int'), coerce('', 'float')), (0, 0.0))
+
+    def test_column_same_as_cells(self):
+        values = ['$1,234.50', '', '  ', '7', '0.25', '1 000']
+        for target_type in ('int', 'float'):
+            expected = [coerce(v, target_type) for v in values]
+            converted = coerce_column(values, target_type)
+            self.assertEqual(converted, expected)
+            self.assertEqual([type(v) for v in converted], [type(v) for v in expected])
+        self.assertIsNone(coerce_column(['1', '$'], 'float'))
+
+    def test_rows_fall_back_to_cells(self):
+        rows = [{'qty': '1', 'price': '2,50'}, {'qty': '', 'price': '1.000,00', 'desc': 'x'}]
+        coerce_rows(rows, {'qty': 'int', 'price': 'float'}, ',')
+        self.assertEqual(rows, [{'qty': 1, 'price': 2.5},
+                                {'qty': 0, 'price': 1000.0, 'desc': 'x'}])
+
+        # Same partial result and error as converting the rows in order.
+        rows = [{'qty': '1'}, {'qty': '$'}, {'qty': '2'}]
+        self.assertRaises(ValueError, coerce_rows, rows, {'qty': 'int'})
+        self.assertEqual(rows, [{'qty': 1}, {'qty': '$'}, {'qty': '2'}])
+        self.assertRaises(AssertionError, coerce_rows, [{'qty': '1.2.3'}, {'qty': '1'}],
+                          {'qty': 'int'})
+
+
+if __name__ == '__main__':
+    unittest.main()
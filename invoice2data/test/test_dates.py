@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+
+import datetime
+import unittest
+
+from invoice2data import dates
+
+
+class TestParseDate(unittest.TestCase):
+
+    def setUp(self):
+        dates.clear_cache()
+        dates.date_stats.clear()
+
+    def test_compile_format(self):
+        self.assertIsNotNone(dates.compile_format('%d/%m/%Y').match('3/04/2017'))
+        self.assertIs(dates.compile_format('%d %B %Y'), dates.NO_MATCH)
+        self.assertIs(dates.compile_format('%Y-%m-%dT'), dates.NO_MATCH)
+        self.assertIsNone(dates.compile_format('%H.%M.%S'))
+        self.assertIsNone(dates.compile_format('%m/%Y'))
+
+    def test_numeric_fast_path(self):
+        self.assertEqual(dates.parse_date('03/04/17', ['%d %B %Y', '%d/%m/%y']),
+                         datetime.datetime(2017, 4, 3))
+        self.assertEqual(dates.parse_date('31.12.1969', ['%d.%m.%Y']),
+                         datetime.datetime(1969, 12, 31))
+        self.assertEqual(dates.date_stats['fast'], 2)
+        self.assertEqual(dates.date_stats['dateparser'], 0)
+
+    def test_same_as_dateparser(self):
+        import dateparser
+
+        for raw, formats in [('03/04/2017', ['%m/%d/%Y']),
+                             ('30/02/2017', ['%d/%m/%Y']),
+                             ('12.30.45', ['%H.%M.%S', '%d.%m.%y']),
+                             ('03/04/2017 ', ['%d/%m/%Y']),
+                             ('3 avril 2017', ['%d %B %Y'])]:
+            self.assertEqual(dates.parse_date(raw, formats, ['fr']),
+                             dateparser.parse(raw, date_formats=formats, languages=['fr']), raw)
+
+    def test_cache(self):
+        first = dates.parse_date('3 April 2017', ['%d %B %Y'], ['en'])
+        self.assertEqual(dates.parse_date('3 April 2017', ['%d %B %Y'], ['en']), first)
+        self.assertEqual(dict(dates.date_stats), {'dateparser': 1, 'cached': 1})
+
+    def test_relative_dates_not_cached_across_days(self):
+        self.addCleanup(setattr, dates, 'today', dates.today)
+        dates.today = lambda: datetime.date(2017, 4, 3)
+        dates.parse_date('yesterday', languages=['en'])
+        dates.today = lambda: datetime.date(2017, 4, 4)
+        dates.parse_date('yesterday', languages=['en'])
+        self.assertEqual(dict(dates.date_stats), {'dateparser': 2})
+
+    def test_no_language_detection(self):
+        self.assertEqual(dates.parse_date('3 April 2017', detect_language=False),
+                         datetime.datetime(2017, 4, 3))
+        self.assertIsNone(dates.parse_date('3 avril 2017', detect_language=False))
+
+
+if __name__ == '__main__':
+    unittest.main()
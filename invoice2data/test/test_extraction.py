@@ -11,12 +11,18 @@
 
 # https://docs.python.org/2/library/unittest.html#test-cases
 
+import logging
 import unittest
 import pkg_resources
 import os
+import shutil
+import tempfile
 
+from invoice2data import batch, main
+from invoice2data.batch import extract_files, extract_many
 from invoice2data.main import extract_data
 from invoice2data.template import read_templates
+from invoice2data.test.test_template import SAMPLE_TEXT, TEMPLATE_YML, make_template
 
 class TestExtraction(unittest.TestCase):
 
@@ -38,5 +44,196 @@ class TestExtraction(unittest.TestCase):
         folder = pkg_resources.resource_filename(__name__, 'pdfs')
         self._run_test_on_folder(folder)
 
+    def test_batch_errors_are_isolated(self):
+        folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, folder)
+        unknown = os.path.join(folder, 'unknown.txt')
+        with open(unknown, 'w') as f:
+            f.write('Not an invoice')
+        missing = os.path.join(folder, 'missing.txt')
+
+        templates_folder = pkg_resources.resource_filename('invoice2data', 'templates')
+        results = list(extract_files([missing, unknown], [templates_folder]))
+        self.assertEqual([r[0] for r in results], [missing, unknown])
+        self.assertFalse(results[0][1])
+        self.assertIn('IOError', results[0][2])
+        self.assertEqual(results[1][1:], (False, None))
+
+
+class TestExtractMany(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+        self.templates = os.path.join(self.folder, 'templates')
+        os.mkdir(self.templates)
+        with open(os.path.join(self.templates, 'com.acme.yml'), 'w') as f:
+            f.write(TEMPLATE_YML)
+        self.path = os.path.join(self.folder, 'invoice.txt')
+        with open(self.path, 'w') as f:
+            f.write(SAMPLE_TEXT)
+
+        self.piped = []
+        to_text = main.pdftotext.to_text
+        main.pdftotext.to_text = self.to_text
+        self.addCleanup(setattr, main.pdftotext, 'to_text', to_text)
+
+    def to_text(self, path, encoding='ASCII7', cache=None, first_page=None, last_page=None,
+                data=None):
+        self.piped.append(data)
+        return SAMPLE_TEXT
+
+    def test_paths_bytes_and_files(self):
+        pdf = b'%PDF-1.4 not a real pdf'
+        items = [self.path, pdf, open(self.path, 'rb'), os.path.join(self.folder, 'missing.txt')]
+        results = list(extract_many(items, [self.templates]))
+        self.assertEqual([r.index for r in results], [0, 1, 2, 3])
+        self.assertEqual([r.name for r in results],
+                         [self.path, '<bytes 1>', self.path, items[3]])
+        for r in results[:3]:
+            self.assertEqual(r.result['invoice_number'], '2017-0042')
+            self.assertIsNone(r.error)
+        self.assertFalse(results[3].result)
+        self.assertIn('IOError', results[3].error)
+        self.assertEqual(self.piped, [pdf])
+
+    def test_pool_reads_ahead_at_most_max_pending(self):
+        read = []
+
+        def items():
+            for i in range(6):
+                read.append(i)
+                yield self.path
+
+        results = extract_many(items(), [self.templates], jobs=2, max_pending=2)
+        first = next(results)
+        self.assertLessEqual(len(read), 3)
+        rest = list(results)
+        self.assertEqual(sorted(r.index for r in [first] + rest), list(range(6)))
+        self.assertTrue(all(r.result['invoice_number'] == '2017-0042' for r in rest))
+
+    def test_pool_task_errors_are_results(self):
+        extract_file = batch._extract_file
+
+        def fail(name, data=None):
+            if name == 'unpicklable':
+                return name, {'total': lambda: 0}, None, None, None
+            raise SystemExit('worker exits')
+
+        # Forked workers get the patched function.
+        batch._extract_file = fail
+        self.addCleanup(setattr, batch, '_extract_file', extract_file)
+        results = sorted(extract_many(['unpicklable', 'exits'], [self.templates], jobs=2))
+        self.assertEqual([(r.name, r.result) for r in results],
+                         [('unpicklable', False), ('exits', False)])
+        self.assertIn('worker exits', results[1].error)
+        self.assertTrue(results[0].error)
+
+
+class TestFirstPages(unittest.TestCase):
+
+    def setUp(self):
+        self.pages = [SAMPLE_TEXT.replace('Total EUR', 'Subtotal'), 'Call details\n', 'Total EUR  26,00\n']
+        self.calls = []
+        to_text = main.pdftotext.to_text
+        main.pdftotext.to_text = self.to_text
+        self.addCleanup(setattr, main.pdftotext, 'to_text', to_text)
+
+    def to_text(self, path, encoding='ASCII7', cache=None, first_page=None, last_page=None,
+                data=None):
+        self.calls.append(last_page)
+        return ''.join(page + '\f' for page in self.pages[:last_page])
+
+    def test_header_on_first_page(self):
+        t = make_template()
+        del t['lines']
+        t['fields']['amount'] = r'Subtotal\s+(\d+,\d+)'
+        t.compile_patterns()
+        res = extract_data('invoice.pdf', [t], first_pages=1)
+        self.assertEqual(res['amount'], 26.0)
+        self.assertEqual(self.calls, [1])
+
+    def test_missing_field_reads_whole_document(self):
+        t = make_template()
+        del t['lines']
+        t.compile_patterns()
+        res = extract_data('invoice.pdf', [t], first_pages=1)
+        self.assertEqual(res['amount'], 26.0)
+        self.assertEqual(self.calls, [1, None])
+
+    def test_short_document_read_once(self):
+        res = extract_data('invoice.pdf', [make_template()], first_pages=5)
+        self.assertEqual(res['amount'], 26.0)
+        self.assertEqual(self.calls, [5])
+
+    def test_info_read_once_with_text(self):
+        read = []
+
+        def pdfinfo(path, cache=None, data=None):
+            read.append(path)
+            return (b'Title:          Invoice 2017-0042\n'
+                    b'Pages:          3\n'
+                    b'Page size:      595 x 842 pts (A4)\n')
+        _pdfinfo = main.pdftotext._pdfinfo
+        main.pdftotext._pdfinfo = pdfinfo
+        self.addCleanup(setattr, main.pdftotext, '_pdfinfo', _pdfinfo)
+
+        info = {}
+        res = extract_data('invoice.pdf', [make_template()], first_pages=1, info=info)
+        self.assertEqual(res['amount'], 26.0)
+        self.assertEqual(self.calls, [1, None])
+        self.assertEqual(read, ['invoice.pdf'])
+        self.assertEqual(info['Title'], u'Invoice 2017-0042')
+        self.assertEqual(info['Page size'], u'595 x 842 pts (A4)')
+
+        document = main.pdftotext.load_document('invoice.pdf')
+        self.assertEqual(document.pages, 3)
+        self.assertEqual(document.text.count('\f'), 3)
+        self.assertEqual(main.pdftotext.load_document('invoice.pdf', with_info=False).info, {})
+
+
+class RecordList(logging.Handler):
+
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+class TestSummary(unittest.TestCase):
+
+    def setUp(self):
+        self.handler = RecordList()
+        logger = logging.getLogger('invoice2data.summary')
+        logger.addHandler(self.handler)
+        self.addCleanup(logger.removeHandler, self.handler)
+        level = logger.level
+        logger.setLevel(logging.INFO)
+        self.addCleanup(logger.setLevel, level)
+
+    def test_one_record_per_document(self):
+        t = make_template()
+        t['fields']['po_number'] = r'PO:\s+(\d+)'
+        t.compile_patterns()
+        extract_data('invoice.txt', [t], data=SAMPLE_TEXT)
+        extract_data('other.txt', [t], data='Nothing to see')
+        self.assertEqual(len(self.handler.records), 2)
+
+        document = self.handler.records[0].document
+        self.assertEqual(document['status'], 'extracted')
+        self.assertEqual(document['template'], 'com.acme.yml')
+        self.assertEqual(document['missing'], ['po_number'])
+        self.assertEqual(document['lines'], 2)
+        self.assertIn('invoice_number', document['fields'])
+        self.assertTrue(self.handler.records[0].getMessage().startswith(
+            'invoice.txt: extracted, template com.acme.yml,'))
+
+        document = self.handler.records[1].document
+        self.assertEqual((document['status'], document['template'], document['fields']),
+                         ('no template', None, []))
+
+
 if __name__ == '__main__':
     unittest.main()
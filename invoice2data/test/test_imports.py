@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+
+import os
+import subprocess
+import sys
+import unittest
+
+import invoice2data
+
+# Only imported on the code paths that need them.
+HEAVY_MODULES = ['dateparser', 'numpy', 'pandas', 'pkg_resources', 'PyPDF2', 'unidecode', 'yaml']
+
+# Seconds for `import invoice2data.main` in a fresh interpreter.
+IMPORT_TIME_BUDGET = 0.25
+
+IMPORT_TIME = """
+import timeit
+start = timeit.default_timer()
+import invoice2data.main
+print(timeit.default_timer() - start)
+"""
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(invoice2data.__file__)))
+
+
+def run_python(*args):
+    proc = subprocess.Popen(
+        [sys.executable] + list(args), cwd=ROOT,
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    out, err = proc.communicate()
+    assert proc.returncode == 0, err
+    return out.decode('utf-8'), err.decode('utf-8')
+
+
+class TestImports(unittest.TestCase):
+
+    def test_no_heavy_imports(self):
+        out, err = run_python(
+            '-c', 'import sys, invoice2data.main; print(" ".join(sys.modules))')
+        loaded = set(out.split())
+        self.assertEqual(sorted(loaded.intersection(HEAVY_MODULES)), [])
+
+    def test_import_time_budget(self):
+        # Best of 3, for a busy machine.
+        seconds = min(float(run_python('-c', IMPORT_TIME)[0]) for _ in range(3))
+        self.assertLess(seconds, IMPORT_TIME_BUDGET)
+
+
+if __name__ == '__main__':
+    unittest.main()
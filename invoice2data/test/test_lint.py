@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from invoice2data.lint import lint_template, read_corpus
+from invoice2data.test.test_template import SAMPLE_TEXT, make_template
+
+
+class TestLint(unittest.TestCase):
+
+    def test_lint_template(self):
+        folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, folder)
+        with open(os.path.join(folder, 'invoice.txt'), 'w') as f:
+            f.write(SAMPLE_TEXT.replace('Total', 'Sum') * 3)
+        corpus = read_corpus(folder)
+        self.assertEqual([name for name, text in corpus], ['invoice.txt'])
+
+        template = make_template()
+        # Every space starts a scan to the end of the text.
+        template['fields']['total'] = r'\s(.*)Total'
+        template['lines']['line'] = r'^\s+(?P<desc>.+)$'
+        template.compile_patterns()
+        findings = lint_template(template, corpus, limit=1)
+        self.assertEqual([f.field for f in findings], ['total'])
+        self.assertEqual(findings[0].text, 'invoice.txt')
+        self.assertTrue(findings[0].growth is None or findings[0].growth > 1.5)
+
+
+if __name__ == '__main__':
+    unittest.main()
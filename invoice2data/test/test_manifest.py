@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+
+import datetime
+import os
+import shutil
+import tempfile
+import unittest
+
+from invoice2data.manifest import Manifest
+from invoice2data.test.test_template import make_template
+
+
+class TestManifest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+        self.path = os.path.join(self.folder, 'manifest.sqlite')
+        self.files = []
+        for name in ['acme.txt', 'unknown.txt', 'broken.txt']:
+            self.files.append(os.path.join(self.folder, name))
+            self.write(name, name)
+        self.templates = [make_template(template_name='other.yml', keywords=['Other Corp']),
+                          make_template()]
+        self.result = {'issuer': 'ACME', 'date': datetime.datetime(2017, 4, 3)}
+
+    def write(self, name, content):
+        with open(os.path.join(self.folder, name), 'w') as f:
+            f.write(content)
+
+    def run_manifest(self, templates=None, settings=('ASCII7',)):
+        with Manifest(self.path, templates or self.templates, settings) as manifest:
+            done, todo = manifest.split(self.files)
+            results = dict((name, manifest.result(name)) for name in done)
+            for name in todo:
+                if name.endswith('acme.txt'):
+                    manifest.store(name, 'com.acme.yml', self.result)
+                elif name.endswith('unknown.txt'):
+                    manifest.store(name, None, False)
+                else:
+                    manifest.store(name, None, False, 'Timeout after 1 seconds')
+        return [os.path.basename(name) for name in todo], results
+
+    def test_unchanged(self):
+        todo, results = self.run_manifest()
+        self.assertEqual(todo, ['acme.txt', 'unknown.txt', 'broken.txt'])
+        todo, results = self.run_manifest()
+        self.assertEqual(todo, ['broken.txt'])
+        self.assertEqual(results, {self.files[0]: self.result, self.files[1]: False})
+
+    def test_changed_files(self):
+        self.run_manifest()
+        stat = os.stat(self.files[0])
+        os.utime(self.files[0], (stat.st_atime, stat.st_mtime + 10))
+        self.write('unknown.txt', 'new content')
+        todo, results = self.run_manifest()
+        self.assertEqual(todo, ['unknown.txt', 'broken.txt'])
+
+    def test_changed_templates(self):
+        self.run_manifest()
+        # Only the files without a template run again.
+        templates = self.templates + [make_template(template_name='new.yml')]
+        self.assertEqual(self.run_manifest(templates)[0], ['unknown.txt', 'broken.txt'])
+
+        templates[1]['fields']['amount'] = r'Total\s+(\d+,\d+)'
+        self.assertEqual(self.run_manifest(templates)[0], ['acme.txt', 'unknown.txt', 'broken.txt'])
+        self.assertEqual(self.run_manifest(templates)[0], ['broken.txt'])
+
+        self.assertEqual(self.run_manifest(templates, settings=('UTF-8',))[0],
+                         ['acme.txt', 'unknown.txt', 'broken.txt'])
+
+
+if __name__ == '__main__':
+    unittest.main()
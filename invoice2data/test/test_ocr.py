@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+from distutils import spawn
+
+from invoice2data import in_tesseract, main
+from invoice2data.in_tesseract import OcrOptions
+from invoice2data.test.test_template import SAMPLE_TEXT, make_template
+
+try:
+    from PIL import Image, ImageDraw, ImageFont
+except ImportError:
+    Image = None
+
+FONT = '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf'
+
+
+def has_ocr():
+    return (Image is not None and os.path.exists(FONT) and
+            all(spawn.find_executable(c) for c in ['tesseract', 'pdftoppm', 'pdfinfo']))
+
+
+class TestOcrFallback(unittest.TestCase):
+    """`extract_data` with pdftotext and tesseract replaced."""
+
+    def setUp(self):
+        # The invoice on page 1, its lines continued on page 2.
+        first, rest = SAMPLE_TEXT.split('  2  Gadget')
+        self.pages = [first.encode('utf-8'), ('  2  Gadget' + rest).encode('utf-8'), b'Terms']
+        self.ocr_calls = []
+        self.patch(main.pdftotext, 'to_text', lambda *args, **kwargs: b'\f\f\f')
+        self.patch(in_tesseract, 'to_text', self.fake_ocr)
+
+    def patch(self, module, name, value):
+        self.addCleanup(setattr, module, name, getattr(module, name))
+        setattr(module, name, value)
+
+    def fake_ocr(self, path, options=None, cache=None, first_page=None, last_page=None, data=None,
+                 info=None):
+        if info is not None:
+            info['Pages'] = len(self.pages)
+        first_page = first_page or 1
+        last_page = min(last_page or len(self.pages), len(self.pages))
+        self.ocr_calls.append((first_page, last_page))
+        return b''.join(page + b'\f' for page in self.pages[first_page - 1:last_page])
+
+    def test_first_page_is_enough(self):
+        self.pages = [SAMPLE_TEXT.encode('utf-8'), b'Terms', b'Terms']
+        template = make_template()
+        del template['lines']
+        res = main.extract_data('scan.pdf', [template], ocr=OcrOptions(jobs=1))
+        self.assertEqual(res['invoice_number'], '2017-0042')
+        self.assertEqual(self.ocr_calls, [(1, 1)])
+
+    def test_other_pages_for_lines(self):
+        res = main.extract_data('scan.pdf', [make_template()], ocr=OcrOptions(jobs=1))
+        self.assertEqual([line['desc'] for line in res['lines']],
+                         ['Widget', 'Gadget with extra batteries'])
+        self.assertEqual(self.ocr_calls, [(1, 1), (2, 3)])
+
+    def test_no_second_read_past_the_last_page(self):
+        # A field not on the only page doesn't read pages that don't exist.
+        self.pages = [SAMPLE_TEXT.encode('utf-8')]
+        template = make_template()
+        del template['lines']
+        template['fields']['po_number'] = r'PO:\s+(\d+)'
+        template.compile_patterns()
+        res = main.extract_data('scan.pdf', [template], ocr=OcrOptions(jobs=1))
+        self.assertEqual(res['invoice_number'], '2017-0042')
+        self.assertEqual(self.ocr_calls, [(1, 1)])
+
+    def test_off_by_default(self):
+        self.assertFalse(main.extract_data('scan.pdf', [make_template()]))
+        self.assertEqual(self.ocr_calls, [])
+
+
+@unittest.skipUnless(has_ocr(), 'needs tesseract, poppler, pillow and the DejaVu font')
+class TestTesseract(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+        self.pdf = os.path.join(self.folder, 'scan.pdf')
+        font = ImageFont.truetype(FONT, 48)
+        images = []
+        for text in ['Invoice 1001', 'Widget 10,50', 'Invoice 1001']:
+            image = Image.new('L', (1240, 1754), 255)
+            ImageDraw.Draw(image).text((100, 100), text, font=font, fill=0)
+            images.append(image)
+        images[0].save(self.pdf, save_all=True, append_images=images[1:], resolution=150)
+
+    def test_pages_in_order_and_cached(self):
+        in_tesseract._pages.clear()
+        options = OcrOptions(dpi=150, jobs=3)
+        text = in_tesseract.to_text(self.pdf, options).decode('utf-8')
+        pages = text.split('\f')
+        self.assertEqual(len(pages), 4)
+        self.assertIn('Invoice 1001', pages[0])
+        self.assertIn('Widget', pages[1])
+        # Pages 1 and 3 have the same image.
+        self.assertEqual(len(in_tesseract._pages), 2)
+
+        ocr_image = in_tesseract.ocr_image
+        in_tesseract.ocr_image = None
+        try:
+            self.assertEqual(in_tesseract.to_text(self.pdf, options, last_page=2).decode('utf-8'),
+                             '\f'.join(pages[:2]) + '\f')
+        finally:
+            in_tesseract.ocr_image = ocr_image
+
+
+if __name__ == '__main__':
+    unittest.main()
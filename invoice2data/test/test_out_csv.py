@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+
+import datetime
+import os
+import shutil
+import tempfile
+import unittest
+
+from invoice2data.lines import LineItems
+from invoice2data.out_csv import IssuerCsvWriter, invoices_to_csv, write_issuer_invoices
+
+
+def invoice(number, **kwargs):
+    res = {
+        'issuer': 'ACME Corp',
+        'title': 'invoice %s' % number,
+        'invoice_number': number,
+        'date': datetime.datetime(2017, 4, 3),
+        'amount': 26.0,
+        'desc': 'Invoice %s from ACME Corp' % number,
+    }
+    res.update(kwargs)
+    return res
+
+
+class TestOutCsv(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+
+    def read(self, name):
+        with open(os.path.join(self.folder, name)) as f:
+            return f.read()
+
+    def test_invoices_to_csv(self):
+        invoices_to_csv([invoice('1'), invoice('2', amount=5)],
+                        os.path.join(self.folder, 'invoices.csv'))
+        self.assertEqual(self.read('invoices.csv'),
+                         'date,desc,amount\r\n'
+                         '03/04/2017,Invoice 1 from ACME Corp,26.0\r\n'
+                         '03/04/2017,Invoice 2 from ACME Corp,5\r\n')
+
+    def test_column_types(self):
+        # Same as pandas.DataFrame(rows).set_index(['title', 'invoice_number']).to_csv()
+        write_issuer_invoices('ACME', [
+            {'a': 1, 'b': 2.5, 'c': True, 'd': datetime.datetime(2017, 4, 3),
+             'title': 't', 'invoice_number': '1', 'z': 'x'},
+            {'a': 2, 'c': None, 'title': 't2', 'invoice_number': '2', 'e': 0.1 + 0.2, 'f': [1]},
+            {'b': 1, 'e': 's', 'title': 't3'},
+        ], 'ASCII7', self.folder)
+        self.assertEqual(self.read('ACME_summary.csv'),
+                         'title,invoice_number,a,b,c,d,e,f,z\n'
+                         't,1,1.0,2.5,True,2017-04-03,,,x\n'
+                         't2,2,2.0,,,,0.30000000000000004,[1],\n'
+                         't3,,,1.0,,,s,,\n')
+
+    def test_lines_and_issuers(self):
+        with IssuerCsvWriter(self.folder, 'ASCII7') as writer:
+            writer.write(invoice('1', lines=[{'qty': 2, 'price': 10.5}, {},
+                                             {'qty': 1, 'price': 5.0}]))
+            writer.write(invoice('2', issuer='Other', date=datetime.datetime(2017, 4, 3, 12, 30)))
+            writer.write(invoice('3'))
+            writer.write(invoice('4', lines=[]))
+        self.assertEqual(self.read('ACME_Corp_summary.csv'),
+                         'title,invoice_number,amount,date,issuer,price,qty\n'
+                         'invoice 1,1,26.0,2017-04-03,ACME Corp,10.5,2.0\n'
+                         'invoice 1,1,26.0,2017-04-03,ACME Corp,5.0,1.0\n'
+                         'invoice 3,3,26.0,2017-04-03,ACME Corp,,\n')
+        self.assertEqual(self.read('Other_summary.csv'),
+                         'title,invoice_number,amount,date,issuer\n'
+                         'invoice 2,2,26.0,2017-04-03 12:30:00,Other\n')
+
+    def test_columnar_lines_same_as_dicts(self):
+        lines = [{'qty': 2, 'price': 10.5}, {'desc': 'note'}, {'qty': 0},
+                 {'qty': 1, 'price': 5.0, 'amount': 5.0}]
+        for name, lines in [('dicts', lines), ('columns', LineItems.from_dicts(lines))]:
+            os.mkdir(os.path.join(self.folder, name))
+            with IssuerCsvWriter(os.path.join(self.folder, name), 'ASCII7') as writer:
+                writer.write(invoice('1', lines=lines))
+                writer.write(invoice('2', lines=LineItems()))
+                writer.write(invoice('3', vat=None))
+        self.assertEqual(self.read('columns/ACME_Corp_summary.csv'),
+                         self.read('dicts/ACME_Corp_summary.csv'))
+        self.assertEqual(self.read('columns/ACME_Corp_summary.csv').splitlines()[1:4], [
+            'invoice 1,1,26.0,2017-04-03,,ACME Corp,10.5,2.0,',
+            'invoice 1,1,26.0,2017-04-03,note,ACME Corp,,,',
+            'invoice 1,1,5.0,2017-04-03,,ACME Corp,5.0,1.0,',
+        ])
+
+    def test_encoding(self):
+        write_issuer_invoices('ACME', [invoice('1', partner_name=u'Société')], 'UTF-8', self.folder)
+        with open(os.path.join(self.folder, 'ACME_summary.csv'), 'rb') as f:
+            self.assertEqual(f.read().splitlines()[1],
+                             u'invoice 1,1,26.0,2017-04-03,ACME Corp,Société'.encode('utf-8'))
+
+
+if __name__ == '__main__':
+    unittest.main()
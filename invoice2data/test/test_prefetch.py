@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from invoice2data import in_pdftotext, supervise
+from invoice2data.batch import extract_files
+from invoice2data.cache import TextCache
+from invoice2data.prefetch import PrefetchCache, read_ahead
+from invoice2data.test.test_template import SAMPLE_TEXT, TEMPLATE_YML
+
+
+class FakePopen(object):
+    "pdftotext printing SAMPLE_TEXT."
+
+    calls = []
+    returncode = 0
+
+    def __init__(self, args, **kwargs):
+        self.calls.append(args[-2])
+
+    def communicate(self, data=None):
+        return SAMPLE_TEXT.encode('ascii'), b''
+
+
+class TestReadAhead(unittest.TestCase):
+
+    def test_in_order_at_most_ahead(self):
+        lock = threading.Lock()
+        read = []
+        consumed = []
+
+        def record(item):
+            with lock:
+                read.append(item)
+
+        for item in read_ahead(iter(range(10)), record, 3):
+            with lock:
+                self.assertIn(item, read)
+                self.assertLessEqual(len(read), item + 4)
+            consumed.append(item)
+        self.assertEqual(consumed, list(range(10)))
+
+    def test_errors_are_ignored(self):
+        def fail(item):
+            raise ValueError(item)
+        self.assertEqual(list(read_ahead(['a', 'b'], fail, 2)), ['a', 'b'])
+
+
+class TestPrefetchCache(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+
+    def test_texts_are_read_once(self):
+        cache = PrefetchCache(size=2)
+        for key in ('aa01', 'aa02', 'aa03'):
+            cache.set(key, b'text ' + key.encode('ascii'))
+        self.assertIsNone(cache.get('aa01'))
+        self.assertEqual(cache.get('aa02'), b'text aa02')
+        self.assertIsNone(cache.get('aa02'))
+
+    def test_in_front_of_text_cache(self):
+        text_cache = TextCache(self.folder)
+        cache = PrefetchCache(text_cache)
+        self.assertEqual(cache.key(b'%PDF', 'pdftotext'), text_cache.key(b'%PDF', 'pdftotext'))
+        cache.set('aa01', b'some text')
+        self.assertEqual(cache.get('aa01'), b'some text')
+        self.assertEqual(cache.get('aa01'), b'some text')
+        self.assertEqual(text_cache.hits, 1)
+
+    def test_extract_files_runs_pdftotext_once_per_file(self):
+        templates = os.path.join(self.folder, 'templates')
+        os.mkdir(templates)
+        with open(os.path.join(templates, 'com.acme.yml'), 'w') as f:
+            f.write(TEMPLATE_YML)
+        files = []
+        for i in range(5):
+            files.append(os.path.join(self.folder, 'invoice-%d.pdf' % i))
+            with open(files[-1], 'wb') as f:
+                f.write(b'%PDF-1.4 invoice ' + str(i).encode('ascii'))
+
+        FakePopen.calls = []
+        popen = supervise.subprocess.Popen
+        supervise.subprocess.Popen = FakePopen
+        self.addCleanup(setattr, supervise.subprocess, 'Popen', popen)
+        find_executable = in_pdftotext.find_executable
+        in_pdftotext.find_executable = lambda name: name == 'pdftotext'
+        self.addCleanup(setattr, in_pdftotext, 'find_executable', find_executable)
+
+        results = list(extract_files(files, [templates], prefetch=2))
+        self.assertEqual([r[0] for r in results], files)
+        self.assertTrue(all(r[1]['invoice_number'] == '2017-0042' for r in results))
+        self.assertEqual(sorted(FakePopen.calls), files)
+
+
+if __name__ == '__main__':
+    unittest.main()
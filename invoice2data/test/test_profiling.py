@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from invoice2data import profiling
+from invoice2data.main import extract_data
+from invoice2data.test.test_template import SAMPLE_TEXT, make_template
+
+
+class TestProfiling(unittest.TestCase):
+
+    def setUp(self):
+        folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, folder)
+        self.path = os.path.join(folder, 'invoice.txt')
+        with open(self.path, 'w') as f:
+            f.write(SAMPLE_TEXT)
+        self.templates = [make_template(template_name='other.yml', keywords=['Other Corp']),
+                          make_template()]
+
+    def test_disabled(self):
+        self.assertIsNone(profiling.current())
+        self.assertIs(profiling.timer('fields'), profiling.NULL_TIMER)
+        extract_data(self.path, self.templates)
+
+    def test_stages_and_files(self):
+        profile = profiling.enable()
+        try:
+            extract_data(self.path, self.templates)
+        finally:
+            profiling.disable()
+
+        summary = profile.summary()
+        for stage in ['document', 'unicode', 'prepare_input', 'matches_input',
+                      'extract', 'fields', 'dates', 'lines']:
+            self.assertIn(stage, summary['stages'])
+        self.assertEqual(summary['stages']['document']['count'], 1)
+        self.assertEqual(summary['files'][0]['file'], self.path)
+        self.assertEqual(summary['files'][0]['templates_tried'], 1)
+        self.assertEqual([t['template'] for t in summary['templates']], ['com.acme.yml'])
+        self.assertIn('slowest files', profile.report())
+
+    def test_merge_worker_timings(self):
+        worker = profiling.Profile()
+        worker.add('pdftotext', 0.5)
+        profile = profiling.Profile()
+        profile.merge(worker.pop())
+        profile.merge(worker.pop())
+        self.assertEqual(profile.summary()['stages']['pdftotext']['max'], 0.5)
+        self.assertEqual(profile.summary()['stages']['pdftotext']['count'], 1)
+        self.assertEqual(worker.stages, {})
+
+    def test_totals_not_records(self):
+        profile = profiling.Profile()
+        for i in range(1, 1001):
+            profile.add('fields', i / 1000.0, 'com.acme.yml')
+            profile.add_document('invoice-%d.pdf' % i, i / 1000.0, 2)
+        summary = profile.summary(top=3)
+        fields = summary['stages']['fields']
+        self.assertEqual((fields['count'], fields['max']), (1000, 1.0))
+        self.assertAlmostEqual(fields['total'], 500.5)
+        self.assertAlmostEqual(fields['p50'], 0.5, delta=0.5 * 0.05)
+        self.assertAlmostEqual(fields['p95'], 0.95, delta=0.95 * 0.05)
+        self.assertEqual([f['file'] for f in summary['files']],
+                         ['invoice-1000.pdf', 'invoice-999.pdf', 'invoice-998.pdf'])
+        self.assertEqual(summary['templates_tried'], {'mean': 2.0, 'max': 2})
+        self.assertEqual(len(profile.documents), profiling.MAX_FILES)
+        self.assertLess(len(profile.stages['fields'][3]), 200)
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(profiling.percentile(values, 50), 50)
+        self.assertEqual(profiling.percentile(values, 95), 95)
+        self.assertEqual(profiling.percentile([3], 95), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
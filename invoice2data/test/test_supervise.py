@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import stat
+import sys
+import tempfile
+import time
+import unittest
+
+from invoice2data import supervise
+from invoice2data.batch import extract_files
+from invoice2data.supervise import Limits
+from invoice2data.test.test_template import TEMPLATE_YML
+
+
+class TestSupervise(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+        self.addCleanup(supervise.disable)
+
+    def command(self, name, script):
+        "An executable `name` in a folder put first in PATH."
+        path = os.path.join(self.folder, name)
+        with open(path, 'w') as f:
+            f.write('#!/bin/sh\n' + script + '\n')
+        os.chmod(path, os.stat(path).st_mode | stat.S_IEXEC)
+        if os.environ['PATH'].split(os.pathsep)[0] != self.folder:
+            self.addCleanup(os.environ.__setitem__, 'PATH', os.environ['PATH'])
+            os.environ['PATH'] = self.folder + os.pathsep + os.environ['PATH']
+        return name
+
+    def test_timeout_kills_and_reaps(self):
+        start = time.time()
+        result = supervise.run([self.command('slow', 'exec sleep 30')], limits=Limits(0.2))
+        self.assertLess(time.time() - start, 10)
+        self.assertTrue(result.timed_out)
+        self.assertTrue(result.failed)
+        self.assertLess(result.returncode, 0)
+        self.assertEqual(supervise._running, set())
+        self.assertIn('slow timed out after', result.describe())
+
+    def test_kill_while_starting(self):
+        popen = supervise.subprocess.Popen
+
+        def start_then_kill(*args, **kwargs):
+            process = popen(*args, **kwargs)
+            supervise.kill_running()
+            return process
+
+        supervise.subprocess.Popen = start_then_kill
+        self.addCleanup(setattr, supervise.subprocess, 'Popen', popen)
+        start = time.time()
+        result = supervise.run([self.command('slow', 'exec sleep 30')])
+        self.assertLess(time.time() - start, 10)
+        self.assertLess(result.returncode, 0)
+        self.assertEqual(supervise._running, set())
+
+    def test_cpu_limit(self):
+        result = supervise.run([sys.executable, '-c', 'while True: pass'],
+                               limits=Limits(seconds=30, cpu=1))
+        self.assertFalse(result.timed_out)
+        self.assertLess(result.returncode, 0)
+        self.assertEqual(result.args[0], sys.executable)
+        self.assertIn('memory or CPU limit', result.describe())
+
+    def test_cpu_limit_hard(self):
+        code = 'import resource; print(resource.getrlimit(resource.RLIMIT_CPU))'
+        result = supervise.run([sys.executable, '-c', code], limits=Limits(cpu=5))
+        self.assertEqual(result.out.strip(), b'(5, 6)')
+        self.assertEqual(result.err, b'')
+
+        # Ignoring SIGXCPU doesn't escape the hard limit.
+        code = 'import signal; signal.signal(signal.SIGXCPU, signal.SIG_IGN)\nwhile True: pass'
+        result = supervise.run([sys.executable, '-c', code], limits=Limits(seconds=30, cpu=1))
+        self.assertFalse(result.timed_out)
+        self.assertLess(result.returncode, 0)
+
+    def test_memory_limit(self):
+        supervise.enable(memory=256)
+        result = supervise.run([sys.executable, '-c', 'x = b" " * (1024 * 2 ** 20)'])
+        self.assertTrue(result.failed)
+        self.assertIn(b'MemoryError', result.err)
+
+    def test_exit_code_and_stderr(self):
+        name = self.command('broken', 'echo "Syntax Error: no trailer" >&2; exit 1')
+        result = supervise.run([name], data=b'%PDF')
+        self.assertEqual((result.returncode, result.timed_out), (1, False))
+        self.assertEqual(result.describe(), 'broken exited with 1: Syntax Error: no trailer')
+        ok = supervise.run(['echo', 'text'])
+        self.assertFalse(ok.failed)
+        self.assertEqual(ok.out, b'text\n')
+
+    def test_pdftotext_timeout_is_the_error_of_the_file(self):
+        self.command('pdftotext', 'exec sleep 30')
+        templates = os.path.join(self.folder, 'templates')
+        os.mkdir(templates)
+        with open(os.path.join(templates, 'com.acme.yml'), 'w') as f:
+            f.write(TEMPLATE_YML)
+        pdf = os.path.join(self.folder, 'invoice.pdf')
+        with open(pdf, 'wb') as f:
+            f.write(b'%PDF-1.4 not a real pdf')
+
+        results = list(extract_files([pdf], [templates], command_limits=Limits(0.2)))
+        self.assertEqual(results[0][:2], (pdf, False))
+        self.assertIn('CommandFailed: pdftotext timed out after', results[0][2])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,270 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+from collections import Counter, OrderedDict
+
+from invoice2data import template
+from invoice2data.index import TemplateIndex, read_hits, write_hits
+from invoice2data.lines import LineItems
+from invoice2data.main import template_index
+from invoice2data.template import InvoiceTemplate, PreparedInput, read_templates
+
+SAMPLE_TEXT = """
+ACME Corp.                                   Invoice No: 2017-0042
+VAT ID: FR 12 345 678 901                    Date: 03/04/2017
+
+Pos  Description                  Qty      Price
+  1  Widget                         2      10,50
+  2  Gadget                         1       5,00
+     with extra batteries
+Total EUR                                  26,00
+"""
+
+
+def make_template(**kwargs):
+    tpl = OrderedDict([
+        ('issuer', 'ACME'),
+        ('template_name', 'com.acme.yml'),
+        ('keywords', ['ACME Corp', r'FR \d\d 345']),
+        ('fields', OrderedDict([
+            ('amount', r'Total EUR\s+(\d+,\d+)'),
+            ('date', r'Date:\s+(\d+/\d+/\d+)'),
+            ('invoice_number', [r'Invoice Number:\s+(\S+)', r'Invoice No:\s+(\S+)']),
+            ('static_vat', 'FR12345678901'),
+        ])),
+        ('lines', OrderedDict([
+            ('start', r'Pos\s+Description\s+Qty\s+Price'),
+            ('end', r'Total EUR'),
+            ('first_line', r'^\s+(?P<pos>\d+)\s+(?P<desc>\w+)\s+(?P<qty>\d+)\s+(?P<price>\d+,\d+)$'),
+            ('line', r'^\s+(?P<desc>.+)$'),
+            ('types', {'qty': 'int', 'price': 'float'}),
+        ])),
+        ('options', {'decimal_separator': ',', 'date_formats': ['%d/%m/%Y']}),
+    ])
+    tpl.update(kwargs)
+    return InvoiceTemplate(tpl)
+
+
+class TestTemplate(unittest.TestCase):
+
+    def test_patterns_compiled_once(self):
+        t = make_template()
+        self.assertEqual(len(t.keyword_patterns), 2)
+        self.assertEqual(len(t.field_patterns['invoice_number']), 2)
+        self.assertNotIn('static_vat', t.field_patterns)
+        self.assertEqual(
+            sorted(t.lines_patterns), ['end', 'first_line', 'line', 'start'])
+
+    def test_extract(self):
+        t = make_template()
+        optimized_str = t.prepare_input(SAMPLE_TEXT)
+        self.assertTrue(t.matches_input(optimized_str))
+        res = t.extract(optimized_str)
+        self.assertEqual(res['invoice_number'], '2017-0042')
+        self.assertEqual(res['amount'], 26.0)
+        self.assertEqual(res['vat'], 'FR12345678901')
+        self.assertEqual(res['date'].strftime('%Y-%m-%d'), '2017-04-03')
+        self.assertEqual(res['lines'], [
+            {'pos': '1', 'desc': 'Widget', 'qty': 2, 'price': 10.5},
+            {'pos': '2', 'desc': 'Gadget with extra batteries', 'qty': 1, 'price': 5.0},
+        ])
+
+    def test_extract_lines_kinds(self):
+        t = make_template()
+        t['lines'].update([
+            ('ignore_line', r'^\s+-+$'),
+            ('line', r'^\s+(?P<desc>\w*)\s*(?P<note>\(.*\))?$'),
+            ('last_line', r'^\s+(?P<desc>end of item)$'),
+        ])
+        t.options['append_separator'] = '|'
+        t.compile_patterns()
+        content = '\n'.join([
+            'Pos  Description                  Qty      Price',
+            '  1  Widget                         2      10,50',
+            '     ------',
+            '     (blue)',
+            '     end of item',
+            '     ',
+            '     Spare',
+            'Total EUR',
+        ])
+        output = {}
+        t.extract_lines(content, output)
+        self.assertEqual(output['lines'], [
+            {'pos': '1', 'desc': 'Widget||end of item', 'qty': 2, 'price': 10.5,
+             'note': '(blue)'},
+            {'desc': 'Spare', 'note': ''},
+        ])
+
+    def test_extract_columnar_lines(self):
+        t = make_template()
+        lines = t.extract(t.prepare_input(SAMPLE_TEXT), columnar_lines=True)['lines']
+        self.assertIsInstance(lines, LineItems)
+        self.assertEqual((lines.columns['qty'].typecode, lines.columns['price'].typecode),
+                         ('l', 'd'))
+        self.assertEqual(lines.to_dicts(), t.extract(t.prepare_input(SAMPLE_TEXT))['lines'])
+        self.assertEqual(lines[1]['desc'], 'Gadget with extra batteries')
+        self.assertEqual([line.get('qty') for line in lines], [2, 1])
+
+        # A typed column missing on some lines stays a list.
+        lines = LineItems.from_dicts([{'qty': '2', 'desc': 'a'}, {'desc': 'b'}])
+        lines.coerce({'qty': 'int'})
+        self.assertEqual(lines.columns['qty'], [2, None])
+        self.assertEqual(list(lines), [{'qty': 2, 'desc': 'a'}, {'desc': 'b'}])
+        self.assertNotIn('qty', lines[1])
+        self.assertRaises(KeyError, lambda: lines[1]['qty'])
+
+    def test_no_match(self):
+        t = make_template()
+        self.assertFalse(t.matches_input('Some other vendor'))
+
+    def test_prepared_input_shared(self):
+        default = make_template()
+        same = make_template(template_name='same.yml')
+        lowercase = make_template(options={'lowercase': True})
+        prepared = PreparedInput(SAMPLE_TEXT)
+        self.assertEqual(prepared.get(default), SAMPLE_TEXT)
+        self.assertEqual(prepared.get(same), SAMPLE_TEXT)
+        self.assertEqual(prepared.get(lowercase), SAMPLE_TEXT.lower())
+        self.assertEqual((prepared.hits, prepared.misses), (1, 2))
+
+
+TEMPLATE_YML = """
+issuer: ACME
+keywords: ACME Corp
+fields:
+  amount: Total EUR\\s+(\\d+,\\d+)
+  date: Date:\\s+(\\d+/\\d+/\\d+)
+  invoice_number: Invoice No:\\s+(\\S+)
+"""
+
+
+class TestReadTemplates(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+        self.templates = os.path.join(self.folder, 'templates')
+        self.cache = os.path.join(self.folder, 'cache')
+        os.mkdir(self.templates)
+        self.path = os.path.join(self.templates, 'com.acme.yml')
+        with open(self.path, 'w') as f:
+            f.write(TEMPLATE_YML)
+
+    def test_cache(self):
+        parsed = read_templates(self.templates, cache_folder=self.cache)
+        self.assertEqual(parsed[0]['keywords'], ['ACME Corp'])
+
+        parse_template = template.parse_template
+        template.parse_template = None
+        try:
+            cached = read_templates(self.templates, cache_folder=self.cache)
+        finally:
+            template.parse_template = parse_template
+        self.assertEqual(cached, parsed)
+        self.assertEqual(len(cached[0].keyword_patterns), 1)
+
+        with open(self.path, 'a') as f:
+            f.write('options:\n  currency: USD\n')
+        changed = read_templates(self.templates, cache_folder=self.cache)
+        self.assertEqual(changed[0].options['currency'], 'USD')
+
+
+class TestTemplateIndex(unittest.TestCase):
+
+    def test_candidates_keep_template_order(self):
+        templates = [
+            make_template(template_name='other.yml', keywords=['Other Corp']),
+            make_template(template_name='spaces.yml', keywords=['Corp.Invoice'],
+                          options={'remove_whitespace': True}),
+            make_template(template_name='regex.yml', keywords=[r'VAT ID: FR \d+']),
+            make_template(template_name='prefix.yml', keywords=['ACME', 'ACME Corp.']),
+            make_template(),
+        ]
+        index = TemplateIndex(templates)
+        names = [t['template_name'] for t, _ in index.candidates(SAMPLE_TEXT)]
+        self.assertEqual(names, ['spaces.yml', 'regex.yml', 'prefix.yml', 'com.acme.yml'])
+
+        expected = [t['template_name'] for t in templates
+                    if t.matches_input(t.prepare_input(SAMPLE_TEXT))]
+        self.assertEqual(names, expected)
+
+    def candidate_names(self, index, **kwargs):
+        return [t['template_name'] for t, _ in index.candidates(SAMPLE_TEXT, **kwargs)]
+
+    def test_hits_first(self):
+        templates = [
+            make_template(template_name='regex.yml', keywords=[r'VAT ID: FR \d+']),
+            make_template(template_name='other.yml', keywords=['Other Corp']),
+            make_template(template_name='widget.yml', keywords=['Widget']),
+            make_template(),
+        ]
+        index = TemplateIndex(templates, Counter())
+        self.assertEqual(self.candidate_names(index), ['regex.yml', 'widget.yml', 'com.acme.yml'])
+
+        index.add_hit(templates[3])
+        # regex.yml only has a regex keyword, it may match whenever
+        # com.acme.yml does and must be tried before.
+        self.assertEqual(self.candidate_names(index), ['regex.yml', 'widget.yml', 'com.acme.yml'])
+
+        index.add_hit(templates[2])
+        index.add_hit(templates[2])
+        templates[0]['keywords'] = ['Invoice No', r'VAT ID: FR \d+']
+        index = TemplateIndex(templates, index.hits)
+        self.assertEqual(index.hits, Counter({'widget.yml': 2, 'com.acme.yml': 1}))
+        # widget.yml and com.acme.yml don't conflict with regex.yml anymore.
+        self.assertEqual(self.candidate_names(index), ['widget.yml', 'com.acme.yml', 'regex.yml'])
+
+    def test_hits_keep_conflicting_order(self):
+        templates = [
+            make_template(template_name='generic.yml', keywords=['ACME']),
+            make_template(template_name='other.yml', keywords=['Other Corp']),
+            make_template(keywords=['ACME Corp.', 'Widget']),
+        ]
+        index = TemplateIndex(templates, Counter({'com.acme.yml': 5}))
+        self.assertEqual(self.candidate_names(index), ['generic.yml', 'com.acme.yml'])
+
+        # Tried first once generic.yml is ruled out. Hot templates are
+        # yielded before their keywords are checked.
+        text = SAMPLE_TEXT.replace('ACME', 'ACNE')
+        self.assertEqual([t['template_name'] for t, _ in index.candidates(text)], ['com.acme.yml'])
+        templates[0]['keywords'] = ['Gadget']
+        index = TemplateIndex(templates, Counter({'com.acme.yml': 5}))
+        self.assertEqual(self.candidate_names(index), ['com.acme.yml', 'generic.yml'])
+
+    def test_index_of_list_reused(self):
+        templates = [make_template(), make_template(template_name='other.yml')]
+        index = template_index(templates)
+        self.assertIs(template_index(templates), index)
+        self.assertIs(template_index(index), index)
+        templates[1] = make_template(template_name='new.yml')
+        self.assertEqual([t['template_name'] for t in template_index(templates)],
+                         ['com.acme.yml', 'new.yml'])
+        self.assertIsNot(template_index(list(templates)), template_index(templates))
+
+    def test_hint(self):
+        templates = [
+            make_template(template_name='widget.yml', issuer='Widgets', keywords=['Widget']),
+            make_template(template_name='other.yml', issuer='Other', keywords=['Other Corp']),
+            make_template(),
+        ]
+        index = TemplateIndex(templates)
+        self.assertEqual(self.candidate_names(index, hint='ACME'), ['com.acme.yml', 'widget.yml'])
+        self.assertEqual(self.candidate_names(index, hint='other.yml'),
+                         ['other.yml', 'widget.yml', 'com.acme.yml'])
+        self.assertEqual(self.candidate_names(index, hint='unknown'), ['widget.yml', 'com.acme.yml'])
+
+    def test_read_write_hits(self):
+        folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, folder)
+        path = os.path.join(folder, 'hits.json')
+        self.assertEqual(read_hits(path), Counter())
+        write_hits(path, Counter({'com.acme.yml': 3, u'soci\xe9t\xe9.yml': 1}))
+        self.assertEqual(read_hits(path), Counter({'com.acme.yml': 3, u'soci\xe9t\xe9.yml': 1}))
+
+
+if __name__ == '__main__':
+    unittest.main()
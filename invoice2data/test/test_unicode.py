@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from invoice2data.unicode import asciify, replace_unicode_characters
+
+
+class TestAsciify(unittest.TestCase):
+
+    def test_ascii_unchanged(self):
+        self.assertEqual(asciify(b'Total EUR 26,00'), b'Total EUR 26,00')
+
+    def test_mapped_characters(self):
+        text = u'“Widget” \xbd kg – \xa9 ACME'.encode('utf-8')
+        # EN DASH isn't mapped and is dropped.
+        self.assertEqual(replace_unicode_characters(text), b'"Widget" 1/2 kg  (C) ACME')
+
+    def test_custom_map(self):
+        self.assertEqual(asciify(u'caf\xe9', {u'\xe9': 'e'}), b'cafe')
+
+
+if __name__ == '__main__':
+    unittest.main()
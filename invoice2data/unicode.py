@@ -1,9 +1,9 @@
 # -*- coding: utf-8 -*-
 
-from unidecode import unidecode
-import re
+import codecs
 import logging
-import numpy as np
+
+logger = logging.getLogger(__name__)
 
 UTF_MAP = {'\x80': '',  # €
            '\x81': ' ',
@@ -71,23 +71,70 @@ UTF_MAP = {'\x80': '',  # €
            '\xef': 'i'}  # ï      LATIN SMALL LETTER I WITH DIAERESIS
 
 
+def translate_table(replacement_map):
+    """ Turn a map of single characters into a table of code points
+
+    Args:
+        replacement_map (dict): character -> ASCII replacement
+
+    Returns:
+        dict: code point -> unicode replacement
+    """
+    table = {}
+    for key, val in replacement_map.items():
+        if isinstance(key, bytes):
+            key = key.decode('latin-1')
+        if isinstance(val, bytes):
+            val = val.decode('latin-1')
+        table[ord(key)] = val
+    return table
+
+
+UTF_TABLE = translate_table(UTF_MAP)
+
+
+def _replace_from_table(err):
+    """ Encoding error handler: replace characters found in `UTF_TABLE`,
+    give up on the first one that isn't.
+    """
+    replacement = []
+    for pos in range(err.start, err.end):
+        try:
+            replacement.append(UTF_TABLE[ord(err.object[pos])])
+        except KeyError:
+            raise UnicodeEncodeError(
+                err.encoding, err.object, pos, pos + 1, err.reason)
+    return u''.join(replacement), err.end
+
+
+def _replace_from_table_or_drop(err):
+    """ Encoding error handler: replace characters found in `UTF_TABLE`,
+    drop all others.
+    """
+    table = UTF_TABLE
+    chars = err.object[err.start:err.end]
+    return u''.join([table.get(ord(c), u'') for c in chars]), err.end
+
+
+codecs.register_error('invoice2data.asciify', _replace_from_table)
+codecs.register_error('invoice2data.asciify_or_drop', _replace_from_table_or_drop)
+
+
 def replace_unicode_characters(str):
-    a = asciify(str)
-    try: 
-        u = a.encode('utf-8')
-    except:
-        print("Couldn't unicode() %s",a)
-        print type(str)
-        u = a.decode('utf-8')
-        assert False
-    str = unidecode(u)
-    a = asciify(str)
-    return a
+    """ Convert UTF-8 text to ASCII, see `asciify`.
+
+    All characters that `asciify` doesn't map are dropped, so there is
+    nothing left for a second pass (eg. through unidecode) to convert.
+    """
+    return asciify(str)
 
 
 def asciify(str, replacement_map=UTF_MAP):
     """ Convert UTF-8 unicode to ASCII strings using a predefined charecter map
 
+    The text is encoded in a single pass: ASCII characters are copied,
+    mapped characters are replaced and all others are dropped.
+
     Args:
         uni_string: a unicode string
 
@@ -95,20 +142,24 @@ def asciify(str, replacement_map=UTF_MAP):
         str or NaN: ASCII string
 
     """
-    try:
-        uni_string = unicode(str,'utf-8')
-        uni_string = uni_string.encode('ascii')
-        return uni_string
-    except UnicodeEncodeError:
-        # first, replace items from the unicode string
-        for key, val in replacement_map.iteritems():
-           uni_string = re.sub(key, val, uni_string)
+    if isinstance(str, bytes):
+        uni_string = str.decode('utf-8')
+    else:
+        uni_string = str
+
+    if replacement_map is not UTF_MAP:
+        uni_string = uni_string.translate(translate_table(replacement_map))
         try:
-            asc = uni_string.encode('ascii')
+            return uni_string.encode('ascii')
         except UnicodeEncodeError as e:
-            logging.warn(e)
-            asc = uni_string.encode('ascii', errors='ignore')
-        return asc
+            logger.warning('%s', e)
+            return uni_string.encode('ascii', 'ignore')
+
+    try:
+        return uni_string.encode('ascii', 'invoice2data.asciify')
+    except UnicodeEncodeError as e:
+        logger.warning('%s', e)
+        return uni_string.encode('ascii', 'invoice2data.asciify_or_drop')
 
 
 def get_unicode_chars(unicode_string):
@@ -120,6 +171,8 @@ def get_unicode_chars(unicode_string):
    Returns:
        list[str] or NaN: A list of all non-ASCII charecters
    """
+   import numpy as np
+
    try:
        unicode_string.decode('ascii')
        return np.nan
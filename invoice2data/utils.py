@@ -4,13 +4,19 @@ Keep helper functions not related to specific module.
 
 import logging
 
-import yaml
 from collections import OrderedDict
 
+
 # borrowed from http://stackoverflow.com/a/21912744
 def ordered_load(
-        stream, Loader=yaml.Loader, object_pairs_hook=OrderedDict
+        stream, Loader=None, object_pairs_hook=OrderedDict
 ):
+    import yaml
+
+    # libyaml's loader is much faster, if PyYAML was built with it.
+    if Loader is None:
+        Loader = getattr(yaml, 'CLoader', yaml.Loader)
+
     class OrderedLoader(Loader):
         pass
 
@@ -28,6 +28,7 @@ setup(
     entry_points = {
               'console_scripts': [
                   'invoice2data = invoice2data.main:main',
+                  'invoice2data-lint = invoice2data.lint:main',
               ],
           },
     test_suite='nose.collector',